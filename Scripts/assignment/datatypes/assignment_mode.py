@@ -4,6 +4,7 @@ from abc import ABC, abstractmethod
 import numpy
 
 import parameters.assignment as param
+from utils.precision import emme_performance_settings
 from assignment.datatypes.path_analysis import PathAnalysis
 from assignment.datatypes.emme_matrix import EmmeMatrix, PermanentEmmeMatrix
 if TYPE_CHECKING:
@@ -127,7 +128,7 @@ class BikeMode(SoftMode):
                 "relative_gap": 1,
                 "normalized_gap": 1,
             },
-            "performance_settings": param.performance_settings
+            "performance_settings": emme_performance_settings()
         }
 
 
@@ -1,6 +1,7 @@
 from __future__ import annotations
 from typing import Any, Dict, Generator
 import parameters.assignment as param
+from utils.precision import emme_performance_settings
 from assignment.datatypes.car import CarMode
 
 class CarSpecification:
@@ -24,7 +25,7 @@ class CarSpecification:
                 "link_component": param.background_traffic_attr,
                 "add_transit_vehicles": False,
             },
-            "performance_settings": param.performance_settings,
+            "performance_settings": emme_performance_settings(),
             "stopping_criteria": None, # This is defined later
         }
 
@@ -1,13 +1,19 @@
 from __future__ import annotations
-from typing import Any, Dict, List, Tuple, Union, Sequence, cast
+from typing import TYPE_CHECKING, Any, Dict, List, Tuple, Union, Sequence, cast
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import numpy # type: ignore
 
 from datatypes.demand import Demand
 from datatypes.tour import Tour
 import utils.log as log
+from utils.precision import float_dtype
 from assignment.abstract_assignment import AssignmentModel, Period
 import parameters.departure_time as param
 from parameters.assignment import transport_classes, volume_factors
+if TYPE_CHECKING:
+    from datatypes.demand import SecDestDemand
+    from datatypes.population import TourTable
 
 
 class DepartureTimeModel:
@@ -80,7 +86,7 @@ class DepartureTimeModel:
             for tc in modes:
                 if tc in ap.assignment_modes:
                     self.demand[ap.name][tc] = numpy.zeros(
-                        (n, n), numpy.float32)
+                        (n, n), float_dtype())
 
     def add_demand(self, demand: Union[Demand, Tour]):
         """Add demand matrix for whole day.
@@ -118,23 +124,45 @@ class DepartureTimeModel:
                        ass_class: str,
                        time_period: str,
                        mtx: numpy.ndarray,
-                       mtx_pos: Tuple[int, int]):
-        """Slice demand, include transpose and add for one time period. ???types"""
-        r_0 = mtx_pos[0]
-        c_0 = mtx_pos[1]
-        r_n = r_0 + mtx.shape[0]
-        c_n = c_0 + mtx.shape[1]
+                       mtx_pos: Tuple[int, int],
+                       nr_threads: int = 1):
+        """Slice demand, include transpose and add for one time period.
+
+        Parameters
+        ----------
+        demand_share : tuple
+            Demand shares for forward and backward direction
+        ass_class : str
+            Assignment class
+        time_period : str
+            Time period (aht/pt/iht)
+        mtx : numpy.ndarray
+            Demand matrix to add
+        mtx_pos : tuple of int
+            Row and column index where `mtx` is inserted
+        nr_threads : int (optional)
+            Number of threads adding disjoint row stripes
+            of time-period matrix in parallel
+        """
         large_mtx = self.demand[time_period][ass_class]
         vol_fac = volume_factors[ass_class][time_period]
         try:
-            large_mtx[r_0:r_n, c_0:c_n] += vol_fac * demand_share[0] * mtx
-            large_mtx[c_0:c_n, r_0:r_n] += vol_fac * demand_share[1] * mtx.T
+            numpy.broadcast_shapes(numpy.shape(demand_share[0]), mtx.shape)
+            numpy.broadcast_shapes(numpy.shape(demand_share[1]), mtx.T.shape)
         except ValueError:
-            share = param.backup_demand_share[time_period]
-            large_mtx[r_0:r_n, c_0:c_n] += vol_fac * share[0] * mtx
-            large_mtx[c_0:c_n, r_0:r_n] += vol_fac * share[1] * mtx.T
             log.warn("{} {} matrix not matching {} demand shares. Resorted to backup demand shares.".format(
                 mtx.shape, ass_class, len(demand_share[0])))
+            demand_share = param.backup_demand_share[time_period]
+        shares = (vol_fac * demand_share[0], vol_fac * demand_share[1])
+        if nr_threads > 1:
+            stripe = -(-len(large_mtx) // nr_threads)
+            with ThreadPoolExecutor(nr_threads) as pool:
+                list(pool.map(
+                    lambda r: _add_rows(
+                        large_mtx, shares, mtx, mtx_pos, r, r + stripe),
+                    range(0, len(large_mtx), stripe)))
+        else:
+            _add_rows(large_mtx, shares, mtx, mtx_pos, 0, len(large_mtx))
         self.demand[time_period][ass_class] = large_mtx
 
     def _add_3d_demand(self,
@@ -154,6 +182,93 @@ class DepartureTimeModel:
         self._add_2d_demand(share[0], ass_class, tp, mtx, (d1, d2))
         self._add_2d_demand(share[1], ass_class, tp, colsum, (d2, o))
     
+    def add_sec_dest_demand(self, demand: SecDestDemand, nr_threads: int = 1):
+        """Add secondary destination demand for whole day.
+
+        Parameters
+        ----------
+        demand : SecDestDemand
+            Demand accumulated for all origins
+        nr_threads : int (optional)
+            Number of threads adding disjoint row stripes
+            of time-period matrices in parallel
+        """
+        start = demand.purpose.bounds.start
+        for ap in self.assignment_periods:
+            if demand.mode in ap.assignment_modes:
+                share = demand.purpose.demand_share[demand.mode][ap.name]
+                self._add_2d_demand(
+                    share[0], demand.mode, ap.name, demand.matrix,
+                    (start, start), nr_threads)
+                self._add_2d_demand(
+                    share[1], demand.mode, ap.name, demand.orig_matrix,
+                    (start, 0), nr_threads)
+
+    def add_tours(self, tours: TourTable):
+        """Add agent tours for whole day.
+
+        Same as `add_demand()` for each tour, but tour zone indices
+        are collected for all tours and scattered with one
+        `numpy.bincount` per time-period matrix. Demand shares and
+        volume factors are applied once per purpose and mode.
+
+        Parameters
+        ----------
+        tours : datatypes.population.TourTable
+            Tours with modes and destinations chosen
+        """
+        scatter: Dict[Tuple[str, str], Tuple[List, List]] = defaultdict(
+            lambda: ([], []))
+        for purpose, mode, orig, dest, sec_dest in tours.od_groups():
+            has_sec = sec_dest >= 0
+            for ap in self.assignment_periods:
+                if mode not in ap.assignment_modes:
+                    continue
+                tp = ap.name
+                share = purpose.demand_share[mode][tp]
+                self._add_tour_pairs(scatter, share, mode, tp, orig, dest)
+                if "acc" in mode:
+                    egr_mode = mode.replace("acc", "egr")
+                    self._add_tour_pairs(
+                        scatter, purpose.demand_share[egr_mode][tp],
+                        egr_mode, tp, orig[~has_sec], dest[~has_sec])
+                if has_sec.any():
+                    share = purpose.sec_dest_purpose.demand_share[mode][tp]
+                    self._add_tour_pairs(
+                        scatter, share[0], mode, tp,
+                        dest[has_sec], sec_dest[has_sec])
+                    self._add_tour_pairs(
+                        scatter, share[1], mode, tp,
+                        sec_dest[has_sec], orig[has_sec])
+        n = self.nr_zones
+        for (tp, ass_class), (idx, weights) in scatter.items():
+            demand = numpy.bincount(
+                numpy.concatenate(idx), numpy.concatenate(weights),
+                minlength=n*n)
+            self.demand[tp][ass_class] += demand.reshape(n, n).astype(
+                float_dtype(), copy=False)
+
+    def _add_tour_pairs(self,
+                        scatter: Dict[Tuple[str, str], Tuple[List, List]],
+                        demand_share: Any,
+                        ass_class: str,
+                        time_period: str,
+                        rows: numpy.ndarray,
+                        cols: numpy.ndarray):
+        """Collect flat indices and weights of tours and their transposes."""
+        if numpy.ndim(demand_share[0]) > 0 or numpy.ndim(demand_share[1]) > 0:
+            log.warn("Tour {} demand shares not scalar. Resorted to backup demand shares.".format(
+                ass_class))
+            demand_share = param.backup_demand_share[time_period]
+        weight = (Tour.matrix.item()
+                  * volume_factors[ass_class][time_period])
+        idx, weights = scatter[(time_period, ass_class)]
+        n = self.nr_zones
+        idx.append(rows*n + cols)
+        weights.append(numpy.full(len(rows), weight * demand_share[0]))
+        idx.append(cols*n + rows)
+        weights.append(numpy.full(len(rows), weight * demand_share[1]))
+
     def add_vans(self, time_period: str, nr_zones: int):
         """Add vans as a share of private car trips for one time period.
         
@@ -175,6 +290,25 @@ class DepartureTimeModel:
                 (1, 0), "van", time_period, mtx["truck"][0:n, 0:n], (0, 0))
 
 
+def _add_rows(large_mtx: numpy.ndarray,
+              shares: Tuple[Any, Any],
+              mtx: numpy.ndarray,
+              mtx_pos: Tuple[int, int],
+              row_start: int,
+              row_stop: int):
+    """Add matrix and its transpose to rows of larger matrix."""
+    r_0, c_0 = mtx_pos
+    r_n = r_0 + mtx.shape[0]
+    c_n = c_0 + mtx.shape[1]
+    start, stop = max(row_start, r_0), min(row_stop, r_n)
+    if start < stop:
+        large_mtx[start:stop, c_0:c_n] += shares[0] * mtx[start-r_0:stop-r_0]
+    start, stop = max(row_start, c_0), min(row_stop, c_n)
+    if start < stop:
+        large_mtx[start:stop, r_0:r_n] += (shares[1]
+                                           * mtx[:, start-c_0:stop-c_0].T)
+
+
 class DirectDepartureTimeModel (DepartureTimeModel):
     def __init__(self, assignment_model: AssignmentModel):
         self._ass_model = assignment_model
@@ -203,13 +203,17 @@ class MockPeriod(Period):
         with self.matrices.open(
                 mtx_type, self.name, transport_classes=[]) as mtx:
             matrix_list = set(assignment_classes) & set(mtx.matrix_list)
-            matrices = {mode: mtx[mode] for mode in matrix_list}
+            # Matrices are read in blocks when used, so that purposes
+            # only read the part of the matrix within their bounds
+            matrices = {mode: mtx.lazy(
+                    mode, [_InfiniteValueCheck(mtx_type, mode)])
+                for mode in matrix_list}
             new_zone_numbers = mtx.zone_numbers
-        for mode in matrices:
-            if numpy.any(matrices[mode] > 1e10):
-                log.warn(f"Matrix with infinite values: {mtx_type} : {mode}.")
-            idx = numpy.where(numpy.isin(self.zone_numbers, new_zone_numbers))[0]
-            matrices[mode] = matrices[mode][idx[:, None], idx]
+        idx = numpy.where(numpy.isin(self.zone_numbers, new_zone_numbers))[0]
+        if not numpy.array_equal(idx, numpy.arange(len(new_zone_numbers))):
+            for mode in matrices:
+                matrices[mode] = numpy.asarray(
+                    matrices[mode])[idx[:, None], idx]
         return matrices
 
     def get_matrix(self,
@@ -228,6 +232,21 @@ class MockPeriod(Period):
             mtx[ass_class] = matrix
 
 
+class _InfiniteValueCheck:
+    """Warn once if matrix blocks contain infinite values."""
+
+    def __init__(self, mtx_type: str, mode: str):
+        self.mtx_type = mtx_type
+        self.mode = mode
+        self.found = False
+
+    def __call__(self, mtx: numpy.ndarray):
+        if not self.found and numpy.any(mtx > 1e10):
+            self.found = True
+            log.warn(
+                f"Matrix with infinite values: {self.mtx_type} : {self.mode}.")
+
+
 class WholeDayPeriod(MockPeriod):
     def __init__(self, *args, **kwargs):
         MockPeriod.__init__(self, *args, **kwargs)
@@ -0,0 +1,168 @@
+from __future__ import annotations
+import json
+import random
+import shutil
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+import numpy # type: ignore
+
+import utils.log as log
+
+
+class IterationCheckpoint:
+    """Model state at the end of demand model iterations.
+
+    Each iteration is stored in its own directory, with matrices as
+    `.npy` files (loaded memory-mapped) and other state in `state.json`.
+    The directory is written under a temporary name and renamed when
+    complete, so an interrupted save does not leave a broken checkpoint.
+    Only the latest checkpoints are kept, older ones are deleted
+    after a new one has been saved.
+
+    Parameters
+    ----------
+    path : Path
+        Directory where checkpoints are stored
+    nr_kept : int (optional)
+        Number of latest iterations for which checkpoints are kept
+        (at least 1)
+    """
+
+    def __init__(self, path: Path, nr_kept: int = 2):
+        self.path = path
+        self.nr_kept = max(nr_kept, 1)
+
+    def save(self,
+             iteration: int,
+             impedance: Dict[str, Dict[str, Dict[str, numpy.ndarray]]],
+             demand: Dict[str, Dict[str, numpy.ndarray]],
+             convergence: List[Dict[str, float]],
+             mode_share: List[Dict[str, float]]):
+        """Save model state after iteration.
+
+        Parameters
+        ----------
+        iteration : int
+            Number of iteration just completed
+        impedance : dict
+            Time period (aht/pt/iht) : dict
+                Impedance type (time/cost/dist) : dict
+                    Assignment class (car_work/transit_leisure/...) : numpy 2-d matrix
+        demand : dict
+            Time period (aht/pt/iht) : dict
+                Assignment class (car_work/transit_leisure/...) : numpy 2-d matrix
+        convergence : list of dict
+            Demand convergence indicators for each iteration
+        mode_share : list of dict
+            Mode shares for each iteration
+        """
+        target = self._dir(iteration)
+        tmp = target.with_name(target.name + ".tmp")
+        if tmp.exists():
+            shutil.rmtree(tmp)
+        tmp.mkdir(parents=True)
+        state: Dict[str, Any] = {
+            "iteration": iteration,
+            "impedance": {},
+            "demand": {},
+            "convergence": [{key: float(val) for key, val in gap.items()}
+                            for gap in convergence],
+            "mode_share": [{key: float(val) for key, val in shares.items()}
+                           for shares in mode_share],
+            "random_state": random.getstate(),
+        }
+        for tp, tp_imp in impedance.items():
+            state["impedance"][tp] = {}
+            for mtx_type, mtxs in tp_imp.items():
+                state["impedance"][tp][mtx_type] = list(mtxs)
+                self._save_matrices(tmp / "impedance" / tp / mtx_type, mtxs)
+        for tp, mtxs in demand.items():
+            state["demand"][tp] = list(mtxs)
+            self._save_matrices(tmp / "demand" / tp, mtxs)
+        rng_name, keys, pos, has_gauss, cached_gauss = numpy.random.get_state()
+        numpy.save(tmp / "numpy_random_keys.npy", keys)
+        state["numpy_random_state"] = [rng_name, pos, has_gauss, cached_gauss]
+        with open(tmp / "state.json", 'w') as file:
+            json.dump(state, file)
+        if target.exists():
+            shutil.rmtree(target)
+        tmp.rename(target)
+        log.info(f"Checkpoint for iteration {iteration} saved to {target}")
+        self._remove_older(iteration)
+
+    def load(self, iteration: int) -> Tuple[
+            Dict[str, Dict[str, Dict[str, numpy.ndarray]]],
+            Dict[str, Dict[str, numpy.ndarray]],
+            List[Dict[str, float]],
+            List[Dict[str, float]]]:
+        """Load model state saved after iteration.
+
+        Also restores state of random number generators.
+
+        Parameters
+        ----------
+        iteration : int
+            Number of iteration to resume from
+
+        Returns
+        -------
+        dict
+            Time period (aht/pt/iht) : dict
+                Impedance type (time/cost/dist) : dict
+                    Assignment class (car_work/transit_leisure/...) : numpy 2-d matrix
+        dict
+            Time period (aht/pt/iht) : dict
+                Assignment class (car_work/transit_leisure/...) : numpy 2-d matrix
+        list of dict
+            Demand convergence indicators for each iteration
+        list of dict
+            Mode shares for each iteration
+        """
+        source = self._dir(iteration)
+        try:
+            with open(source / "state.json", 'r') as file:
+                state = json.load(file)
+        except FileNotFoundError:
+            msg = f"No checkpoint found for iteration {iteration} in {self.path}"
+            log.error(msg)
+            raise FileNotFoundError(msg)
+        impedance = {tp: {mtx_type: self._load_matrices(
+                    source / "impedance" / tp / mtx_type, ass_classes)
+                for mtx_type, ass_classes in tp_imp.items()}
+            for tp, tp_imp in state["impedance"].items()}
+        demand = {tp: self._load_matrices(source / "demand" / tp, ass_classes)
+            for tp, ass_classes in state["demand"].items()}
+        version, internal_state, gauss_next = state["random_state"]
+        random.setstate((version, tuple(internal_state), gauss_next))
+        rng_name, pos, has_gauss, cached_gauss = state["numpy_random_state"]
+        keys = numpy.load(source / "numpy_random_keys.npy")
+        numpy.random.set_state((rng_name, keys, pos, has_gauss, cached_gauss))
+        log.info(f"Model state restored from {source}")
+        return impedance, demand, state["convergence"], state["mode_share"]
+
+    def _dir(self, iteration: int) -> Path:
+        return self.path / f"iteration_{iteration}"
+
+    def _remove_older(self, iteration: int):
+        for path in self.path.glob("iteration_*"):
+            try:
+                saved_iteration = int(path.name[len("iteration_"):])
+            except ValueError:
+                # Unfinished save
+                continue
+            if saved_iteration <= iteration - self.nr_kept:
+                shutil.rmtree(path)
+                log.debug(f"Old checkpoint {path} removed")
+
+    @staticmethod
+    def _save_matrices(path: Path, matrices: Dict[str, numpy.ndarray]):
+        path.mkdir(parents=True)
+        for ass_class, mtx in matrices.items():
+            numpy.save(path / f"{ass_class}.npy", numpy.asarray(mtx))
+
+    @staticmethod
+    def _load_matrices(path: Path,
+                       ass_classes: List[str]) -> Dict[str, numpy.ndarray]:
+        # Copy-on-write mapping, so matrices can be modified in memory
+        return {ass_class: numpy.load(path / f"{ass_class}.npy", mmap_mode='c')
+            for ass_class in ass_classes}
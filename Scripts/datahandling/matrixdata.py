@@ -1,23 +1,123 @@
 from __future__ import annotations
 import os
 from pathlib import Path
-from typing import TYPE_CHECKING, Optional, Iterable
+from typing import (
+    TYPE_CHECKING, Any, Callable, Dict, List, NamedTuple, Optional, Iterable,
+    Tuple, Union)
+from functools import partial
+import threading
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 import openmatrix as omx # type: ignore
 import numpy # type: ignore
+from numpy.lib.mixins import NDArrayOperatorsMixin # type: ignore
 import pandas
 from contextlib import contextmanager
-from tables.exceptions import NodeError
+import tables # type: ignore
 
 if TYPE_CHECKING:
     from datahandling.zonedata import BaseZoneData
 import utils.log as log
+from utils.precision import float_dtype
 import parameters.assignment as param
 
 
+# PyTables is not thread-safe, so all HDF5 calls are serialized
+hdf5_lock = threading.RLock()
+
+
+class StorageOptions(NamedTuple):
+    """HDF5 storage layout for written OMX files.
+
+    Parameters
+    ----------
+    codec : str (optional)
+        Compression library (zlib/blosc:lz4/blosc:zstd/...) or "none"
+    level : int (optional)
+        Compression level (0-9)
+    chunk_rows : int (optional)
+        Number of matrix rows in one HDF5 chunk,
+        if None, chunk shape is chosen by PyTables
+    """
+    codec: str = "zlib"
+    level: int = 1
+    chunk_rows: Optional[int] = None
+
+    def checked(self) -> StorageOptions:
+        """Validate options, falling back to zlib if codec is not built in.
+
+        Returns
+        -------
+        StorageOptions
+            Options that can be used with installed PyTables
+        """
+        if self.codec != "none" and self.codec not in tables.filters.all_complibs:
+            msg = "Matrix compression {} not supported, use one of {}".format(
+                self.codec, ["none"] + tables.filters.all_complibs)
+            log.error(msg)
+            raise ValueError(msg)
+        if not 0 <= self.level <= 9:
+            msg = f"Matrix compression level {self.level} not in range 0-9"
+            log.error(msg)
+            raise ValueError(msg)
+        if self.chunk_rows is not None and self.chunk_rows < 1:
+            msg = f"Matrix chunk rows {self.chunk_rows} must be positive"
+            log.error(msg)
+            raise ValueError(msg)
+        if self.codec != "none":
+            lib, _, compressor = self.codec.partition(':')
+            if (tables.which_lib_version(lib) is None
+                    or (compressor and compressor not in (
+                        tables.blosc2_compressor_list() if lib == "blosc2"
+                        else tables.blosc_compressor_list()))):
+                log.warn(f"Matrix compression {self.codec} not available, "
+                         + "using zlib instead")
+                return self._replace(codec="zlib")
+        return self
+
+    @property
+    def filters(self) -> tables.Filters:
+        """HDF5 filters for compression."""
+        if self.codec == "none" or self.level == 0:
+            return tables.Filters(complevel=0)
+        return tables.Filters(
+            complevel=self.level, complib=self.codec, shuffle=True)
+
+    def chunkshape(self, shape: Tuple[int, ...]) -> Optional[Tuple[int, ...]]:
+        """HDF5 chunk shape for matrix of given shape."""
+        if self.chunk_rows is None or len(shape) != 2:
+            return None
+        return (min(self.chunk_rows, shape[0]), shape[1])
+
+
 class MatrixData:
-    def __init__(self, path: Path):
+    """Folder of OMX matrix files.
+
+    Files opened read-only are kept open in a handle pool, together with
+    cached metadata (zone numbers, mapping and matrix list), until the
+    file is opened for writing or `close()` is called.
+
+    Parameters
+    ----------
+    path : Path
+        Directory where the OMX files are found
+    storage : StorageOptions (optional)
+        Compression and chunk layout used when writing files
+    """
+    _instances: weakref.WeakSet[MatrixData] = weakref.WeakSet()
+    _writer: MatrixWriter
+
+    def __init__(self, path: Path, storage: Optional[StorageOptions] = None):
         self.path = path
         self.path.mkdir(parents=True, exist_ok=True)
+        self.storage = (StorageOptions() if storage is None
+                        else storage.checked())
+        self._handles: Dict[Path, omx.File] = {}
+        self._metadata: Dict[Path, Dict[str, Any]] = {}
+        MatrixData._instances.add(self)
+        # Pooled handles must be closed also if instance is garbage
+        # collected, as HDF5 does not allow reopening files for writing
+        weakref.finalize(self, MatrixData._close_handles, self._handles)
 
     @contextmanager
     def open(self,
@@ -27,14 +127,225 @@ class MatrixData:
              mapping: Optional[pandas.Series] = None,
              transport_classes: Iterable[str] = param.simple_transport_classes,
              m: str = 'r'):
-        file_name = self.path / (mtx_type + '_' + time_period + ".omx")
+        file_name = self._file_name(mtx_type, time_period)
+        MatrixData._writer.wait_for(file_name)
+        with self._open(
+                file_name, zone_numbers, mapping, transport_classes,
+                m) as mtxfile:
+            yield mtxfile
+
+    def write(self,
+              mtx_type: str,
+              time_period: str,
+              zone_numbers: numpy.ndarray,
+              matrices: Dict[str, numpy.ndarray],
+              copy: bool = True):
+        """Write matrices to new file in background thread.
+
+        Blocks if too many files are already waiting to be written.
+        Errors from earlier writes are raised here or in `join()`.
+
+        Parameters
+        ----------
+        mtx_type : str
+            Type (demand/time/cost/...)
+        time_period : str
+            Time period (aht/pt/iht/vrk/...)
+        zone_numbers : numpy.ndarray
+            Zone numbers to store as mapping
+        matrices : dict
+            key : str
+                Assignment class (car_work/transit_leisure/...)
+            value : numpy.ndarray
+                Matrix to write
+        copy : bool (optional)
+            If False, caller gives up ownership of the arrays,
+            and they must not be modified after this call
+        """
+        if copy:
+            matrices = {key: numpy.array(mtx) for key, mtx in matrices.items()}
+        else:
+            matrices = dict(matrices)
+        MatrixData._writer.submit(
+            self._file_name(mtx_type, time_period), self._write,
+            zone_numbers, matrices)
+
+    @staticmethod
+    def join():
+        """Wait until all background writes are finished.
+
+        Raises the first error occurred in background writing.
+        """
+        MatrixData._writer.join()
+
+    def _file_name(self, mtx_type: str, time_period: str) -> Path:
+        return (self.path / (mtx_type + '_' + time_period + ".omx")).resolve()
+
+    def _write(self, file_name: Path, zone_numbers: numpy.ndarray,
+               matrices: Dict[str, numpy.ndarray]):
+        with self._open(file_name, zone_numbers, m='w') as mtx:
+            for ass_class in list(matrices):
+                mtx[ass_class] = matrices.pop(ass_class)
+
+    @contextmanager
+    def _open(self,
+              file_name: Path,
+              zone_numbers: Optional[numpy.ndarray] = None,
+              mapping: Optional[pandas.Series] = None,
+              transport_classes: Iterable[str] = param.simple_transport_classes,
+              m: str = 'r'):
+        if m == 'r':
+            omx_file = self._get_handle(file_name)
+            metadata = self._metadata[file_name]
+            get_handle = partial(self._read_handle, file_name)
+        else:
+            MatrixData.invalidate(file_name)
+            with hdf5_lock:
+                omx_file = omx.open_file(
+                    file_name, m, filters=self.storage.filters)
+            metadata = {}
+            get_handle = None
         mtxfile = MatrixFile(
-            omx.open_file(file_name, m), zone_numbers, mapping,
-            transport_classes)
+            omx_file, zone_numbers, mapping, transport_classes, metadata,
+            self.storage, get_handle)
         try:
             yield mtxfile
         finally:
-            mtxfile.close()
+            if m != 'r':
+                mtxfile.close()
+
+    def _get_handle(self, file_name: Path) -> omx.File:
+        # Lookup, opening and pooling are done under the same lock,
+        # so concurrent readers do not open the same file twice
+        with hdf5_lock:
+            omx_file = self._handles.get(file_name)
+            if omx_file is None or not omx_file.isopen:
+                omx_file = omx.open_file(file_name, 'r')
+                self._handles[file_name] = omx_file
+                self._metadata[file_name] = {}
+        return omx_file
+
+    def _read_handle(self, file_name: Path) -> omx.File:
+        MatrixData._writer.wait_for(file_name)
+        return self._get_handle(file_name)
+
+    def close(self):
+        """Close all pooled file handles and clear metadata cache."""
+        MatrixData._close_handles(self._handles)
+        self._metadata.clear()
+
+    @staticmethod
+    def _close_handles(handles: Dict[Path, omx.File]):
+        with hdf5_lock:
+            for omx_file in handles.values():
+                omx_file.close()
+            handles.clear()
+
+    @classmethod
+    def invalidate(cls, file_name: Path):
+        """Close pooled handles to file in all `MatrixData` instances.
+
+        Parameters
+        ----------
+        file_name : Path
+            OMX file which is about to be rewritten
+        """
+        for matrices in list(cls._instances):
+            try:
+                omx_file = matrices._handles.pop(file_name)
+            except KeyError:
+                pass
+            else:
+                with hdf5_lock:
+                    omx_file.close()
+                del matrices._metadata[file_name]
+
+
+class MatrixWriter:
+    """Bounded background writer for OMX files.
+
+    Each job writes one whole file in a worker thread. Jobs for the same
+    file are run in submission order.
+
+    Parameters
+    ----------
+    nr_threads : int (optional)
+        Number of worker threads
+    max_pending : int (optional)
+        Maximum number of files waiting to be written
+    """
+
+    def __init__(self, nr_threads: int = 2, max_pending: int = 8):
+        self._nr_threads = nr_threads
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pending: Dict[Path, Future] = {}
+        self._errors: List[BaseException] = []
+
+    def submit(self, file_name: Path, func, *args):
+        """Schedule writing of file.
+
+        Parameters
+        ----------
+        file_name : Path
+            File to be written by `func`
+        func : callable
+            Function taking `file_name` and `args` as arguments
+        """
+        self._raise_errors()
+        self._slots.acquire()
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    self._nr_threads, "matrix_writer")
+            previous = self._pending.get(file_name)
+            future = self._executor.submit(
+                self._run, previous, func, file_name, *args)
+            self._pending[file_name] = future
+        future.add_done_callback(
+            lambda future: self._finish(file_name, future))
+
+    def wait_for(self, file_name: Path):
+        """Wait until pending writes to file are finished."""
+        with self._lock:
+            future = self._pending.get(file_name)
+        if future is not None:
+            wait([future])
+        self._raise_errors()
+
+    def join(self):
+        """Wait until all pending writes are finished."""
+        with self._lock:
+            futures = list(self._pending.values())
+        wait(futures)
+        self._raise_errors()
+
+    @staticmethod
+    def _run(previous: Optional[Future], func, *args):
+        if previous is not None:
+            wait([previous])
+        func(*args)
+
+    def _finish(self, file_name: Path, future: Future):
+        with self._lock:
+            if self._pending.get(file_name) is future:
+                del self._pending[file_name]
+            if future.exception() is not None:
+                self._errors.append(future.exception())
+        self._slots.release()
+
+    def _raise_errors(self):
+        with self._lock:
+            errors = self._errors
+            self._errors = []
+        if errors:
+            msg = "Writing matrices failed in background thread"
+            log.error(msg, errors[0])
+            raise errors[0]
+
+
+MatrixData._writer = MatrixWriter()
 
 
 class MatrixFile:
@@ -42,14 +353,22 @@ class MatrixFile:
                  omx_file: omx.File,
                  zone_numbers: numpy.ndarray,
                  mapping: pandas.Series,
-                 transport_classes: Iterable[str]):
+                 transport_classes: Iterable[str],
+                 metadata: Optional[Dict[str, Any]] = None,
+                 storage: Optional[StorageOptions] = None,
+                 get_handle: Optional[Callable[[], omx.File]] = None):
         self._file = omx_file
+        self._get_handle = get_handle
+        self._storage = StorageOptions() if storage is None else storage
+        self._metadata = {} if metadata is None else metadata
         self.missing_zones = []
+        self._aggregator = None
+        self._reconciliation = None
         if mapping is not None:
             extra_mapping = pandas.Series(zone_numbers, zone_numbers)
             mapping = mapping.combine_first(extra_mapping).astype("int32")
             zone_numbers = mapping.index
-        self._data_zone_mapping = mapping
+            self._aggregator = ZoneAggregator.get(mapping)
         if zone_numbers is None:
             pass
         elif omx_file.mode == 'r':
@@ -61,19 +380,17 @@ class MatrixFile:
                 log.error(msg)
                 raise IndexError(msg)
             if not numpy.array_equal(mtx_numbers, zone_numbers):
-                for i in mtx_numbers:
-                    if i not in zone_numbers:
-                        msg = "Zone number {} from file {} not found in network".format(
-                            i, path)
-                        log.error(msg)
-                        raise IndexError(msg)
-                for i in zone_numbers:
-                    if i not in mtx_numbers:
-                        self.missing_zones.append(i)
+                plan = ZoneReconciliation.get(mtx_numbers, zone_numbers)
+                if plan.extra_zones.size > 0:
+                    msg = "Zone number {} from file {} not found in network".format(
+                        plan.extra_zones[0], path)
+                    log.error(msg)
+                    raise IndexError(msg)
+                self.missing_zones = plan.missing_zones
                 log.warn("Zone number(s) {} missing from file {}{}".format(
                              self.missing_zones, path,
                              ", adding zero row(s) and column(s)"))
-                self.new_zone_numbers = zone_numbers
+                self._reconciliation = plan
             ass_classes = self.matrix_list
             for ass_class in transport_classes:
                 if ass_class not in ass_classes:
@@ -85,10 +402,12 @@ class MatrixFile:
             self.mapping = zone_numbers
     
     def close(self):
-        self._file.close()
+        with hdf5_lock:
+            self._file.close()
     
     def __getitem__(self, mode: str):
-        mtx = numpy.array(self._file[mode])
+        with hdf5_lock:
+            mtx = numpy.array(self._file[mode])
         nr_zones = len(self.zone_numbers)
         dim = (nr_zones, nr_zones)
         if mtx.shape != dim:
@@ -96,6 +415,74 @@ class MatrixFile:
                 mode, self._file.filename, mtx.shape, dim)
             log.error(msg)
             raise IndexError(msg)
+        self._validate(mode, mtx)
+        mtx = self._cast(mtx)
+        if self._reconciliation is not None:
+            mtx = self._reconciliation.expand(mtx)
+        if self._aggregator is not None:
+            mtx = self._aggregator.aggregate(mtx)
+        return mtx
+
+    def lazy(self, mode: str,
+             checks: Iterable[Callable[[numpy.ndarray], None]] = (),
+             block_size: int = 256) -> Union[LazyMatrix, numpy.ndarray]:
+        """Get matrix which is read from file only when indexed.
+
+        Blocks are read from the pooled file handle, so the proxy can be
+        used after the file context is closed. Files with missing zones
+        or zone aggregation cannot be read in blocks, and are read in full.
+
+        Parameters
+        ----------
+        mode : str
+            Assignment class (car_work/transit_leisure/...)
+        checks : iterable of callable (optional)
+            Functions called with every block (or full matrix) read
+        block_size : int (optional)
+            Number of rows and columns in one cached block
+
+        Returns
+        -------
+        LazyMatrix or numpy.ndarray
+            Matrix in network zone order
+        """
+        if (self._get_handle is None or self._reconciliation is not None
+                or self._aggregator is not None):
+            mtx = self[mode]
+            for check in checks:
+                check(mtx)
+            return mtx
+        with hdf5_lock:
+            node = self._file[mode]
+            shape = node.shape
+            dtype = self._cast(numpy.empty(0, node.dtype)).dtype
+        nr_zones = len(self.zone_numbers)
+        dim = (nr_zones, nr_zones)
+        if shape != dim:
+            msg = "Matrix {} in file {} has dimensions {}, should be {}".format(
+                mode, self._file.filename, shape, dim)
+            log.error(msg)
+            raise IndexError(msg)
+        get_handle = self._get_handle
+        def read(rows: slice, cols: slice) -> numpy.ndarray:
+            while True:
+                # Handle is fetched outside lock, as it may wait for writer
+                omx_file = get_handle()
+                with hdf5_lock:
+                    if omx_file.isopen:
+                        mtx = omx_file[mode][rows, cols]
+                        break
+            self._validate(mode, mtx)
+            return self._cast(mtx)
+        return LazyMatrix(read, shape, dtype, block_size, checks)
+
+    @staticmethod
+    def _cast(mtx: numpy.ndarray) -> numpy.ndarray:
+        if mtx.dtype.kind == 'f':
+            return mtx.astype(float_dtype(), copy=False)
+        return mtx
+
+    def _validate(self, mode: str, mtx: numpy.ndarray):
         if numpy.isnan(mtx).any():
             msg = "Matrix {} in file {} contains NA values".format(
                 mode, self._file.filename)
@@ -106,35 +493,330 @@ class MatrixFile:
                 mode, self._file.filename)
             log.error(msg)
             raise ValueError(msg)
-        mtx = pandas.DataFrame(mtx, self.zone_numbers, self.zone_numbers)
-        if self.missing_zones:
-            mtx = mtx.reindex(
-                index=self.new_zone_numbers, columns=self.new_zone_numbers,
-                fill_value=0)
-        if self._data_zone_mapping is not None:
-            for _ in range(2):
-                mtx = mtx.groupby(self._data_zone_mapping).agg("sum").T
-        return mtx.values
 
     def __setitem__(self, mode, data):
-        try:
-            self._file[mode] = data
-        except NodeError:
-            del self._file[mode]
-            self._file[mode] = data
+        data = numpy.asarray(data)
+        with hdf5_lock:
+            if mode in self._file.list_matrices():
+                del self._file[mode]
+            self._file.create_matrix(
+                mode, obj=data, filters=self._storage.filters,
+                chunkshape=self._storage.chunkshape(data.shape))
+        self._metadata.pop("matrix_list", None)
 
     @property
     def zone_numbers(self):
-        return self._file.mapentries("zone_number")
+        try:
+            return self._metadata["zone_numbers"]
+        except KeyError:
+            with hdf5_lock:
+                zone_numbers = self._file.mapentries("zone_number")
+            self._metadata["zone_numbers"] = zone_numbers
+            return zone_numbers
 
     @property
     def mapping(self):
-        return self._file.mapping("zone_number")
+        try:
+            return self._metadata["mapping"]
+        except KeyError:
+            with hdf5_lock:
+                mapping = self._file.mapping("zone_number")
+            self._metadata["mapping"] = mapping
+            return mapping
 
     @mapping.setter
     def mapping(self, zone_numbers):
-        self._file.create_mapping("zone_number", zone_numbers, overwrite=True)
+        with hdf5_lock:
+            self._file.create_mapping(
+                "zone_number", zone_numbers, overwrite=True)
+        self._metadata.pop("zone_numbers", None)
+        self._metadata.pop("mapping", None)
 
     @property
     def matrix_list(self):
-        return self._file.list_matrices()
+        try:
+            return self._metadata["matrix_list"]
+        except KeyError:
+            with hdf5_lock:
+                matrix_list = self._file.list_matrices()
+            self._metadata["matrix_list"] = matrix_list
+            return matrix_list
+
+
+class LazyMatrix(NDArrayOperatorsMixin):
+    """Square matrix which is read in blocks when first needed.
+
+    Indexing with two slices or two integers reads (and caches)
+    only the blocks covering the requested area. Other indexing,
+    `numpy.asarray` and array methods read the whole matrix.
+    Sums, differences, products and quotients with scalars
+    or other lazy matrices are also calculated block by block.
+
+    Parameters
+    ----------
+    read : callable
+        Function taking row slice and column slice, returning numpy.ndarray
+    shape : tuple of int
+        Matrix dimensions
+    dtype : numpy.dtype
+        Data type of matrix
+    block_size : int (optional)
+        Number of rows and columns in one cached block
+    checks : iterable of callable (optional)
+        Functions called with every block read
+    """
+    _elementwise = (numpy.add, numpy.subtract, numpy.multiply, numpy.true_divide)
+
+    def __init__(self,
+                 read: Callable[[slice, slice], numpy.ndarray],
+                 shape: Tuple[int, int],
+                 dtype: numpy.dtype,
+                 block_size: int = 256,
+                 checks: Iterable[Callable[[numpy.ndarray], None]] = ()):
+        self._read = read
+        self.shape = shape
+        self.dtype = numpy.dtype(dtype)
+        self._block_size = block_size
+        self._checks = list(checks)
+        self._blocks: Dict[Tuple[int, int], numpy.ndarray] = {}
+        self._full: Optional[numpy.ndarray] = None
+        # Matrix can be shared between threads (see `PurposeScheduler`),
+        # which must not read the same blocks (or whole matrix) twice
+        self._lock = threading.RLock()
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    @property
+    def nr_blocks_read(self) -> int:
+        """Number of blocks in cache (or all blocks if read in full)."""
+        if self._full is not None:
+            n = -(-self.shape[0] // self._block_size)
+            return n * n
+        return len(self._blocks)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None) -> numpy.ndarray:
+        mtx = self._materialize()
+        return mtx if dtype is None else mtx.astype(dtype, copy=False)
+
+    def __getattr__(self, name: str):
+        # Array methods and attributes (sum, T, astype, ...) use full matrix
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._materialize(), name)
+
+    def __getitem__(self, key):
+        if self._full is not None:
+            return self._full[key]
+        if isinstance(key, tuple) and len(key) == 2:
+            row, col = key
+            if isinstance(row, (int, numpy.integer)) and isinstance(
+                    col, (int, numpy.integer)):
+                row, col = row % self.shape[0], col % self.shape[1]
+                b = self._block_size
+                block = self._block(row // b, col // b)
+                return block[row % b, col % b]
+            if (isinstance(row, slice) and isinstance(col, slice)
+                    and row.step in (None, 1) and col.step in (None, 1)):
+                r0, r1, _ = row.indices(self.shape[0])
+                c0, c1, _ = col.indices(self.shape[1])
+                return self._get(r0, max(r0, r1), c0, max(c0, c1))
+        return self._materialize()[key]
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        if (ufunc in self._elementwise and method == "__call__"
+                and not kwargs
+                and all(isinstance(x, LazyMatrix) or numpy.isscalar(x)
+                        for x in inputs)):
+            if all(x.shape == self.shape for x in inputs
+                    if isinstance(x, LazyMatrix)):
+                def read(rows: slice, cols: slice) -> numpy.ndarray:
+                    return ufunc(*[x[rows, cols] if isinstance(x, LazyMatrix)
+                                   else x for x in inputs])
+                dtype = ufunc(*[numpy.empty(0, x.dtype)
+                                if isinstance(x, LazyMatrix) else x
+                                for x in inputs]).dtype
+                return LazyMatrix(read, self.shape, dtype, self._block_size)
+        inputs = tuple(x._materialize() if isinstance(x, LazyMatrix) else x
+                       for x in inputs)
+        if "out" in kwargs:
+            kwargs["out"] = tuple(
+                x._materialize() if isinstance(x, LazyMatrix) else x
+                for x in kwargs["out"])
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def _materialize(self) -> numpy.ndarray:
+        with self._lock:
+            if self._full is None:
+                self._full = self._get(0, self.shape[0], 0, self.shape[1])
+                self._blocks.clear()
+            return self._full
+
+    def _get(self, r0: int, r1: int, c0: int, c1: int) -> numpy.ndarray:
+        b = self._block_size
+        with self._lock:
+            if self._full is not None:
+                return self._full[r0:r1, c0:c1].copy()
+            mtx = numpy.empty((r1 - r0, c1 - c0), self.dtype)
+            for i in range(r0 // b, -(-r1 // b)):
+                for j in range(c0 // b, -(-c1 // b)):
+                    block = self._block(i, j)
+                    rows = slice(max(r0, i*b), min(r1, (i+1)*b))
+                    cols = slice(max(c0, j*b), min(c1, (j+1)*b))
+                    mtx[rows.start-r0:rows.stop-r0,
+                        cols.start-c0:cols.stop-c0] = (
+                        block[rows.start-i*b:rows.stop-i*b,
+                              cols.start-j*b:cols.stop-j*b])
+            return mtx
+
+    def _block(self, i: int, j: int) -> numpy.ndarray:
+        b = self._block_size
+        with self._lock:
+            if self._full is not None:
+                return self._full[i*b:(i+1)*b, j*b:(j+1)*b]
+            try:
+                return self._blocks[i, j]
+            except KeyError:
+                block = self._read(slice(i*b, min((i+1)*b, self.shape[0])),
+                                   slice(j*b, min((j+1)*b, self.shape[1])))
+                for check in self._checks:
+                    check(block)
+                self._blocks[i, j] = block
+                return block
+
+
+class ZoneReconciliation:
+    """Plan for placing file matrices in network zone order.
+
+    Calculated once per pair of file and network zone numbers,
+    use `ZoneReconciliation.get()` to share it between files.
+
+    Parameters
+    ----------
+    file_zones : numpy.ndarray
+        Zone numbers in file (strictly ascending)
+    network_zones : numpy.ndarray
+        Zone numbers in network
+    """
+    _cache: Dict[Tuple[bytes, bytes], ZoneReconciliation] = {}
+
+    def __init__(self, file_zones: numpy.ndarray,
+                 network_zones: numpy.ndarray):
+        file_zones = numpy.asarray(file_zones)
+        network_zones = numpy.asarray(network_zones)
+        self.nr_zones = len(network_zones)
+        is_found = numpy.isin(file_zones, network_zones)
+        self.extra_zones = file_zones[~is_found]
+        self.missing_zones = network_zones[
+            ~numpy.isin(network_zones, file_zones)].tolist()
+        sorter = numpy.argsort(network_zones, kind="stable")
+        pos = numpy.searchsorted(
+            network_zones, file_zones[is_found], sorter=sorter)
+        self.scatter_index = sorter[pos]
+
+    @classmethod
+    def get(cls, file_zones: numpy.ndarray,
+            network_zones: numpy.ndarray) -> ZoneReconciliation:
+        """Get cached reconciliation plan for zone number pair."""
+        file_zones = numpy.asarray(file_zones)
+        network_zones = numpy.asarray(network_zones)
+        key = (file_zones.tobytes(), network_zones.tobytes())
+        try:
+            return cls._cache[key]
+        except KeyError:
+            plan = cls(file_zones, network_zones)
+            cls._cache[key] = plan
+            return plan
+
+    def expand(self, mtx: numpy.ndarray) -> numpy.ndarray:
+        """Scatter file matrix into zero matrix in network zone order.
+
+        Parameters
+        ----------
+        mtx : numpy.ndarray
+            Square matrix in file zone order
+
+        Returns
+        -------
+        numpy.ndarray
+            Square matrix in network zone order,
+            with zero rows and columns for missing zones
+        """
+        idx = self.scatter_index
+        new_mtx = numpy.zeros((self.nr_zones, self.nr_zones), mtx.dtype)
+        new_mtx[numpy.ix_(idx, idx)] = mtx
+        return new_mtx
+
+
+class ZoneAggregator:
+    """Sparse aggregation operator from data zones to assignment zones.
+
+    Represents the 0/1 mapping matrix P (data zones x assignment zones)
+    as a sort order and group boundaries, so that `P.T @ M @ P`
+    can be calculated with two `numpy.add.reduceat` calls.
+
+    Use `ZoneAggregator.get()` to share one operator between all files
+    and assignment classes using the same mapping.
+
+    Parameters
+    ----------
+    mapping : pandas.Series
+        Mapping between data zones (index) and assignment zones
+    """
+    _cache: Dict[Tuple[bytes, bytes], ZoneAggregator] = {}
+
+    def __init__(self, mapping: pandas.Series):
+        self.zone_numbers, codes = numpy.unique(
+            mapping.values, return_inverse=True)
+        self.is_identity = len(self.zone_numbers) == len(codes)
+        order = numpy.argsort(codes, kind="stable")
+        self._order = (None if (numpy.diff(order) == 1).all()
+                       else order)
+        self._starts = numpy.searchsorted(
+            codes[order], numpy.arange(len(self.zone_numbers)))
+
+    @classmethod
+    def get(cls, mapping: pandas.Series) -> ZoneAggregator:
+        """Get cached aggregation operator for mapping.
+
+        Parameters
+        ----------
+        mapping : pandas.Series
+            Mapping between data zones (index) and assignment zones
+
+        Returns
+        -------
+        ZoneAggregator
+            Operator shared by all callers with identical mapping
+        """
+        key = (mapping.index.values.tobytes(), mapping.values.tobytes())
+        try:
+            return cls._cache[key]
+        except KeyError:
+            aggregator = cls(mapping)
+            cls._cache[key] = aggregator
+            return aggregator
+
+    def aggregate(self, mtx: numpy.ndarray) -> numpy.ndarray:
+        """Aggregate matrix from data zones to assignment zones.
+
+        Parameters
+        ----------
+        mtx : numpy.ndarray
+            Square matrix with rows and columns in mapping index order
+
+        Returns
+        -------
+        numpy.ndarray
+            Square matrix in ascending assignment zone order
+        """
+        if self.is_identity and self._order is None:
+            return mtx
+        if self._order is not None:
+            mtx = mtx[numpy.ix_(self._order, self._order)]
+        mtx = numpy.add.reduceat(mtx, self._starts, axis=0)
+        return numpy.add.reduceat(mtx, self._starts, axis=1)
@@ -0,0 +1,235 @@
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict
+import numpy # type: ignore
+import pandas
+import tables # type: ignore
+try:
+    import pyarrow # type: ignore
+    import pyarrow.parquet # type: ignore
+except ImportError:
+    pyarrow = None
+
+import utils.log as log
+from datahandling.matrixdata import hdf5_lock
+
+
+# Number of records buffered and written at a time
+RECORD_BATCH_SIZE = 2**15
+
+FORMATS = ("columnar", "parquet", "hdf5", "text")
+
+
+def record_writer(path: Path,
+                  fields: Dict[str, Any],
+                  fmt: str = "columnar",
+                  batch_size: int = RECORD_BATCH_SIZE) -> RecordWriter:
+    """Create streaming writer for records.
+
+    Parameters
+    ----------
+    path : Path
+        File path without extension
+    fields : dict
+        key : str
+            Field name
+        value : numpy.dtype
+            Field type (strings as fixed-width unicode, e.g. "U16")
+    fmt : str (optional)
+        File format: "columnar" (Parquet if pyarrow is installed,
+        otherwise HDF5), "parquet", "hdf5" or "text" (tab-separated)
+    batch_size : int (optional)
+        Number of records buffered and written at a time
+
+    Returns
+    -------
+    RecordWriter
+        Writer with file opened
+    """
+    if fmt not in FORMATS:
+        msg = "Record output format {} not in {}".format(fmt, FORMATS)
+        log.error(msg)
+        raise ValueError(msg)
+    if fmt == "parquet" and pyarrow is None:
+        log.warn("Package pyarrow not installed, writing HDF5 instead")
+    if fmt in ("columnar", "parquet"):
+        fmt = "hdf5" if pyarrow is None else "parquet"
+    writer = {
+        "parquet": ParquetRecordWriter,
+        "hdf5": HDF5RecordWriter,
+        "text": TextRecordWriter,
+    }[fmt]
+    return writer(path, fields, batch_size)
+
+
+class RecordWriter(ABC):
+    """Streaming writer of records with fixed fields.
+
+    Records are buffered in typed arrays, and each full batch is
+    written to file, so that memory use does not depend on the
+    total number of records.
+
+    Parameters
+    ----------
+    path : Path
+        File path without extension
+    fields : dict
+        key : str
+            Field name
+        value : numpy.dtype
+            Field type (strings as fixed-width unicode, e.g. "U16",
+            longer values raise ValueError)
+    batch_size : int
+        Number of records buffered and written at a time
+    """
+    extension = ""
+
+    def __init__(self,
+                 path: Path,
+                 fields: Dict[str, Any],
+                 batch_size: int):
+        self.path = path.with_name(path.name + self.extension)
+        self.fields = {name: numpy.dtype(dtype)
+            for name, dtype in fields.items()}
+        for name, dtype in self.fields.items():
+            if dtype.kind == 'U' and dtype.itemsize == 0:
+                msg = f"Width of string field {name} not set"
+                log.error(msg)
+                raise ValueError(msg)
+        self._buffer = {name: numpy.empty(batch_size, dtype)
+            for name, dtype in self.fields.items()}
+        self._batch_size = batch_size
+        self._nr_buffered = 0
+        self.nr_records = 0
+        self._open()
+
+    def append(self, columns: Dict[str, numpy.ndarray]):
+        """Add records.
+
+        Parameters
+        ----------
+        columns : dict
+            key : str
+                Field name
+            value : numpy.ndarray
+                Values of field for records (same length for all fields)
+        """
+        nr_records = len(columns[next(iter(self.fields))])
+        for name, dtype in self.fields.items():
+            # Numpy would silently cut too long strings
+            values = numpy.asarray(columns[name])
+            if (dtype.kind == 'U' and values.dtype.itemsize > dtype.itemsize
+                    and numpy.char.str_len(values).max(initial=0)
+                        > dtype.itemsize // 4):
+                msg = "Value longer than {} characters in field {}".format(
+                    dtype.itemsize // 4, name)
+                log.error(msg)
+                raise ValueError(msg)
+        start = 0
+        while start < nr_records:
+            n = min(self._batch_size - self._nr_buffered, nr_records - start)
+            stop = self._nr_buffered + n
+            for name, buffer in self._buffer.items():
+                buffer[self._nr_buffered:stop] = columns[name][start:start+n]
+            self._nr_buffered = stop
+            start += n
+            if self._nr_buffered == self._batch_size:
+                self._flush_buffer()
+
+    def close(self):
+        """Write remaining records and close file."""
+        self._flush_buffer()
+        self._close()
+        log.debug(f"{self.nr_records} records written to {self.path}")
+
+    def _flush_buffer(self):
+        if self._nr_buffered > 0:
+            self._write({name: buffer[:self._nr_buffered]
+                for name, buffer in self._buffer.items()})
+            self.nr_records += self._nr_buffered
+            self._nr_buffered = 0
+
+    @abstractmethod
+    def _open(self):
+        """Open file for writing."""
+        pass
+
+    @abstractmethod
+    def _write(self, batch: Dict[str, numpy.ndarray]):
+        """Write batch of records (field name : values) to file."""
+        pass
+
+    @abstractmethod
+    def _close(self):
+        """Close file."""
+        pass
+
+
+class ParquetRecordWriter(RecordWriter):
+    """Writer of records to Parquet file, one row group per batch."""
+    extension = ".parquet"
+
+    def _open(self):
+        self._schema = pyarrow.schema([
+            (name, pyarrow.string() if dtype.kind == 'U'
+                   else pyarrow.from_numpy_dtype(dtype))
+            for name, dtype in self.fields.items()])
+        self._file = pyarrow.parquet.ParquetWriter(
+            self.path, self._schema, compression="zstd")
+
+    def _write(self, batch: Dict[str, numpy.ndarray]):
+        self._file.write_table(pyarrow.Table.from_arrays(
+            [pyarrow.array(batch[name]) for name in self.fields],
+            schema=self._schema))
+
+    def _close(self):
+        self._file.close()
+
+
+class HDF5RecordWriter(RecordWriter):
+    """Writer of records to compressed table in HDF5 file.
+
+    Strings are stored as UTF-8 encoded fixed-width bytes.
+    """
+    extension = ".h5"
+
+    def _open(self):
+        # Unicode item size (4 bytes per char) fits any UTF-8 encoding
+        self._dtype = numpy.dtype([
+            (name, f"S{dtype.itemsize}" if dtype.kind == 'U' else dtype)
+            for name, dtype in self.fields.items()])
+        with hdf5_lock:
+            self._file = tables.open_file(self.path, 'w')
+            self._table = self._file.create_table(
+                "/", "records", self._dtype,
+                filters=tables.Filters(complevel=1, complib="zlib"),
+                chunkshape=(min(self._batch_size, 2**14),))
+
+    def _write(self, batch: Dict[str, numpy.ndarray]):
+        records = numpy.empty(len(next(iter(batch.values()))), self._dtype)
+        for name, dtype in self.fields.items():
+            records[name] = (numpy.char.encode(batch[name], "utf-8")
+                             if dtype.kind == 'U' else batch[name])
+        with hdf5_lock:
+            self._table.append(records)
+
+    def _close(self):
+        with hdf5_lock:
+            self._file.close()
+
+
+class TextRecordWriter(RecordWriter):
+    """Writer of records to tab-separated text file, with header."""
+    extension = ".txt"
+
+    def _open(self):
+        self._file = open(self.path, 'w')
+        self._file.write("\t".join(self.fields) + "\n")
+
+    def _write(self, batch: Dict[str, numpy.ndarray]):
+        pandas.DataFrame(batch).to_csv(
+            self._file, sep="\t", header=False, index=False)
+
+    def _close(self):
+        self._file.close()
@@ -9,6 +9,9 @@ os.environ["PROJ_DATA"] = (sys.exec_prefix
 import fiona
 from fiona.crs import from_epsg
 import pandas
+import numpy # type: ignore
+
+from datahandling.recordwriter import record_writer, RecordWriter
 
 
 class ResultsData:
@@ -21,6 +24,7 @@ class ResultsData:
         self._line_buffer: Dict[str, Any] = {}
         self._df_buffer: Dict[str, Any] = {}
         self._xlsx_buffer: Dict[str, Any] = {}
+        self._record_buffer: Dict[str, RecordWriter] = {}
 
     def flush(self):
         """Save to files and empty buffers."""
@@ -35,6 +39,9 @@ class ResultsData:
         for filename in self._xlsx_buffer:
             self._xlsx_buffer[filename].close()
         self._xlsx_buffer = {}
+        for filename in self._record_buffer:
+            self._record_buffer[filename].close()
+        self._record_buffer = {}
 
     def print_data(self,
                    data: Union[pandas.Series, pandas.DataFrame],
@@ -89,6 +96,40 @@ class ResultsData:
             self._line_buffer[filename] = buffer
         buffer.write(line + "\n")
 
+    def print_records(self,
+                      columns: Dict[str, numpy.ndarray],
+                      filename: str,
+                      fields: Dict[str, Any],
+                      fmt: str = "columnar"):
+        """Write batch of records to file (closed when flushing).
+
+        Records are streamed to file in fixed-size batches,
+        so the full set of records need not be held in memory.
+
+        Parameters
+        ----------
+        columns : dict
+            key : str
+                Field name
+            value : numpy.ndarray
+                Values of field for records in batch
+        filename : str
+            Name of file where records are pushed (without file extension)
+        fields : dict
+            key : str
+                Field name
+            value : numpy.dtype
+                Field type (strings as fixed-width unicode, e.g. "U16")
+        fmt : str (optional)
+            File format, see `datahandling.recordwriter.record_writer()`
+        """
+        try:
+            writer = self._record_buffer[filename]
+        except KeyError:
+            writer = record_writer(self.path / filename, fields, fmt)
+            self._record_buffer[filename] = writer
+        writer.append(columns)
+
     def print_matrices(self,
                        data: Dict[str, pandas.DataFrame],
                        filename: str,
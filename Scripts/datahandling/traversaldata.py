@@ -3,6 +3,8 @@ import parameters.assignment as param
 import numpy
 from typing import Dict
 
+from utils.precision import float_dtype
+
 def transform_traversal_data(result_path: Path, zones: list) -> Dict[str, numpy.ndarray]:
     """Processes freight model specific traversal files containing information 
     on amount of transported tons between gate pair as auxiliary demand.
@@ -43,7 +45,7 @@ def read_traversal_file(file: Path, zones: numpy.ndarray):
     numpy matrix
         ass class specific traversal matrix
     """
-    traversal_matrix = numpy.zeros([len(zones), len(zones)], dtype=numpy.float32)
+    traversal_matrix = numpy.zeros([len(zones), len(zones)], dtype=float_dtype())
     with open(file) as f:
         lines = f.readlines()
         for line in lines:
@@ -10,6 +10,7 @@ import json
 
 import parameters.zone as param
 import utils.log as log
+from utils.precision import float_dtype
 from datatypes.zone import Zone, ZoneAggregations, avg
 
 def divide(a, b):
@@ -44,6 +45,7 @@ class ZoneData:
                  extra_dummies: Dict[str, Sequence[str]] = {},
                  car_dist_cost: Optional[float] = None):
         self._values = {}
+        self._revisions: Dict[str, int] = defaultdict(int)
         self.share = ShareChecker(self)
         all_zone_numbers = numpy.array(zone_numbers)
         self.all_zone_numbers = all_zone_numbers
@@ -76,9 +78,9 @@ class ZoneData:
                              car_dist_cost: float):
         self["car_density"].clip(upper=1, inplace=True)
         self.share["share_female"] = pandas.Series(
-            0.5, self.zone_numbers, dtype=numpy.float32)
+            0.5, self.zone_numbers, dtype=float_dtype())
         self.share["share_male"] = pandas.Series(
-            0.5, self.zone_numbers, dtype=numpy.float32)
+            0.5, self.zone_numbers, dtype=float_dtype())
 
         # Convert household shares to population shares
         avg_hh_size = {
@@ -107,14 +109,16 @@ class ZoneData:
         self["log_pop_density"] = numpy.log(self["pop_density"]+1)
 
         # Create diagonal matrix
-        self["within_zone"] = numpy.full((self.nr_zones, self.nr_zones), 0.0)
+        self["within_zone"] = numpy.full(
+            (self.nr_zones, self.nr_zones), 0.0, float_dtype())
         self["within_zone"][numpy.diag_indices(self.nr_zones)] = 1.0
         # Two-way intrazonal distances from building distances
         self["dist"] = data["avg_building_distance"] * 2
         self["time"] = self["dist"] / (20/60) # 20 km/h
         self["cost"] = car_dist_cost * self["dist"]
         # Unavailability of intrazonal tours
-        self["within_zone_inf"] = numpy.full((self.nr_zones, self.nr_zones), 0.0)
+        self["within_zone_inf"] = numpy.full(
+            (self.nr_zones, self.nr_zones), 0.0, float_dtype())
         self["within_zone_inf"][numpy.diag_indices(self.nr_zones)] = numpy.inf
         # Create matrix where value is True if origin and destination is in
         # same municipality
@@ -180,7 +184,45 @@ class ZoneData:
                         key, val, i).capitalize()
                     log.error(msg)
                     raise ValueError(msg)
-        self._values[key] = data.astype(numpy.float32)
+        self.set_values(key, data.astype(float_dtype()))
+
+    def set_values(self, key: str, data: Any):
+        """Set data without validation (e.g., model logsums).
+
+        Parameters
+        ----------
+        key : str
+            Key describing the data (e.g., "hb_work_car")
+        data : pandas.Series or numpy.ndarray
+            Values for all zones
+        """
+        self._values[key] = data
+        self._revisions[key] += 1
+
+    def revision(self, key: str) -> int:
+        """Get number of times data for key has been set.
+
+        Used for invalidating cached values calculated from zone data.
+        For compound keys, the sum of revisions of all parts is returned,
+        so the value increases whenever any part is changed.
+
+        Parameters
+        ----------
+        key : str
+            Key describing the data (e.g., "population")
+
+        Returns
+        -------
+        int
+            Revision number
+        """
+        if key not in self._values:
+            keyl = key.split('*')
+            if len(keyl) == 2:
+                return sum(self.revision(k) for k in keyl)
+            elif "beeline" in key:
+                return self._revisions["beeline"]
+        return self._revisions[key]
 
     def zone_index(self, 
                    zone_number: int) -> int:
@@ -1,9 +1,11 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING, Optional
+import threading
 
 import numpy # type: ignore
 if TYPE_CHECKING:
     from datatypes.purpose import Purpose
+from utils.precision import float_dtype
 import parameters.car as param
 
 
@@ -46,3 +48,93 @@ class Demand:
             return (start, self.purpose.dest_interval.start)
         else:
             return (self.orig, start, start)
+
+
+class SecDestDemand:
+
+    def __init__(self,
+                 purpose: Purpose,
+                 mode: str,
+                 nr_zones: int,
+                 nr_origs: int,
+                 nr_stripes: int = 1):
+        """Day demand for secondary destination purpose.
+
+        Accumulated from blocks of origins, calculated in parallel
+        threads. All threads add to the same matrices, so memory use
+        does not depend on number of threads.
+        Destination -> secondary destination matrix is split in row
+        stripes, which can be updated concurrently. Within each stripe,
+        blocks are added in block order, so that the sum does not
+        depend on thread timing.
+
+        Parameters
+        ----------
+        purpose : Purpose
+            Secondary destination purpose
+        mode : str
+            Assignment class
+        nr_zones : int
+            Number of zones in purpose impedance matrices
+        nr_origs : int
+            Number of origins
+        nr_stripes : int (optional)
+            Number of row stripes
+        """
+        self.purpose = purpose
+        self.mode = mode
+        self.matrix = numpy.zeros((nr_zones, nr_zones), float_dtype())
+        self.orig_matrix = numpy.zeros((nr_zones, nr_origs), float_dtype())
+        stripe_rows = max(-(-nr_zones // nr_stripes), 1)
+        self._stripe_bounds = numpy.append(
+            numpy.arange(0, nr_zones, stripe_rows), nr_zones)
+        self._stripes = [threading.Condition()
+            for _ in range(len(self._stripe_bounds) - 1)]
+        self._next_block = [0] * len(self._stripes)
+        self._cancelled = False
+
+    def add_block(self,
+                  block_nr: int,
+                  origs: slice,
+                  dests: numpy.ndarray,
+                  dest_demand: numpy.ndarray,
+                  orig_demand: numpy.ndarray):
+        """Add demand for block of origins.
+
+        Waits for preceding blocks to be added, stripe by stripe.
+
+        Parameters
+        ----------
+        block_nr : int
+            Order number of block (blocks must be numbered 0, 1, 2, ...)
+        origs : slice
+            Relative origin indices in block
+        dests : numpy.ndarray
+            Sorted destination indices with demand
+        dest_demand : numpy.ndarray
+            Destination -> secondary destination demand
+            (one row for each destination in `dests`)
+        orig_demand : numpy.ndarray
+            Secondary destination -> origin demand
+            (one column for each origin in block)
+        """
+        # Origin blocks are disjoint, so no synchronization is needed
+        self.orig_matrix[:, origs] = orig_demand
+        splits = numpy.searchsorted(dests, self._stripe_bounds)
+        for i, stripe in enumerate(self._stripes):
+            with stripe:
+                stripe.wait_for(
+                    lambda: self._next_block[i] == block_nr or self._cancelled)
+                if self._cancelled:
+                    raise RuntimeError("Demand accumulation cancelled")
+                rows = slice(splits[i], splits[i+1])
+                self.matrix[dests[rows], :] += dest_demand[rows]
+                self._next_block[i] += 1
+                stripe.notify_all()
+
+    def cancel(self):
+        """Release threads waiting for blocks that will not be added."""
+        self._cancelled = True
+        for stripe in self._stripes:
+            with stripe:
+                stripe.notify_all()
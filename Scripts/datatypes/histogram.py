@@ -17,6 +17,12 @@ class TourLengthHistogram:
         self.histogram.iat[numpy.searchsorted(self._u, dist, "right")] += 1
         self.histogram.iat[-1] += dist
 
+    def add_array(self, dists):
+        """Add tours with given distances (same as `add()` for each)."""
+        counts, _ = numpy.histogram(dists, intervals)
+        self.histogram.iloc[:-1] += counts
+        self.histogram.iat[-1] += dists.sum()
+
     def count_tour_dists(self, tours, dists):
         self.histogram.iloc[:-1], _ = numpy.histogram(
             dists, intervals, weights=tours)
@@ -0,0 +1,105 @@
+from __future__ import annotations
+from collections import OrderedDict
+from typing import List, Sequence, Tuple
+import threading
+import numpy # type: ignore
+
+import utils.log as log
+from utils.precision import float_dtype, impedance_cache_bytes
+
+
+class DayImpedanceCache:
+    """Day-averaged impedance matrices, shared between tour purposes.
+
+    Purposes with the same assignment class, time-period impedance
+    shares and zone bounds use the same day-averaged matrix, which is
+    calculated only once per model iteration.
+    Entries are identified by the time-period matrices they are
+    calculated from, so they are never returned for impedances of
+    another iteration. The cache should still be cleared after each
+    iteration, to release the old matrices.
+
+    If the total size of entries exceeds the budget set with
+    "impedance_cache_gb" in `parameters.assignment.performance_settings`,
+    least recently used entries are dropped.
+    """
+
+    def __init__(self):
+        self._entries: OrderedDict[
+            Tuple, Tuple[List[numpy.ndarray], numpy.ndarray]] = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self,
+            ass_class: str,
+            mtx_type: str,
+            rows: slice,
+            cols: slice,
+            sources: Sequence[Tuple[numpy.ndarray, Sequence[float]]]
+            ) -> numpy.ndarray:
+        """Get day-averaged impedance matrix.
+
+        The returned matrix may be shared with other purposes,
+        so it must not be modified in place.
+
+        Parameters
+        ----------
+        ass_class : str
+            Assignment class (car_work/transit_leisure/...)
+        mtx_type : str
+            Impedance type (time/cost/dist)
+        rows : slice
+            Origin zone bounds
+        cols : slice
+            Destination zone bounds
+        sources : list of tuple
+            numpy.ndarray
+                Time-period impedance matrix
+            tuple of float
+                Impedance shares of forward and backward direction
+
+        Returns
+        -------
+        numpy.ndarray
+            Impedance matrix, summed over time periods and directions
+        """
+        key = (ass_class, mtx_type, rows.start, rows.stop,
+               cols.start, cols.stop,
+               tuple((id(imp), tuple(share)) for imp, share in sources))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and all(
+                    cached is imp
+                    for cached, (imp, _) in zip(entry[0], sources)):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        dtype = float_dtype()
+        day_imp = numpy.zeros(
+            (rows.stop - rows.start, cols.stop - cols.start), dtype)
+        for imp, share in sources:
+            day_imp += share[0] * imp[rows, cols].astype(dtype, copy=False)
+            day_imp += share[1] * imp[cols, rows].T.astype(dtype, copy=False)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = ([imp for imp, _ in sources], day_imp)
+                self._nbytes += day_imp.nbytes
+            while self._nbytes > impedance_cache_bytes() and self._entries:
+                _, (_, dropped) = self._entries.popitem(last=False)
+                self._nbytes -= dropped.nbytes
+        return day_imp
+
+    def clear(self):
+        """Drop all entries (after impedances have been updated)."""
+        with self._lock:
+            if self.hits or self.misses:
+                log.debug(
+                    f"Day impedance cache: {self.hits} hits, "
+                    + f"{self.misses} calculated")
+            self._entries.clear()
+            self._nbytes = 0
+            self.hits = 0
+            self.misses = 0
@@ -45,6 +45,7 @@ class Person:
         self.age = random.randint(age_group[0], age_group[1])
         self.age_group = "age_" + str(age_group[0]) + "_" + str(age_group[1])
         self.sex = random.random() < 0.5
+        self.is_car_user = False
         self.tours: List[Tour] = []
         self.generation_model = generation_model
         self._im = income_model
@@ -77,7 +78,7 @@ class Person:
 
     def add_tours(self, 
                   purposes: Dict[str,TourPurpose], 
-                  tour_probs: Dict[str,numpy.ndarray]):
+                  tour_probs: numpy.ndarray):
         """Initilize tour list and add new tours.
 
         Parameters
@@ -87,14 +88,14 @@ class Person:
                 Tour purpose name (hw/ho/...)
             value : datatypes.purpose.TourPurpose
                 The tour purpose object
-        tour_probs : dict
-            Age (age_7-17/...) : tuple
-                Is car user (False/True) : numpy.array
-                    Matrix with cumulative tour combination probabilities
-                    for all zones
+        tour_probs : numpy.ndarray
+            Cumulative tour combination probabilities (population group
+            x zone x combination), see
+            `models.tour_combinations.TourCombinationModel.calc_cumul_prob()`
         """
+        group = self.generation_model.group_index(self.age_group)
         tour_comb_idx = numpy.searchsorted(
-            tour_probs[self.age_group][self.zone.index, :],
+            tour_probs[group, self.zone.index, :],
             self._tour_combination_draw)
         new_tours = list(self.generation_model.tour_combinations[tour_comb_idx])
         old_tours = self.tours
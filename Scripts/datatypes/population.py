@@ -0,0 +1,1322 @@
+from __future__ import annotations
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import (TYPE_CHECKING, Any, Dict, Iterable, Iterator, List,
+                    Optional, Sequence, Tuple, Union)
+import multiprocessing
+import numpy # type: ignore
+
+from datatypes.person import Person
+from datatypes.tour import Tour
+from datatypes.purpose import SEC_DEST_BLOCK_BYTES
+import utils.log as log
+from utils.random_streams import RandomStreams
+from datahandling.recordwriter import RECORD_BATCH_SIZE
+import parameters.zone as param
+from parameters.assignment import assignment_classes, vot_inv
+if TYPE_CHECKING:
+    from datahandling.resultdata import ResultsData
+    from datatypes.purpose import SecDestPurpose, TourPurpose
+    from datatypes.zone import Zone
+    from models.linear import IncomeModel
+    from models.tour_combinations import TourCombinationModel
+
+
+# Size (bytes) of previous and current probability blocks compared at a
+# time in `ChoiceChanges`
+CHOICE_CHANGE_BLOCK_BYTES = 2**23
+
+# Number of persons whose tour combinations are drawn at a time
+TOUR_COMBINATION_BLOCK_ROWS = 2**14
+
+AGE_GROUPS = ["age_{}_{}".format(*age_group) for age_group in param.age_groups]
+
+# Output field types, in the order of `Person.attr` and `Tour.attr`.
+# Strings (str) are sized to their longest value, see `output_fields()`.
+PERSON_FIELDS = {
+    "id": numpy.int64,
+    "age_group": str,
+    "gender": str,
+    "is_car_user": bool,
+    "income": numpy.int64,
+    "number": numpy.int64,
+    "county": str,
+    "municipality": str,
+}
+TOUR_FIELDS = {
+    "person_id": numpy.int64,
+    "purpose_name": str,
+    "mode": str,
+    "total_access": numpy.float64,
+    "sustainable_access": numpy.float64,
+    "cost": numpy.float64,
+    "gen_cost": numpy.float64,
+}
+
+
+def _string_field(values: Iterable[str]) -> str:
+    """Fixed-width unicode type fitting all values."""
+    return "U{}".format(max([len(val) for val in values], default=0) or 1)
+
+
+def stream_ids(zone_number: Union[int, numpy.ndarray],
+               slots: numpy.ndarray) -> numpy.ndarray:
+    """Random stream ids of person slots within home zone.
+
+    Parameters
+    ----------
+    zone_number : int or numpy.ndarray
+        Home zone number (of all slots, or of each slot)
+    slots : numpy.ndarray
+        Numbers of person slots within zone
+
+    Returns
+    -------
+    numpy.ndarray
+        Stream ids (64-bit)
+    """
+    return ((numpy.asarray(zone_number, numpy.uint64) << numpy.uint64(32))
+            + numpy.asarray(slots, numpy.uint64))
+
+
+def searchsorted_columns(cumul: numpy.ndarray,
+                         cols: numpy.ndarray,
+                         values: numpy.ndarray) -> numpy.ndarray:
+    """Find insertion indices of values in columns of matrix.
+
+    Same as `numpy.searchsorted(cumul[:, col], value)` for each
+    (col, value) pair, but as one simultaneous binary search.
+
+    Parameters
+    ----------
+    cumul : numpy.ndarray
+        Matrix with ascending columns (e.g., cumulative probabilities)
+    cols : numpy.ndarray
+        Column index for each value
+    values : numpy.ndarray
+        Values to insert
+
+    Returns
+    -------
+    numpy.ndarray
+        Row index for each value
+    """
+    lo = numpy.zeros(len(cols), numpy.intp)
+    hi = numpy.full(len(cols), len(cumul), numpy.intp)
+    active = numpy.flatnonzero(lo < hi)
+    while len(active) > 0:
+        mid = (lo[active] + hi[active]) // 2
+        below = cumul[mid, cols[active]] < values[active]
+        lo[active[below]] = mid[below] + 1
+        hi[active[~below]] = mid[~below]
+        active = active[lo[active] < hi[active]]
+    return lo
+
+
+class PersonTable:
+    """Columnar store of synthetic population for agent-based simulation.
+
+    One row for each person, with the same attributes and draws as
+    in `Person`, stored as numpy arrays. Choice steps are calculated
+    for the whole population at once.
+
+    All draws come from counter-based random streams, keyed by
+    person stream id (home zone number and number of person
+    within zone) and draw purpose. Tours inherit the stream id of
+    their person. Thus results do not depend on simulation order,
+    and a tour that is chosen again in next iteration keeps its draws.
+
+    Parameters
+    ----------
+    zones : dict
+        key : int
+            Zone index
+        value : Zone
+            Zone object (for output)
+    zone : numpy.ndarray
+        Index of home zone of each person
+    age_group : numpy.ndarray
+        Index of age group in `parameters.zone.age_groups`
+    age : numpy.ndarray
+        Age of each person
+    sex : numpy.ndarray
+        Sex of each person (`Person.FEMALE`/`Person.MALE`)
+    income_model : numpy.ndarray
+        Index of income model in `DemandModel` (1 for Helsinki)
+    generation_model : TourCombinationModel
+        Model used to create tours
+    streams : utils.random_streams.RandomStreams
+        Random streams for all draws
+    stream_id : numpy.ndarray
+        Random stream id of each person (see `stream_ids()`)
+    """
+
+    def __init__(self,
+                 zones: Dict[int, Zone],
+                 zone: numpy.ndarray,
+                 age_group: numpy.ndarray,
+                 age: numpy.ndarray,
+                 sex: numpy.ndarray,
+                 income_model: numpy.ndarray,
+                 generation_model: TourCombinationModel,
+                 streams: RandomStreams,
+                 stream_id: numpy.ndarray):
+        self.zones = zones
+        self.zone = zone
+        self.age_group = age_group
+        self.age = age
+        self.sex = sex
+        self.income_model = income_model
+        self.generation_model = generation_model
+        self.streams = streams
+        self.stream_id = stream_id
+        self.car_use_draw = streams.random(RandomStreams.CAR_USE, stream_id)
+        self.tour_combination_draw = streams.random(
+            RandomStreams.TOUR_COMBINATION, stream_id)
+        self.id = numpy.arange(len(zone))
+        self.is_car_user = numpy.zeros(len(zone), bool)
+        self.income = numpy.zeros(len(zone), int)
+
+    @classmethod
+    def from_persons(cls,
+                     persons: Sequence[Person],
+                     income_models: Sequence[IncomeModel],
+                     generation_model: TourCombinationModel,
+                     streams: RandomStreams) -> PersonTable:
+        """Create table from `Person` objects (with their stream ids)."""
+        table = cls(
+            {person.zone.index: person.zone for person in persons},
+            numpy.array([person.zone.index for person in persons], int),
+            numpy.array([AGE_GROUPS.index(person.age_group)
+                for person in persons], int),
+            numpy.array([person.age for person in persons], int),
+            numpy.array([person.sex for person in persons], bool),
+            numpy.array([[id(model) for model in income_models].index(
+                id(person._im)) for person in persons], int),
+            generation_model, streams,
+            numpy.array([person.stream_id for person in persons],
+                        numpy.uint64))
+        table.id = numpy.array([person.id for person in persons], int)
+        return table
+
+    @classmethod
+    def synthesize(cls,
+                   zones: Sequence[Zone],
+                   weights: numpy.ndarray,
+                   zone_pop: numpy.ndarray,
+                   income_model: numpy.ndarray,
+                   generation_model: TourCombinationModel,
+                   streams: RandomStreams) -> PersonTable:
+        """Create synthetic population for all zones at once.
+
+        Person slots of each zone are drawn to age groups (or to
+        under-7-year-olds, who are left out) with the age group
+        draws of their random streams. Same as drawing age group
+        counts from a multinomial distribution for each zone,
+        but each person keeps their draws if zone population changes.
+
+        Parameters
+        ----------
+        zones : list of Zone
+            Zones where population is created
+        weights : numpy.ndarray
+            Shares of under-7-year-olds and of `parameters.zone.age_groups`
+            (zones x 1+age groups), summing to one for each zone
+        zone_pop : numpy.ndarray
+            Number of person slots (including under-7) in each zone
+        income_model : numpy.ndarray
+            Index of income model for each zone (1 for Helsinki)
+        generation_model : TourCombinationModel
+            Model used to create tours
+        streams : utils.random_streams.RandomStreams
+            Random streams for all draws
+
+        Returns
+        -------
+        PersonTable
+            Persons (7 years and over) ordered by home zone
+        """
+        zone_pop = numpy.asarray(zone_pop, int)
+        zone_rel = numpy.repeat(numpy.arange(len(zones)), zone_pop)
+        slots = (numpy.arange(len(zone_rel))
+                 - numpy.repeat(numpy.cumsum(zone_pop) - zone_pop, zone_pop))
+        ids = stream_ids(
+            numpy.array([zone.number for zone in zones], int)[zone_rel], slots)
+        # Same as `searchsorted(cumul, draw, "right")` for each person,
+        # one age group column at a time
+        cumul = numpy.cumsum(weights, axis=1)
+        draw = streams.random(RandomStreams.AGE_GROUP, ids)
+        age_idx = numpy.zeros(len(ids), int)
+        for j in range(cumul.shape[1]):
+            age_idx += cumul[zone_rel, j] <= draw
+        # Group -1 is under-7-year-olds
+        age_idx = numpy.minimum(age_idx, cumul.shape[1] - 1) - 1
+        is_person = age_idx >= 0
+        ids = ids[is_person]
+        zone_rel = zone_rel[is_person]
+        age_idx = age_idx[is_person]
+        lower, upper = numpy.array(param.age_groups, int).T
+        age = lower[age_idx] + (streams.random(RandomStreams.AGE, ids)
+            * (upper - lower + 1)[age_idx]).astype(int)
+        sex = streams.random(RandomStreams.SEX, ids) < 0.5
+        zone_index = numpy.array([zone.index for zone in zones], int)
+        table = cls(
+            {zone.index: zone for zone in zones}, zone_index[zone_rel],
+            age_idx, age, sex, numpy.asarray(income_model, int)[zone_rel],
+            generation_model, streams, ids)
+        table.id = Person.id_counter + numpy.arange(len(table))
+        Person.id_counter += len(table)
+        return table
+
+    def to_persons(self, income_models: Sequence[IncomeModel]
+                   ) -> List[Person]:
+        """Create `Person` objects with same attributes and stream ids.
+
+        Parameters
+        ----------
+        income_models : list of IncomeModel
+            Income models, indexed by `self.income_model`
+
+        Returns
+        -------
+        list of Person
+            Persons, in same order as in table
+        """
+        persons = []
+        for i in range(len(self)):
+            person = Person(
+                self.zones[self.zone[i]], param.age_groups[self.age_group[i]],
+                self.generation_model, income_models[self.income_model[i]])
+            person.id = self.id[i]
+            person.age = self.age[i]
+            person.sex = self.sex[i]
+            person.is_car_user = self.is_car_user[i]
+            person.stream_id = self.stream_id[i]
+            persons.append(person)
+        return persons
+
+    def __len__(self) -> int:
+        return len(self.zone)
+
+    def take(self, rows: Union[slice, numpy.ndarray]) -> PersonTable:
+        """Get table with subset of persons (e.g., for one partition)."""
+        table = PersonTable.__new__(PersonTable)
+        for key, val in self.__dict__.items():
+            if isinstance(val, numpy.ndarray):
+                val = val[rows]
+            setattr(table, key, val)
+        return table
+
+    def decide_car_use(self, car_use_model):
+        """Decide whether persons are car users.
+
+        Same as drawing against `car_use_model.calc_individual_prob()`
+        for each person, but calculated once per (age group, gender).
+
+        Parameters
+        ----------
+        car_use_model : models.logit.CarUseModel
+            Model with probabilities already calculated (`calc_basic_prob()`)
+        """
+        prob = numpy.zeros(len(self))
+        for i, age_group in enumerate(AGE_GROUPS):
+            for sex in (Person.FEMALE, Person.MALE):
+                rows = numpy.flatnonzero(
+                    (self.age_group == i) & (self.sex == sex))
+                if len(rows) > 0:
+                    gender = "female" if sex == Person.FEMALE else "male"
+                    zone_prob = numpy.asarray(
+                        car_use_model.calc_individual_prob(age_group, gender))
+                    prob[rows] = zone_prob[self.zone[rows]]
+        self.is_car_user = (self.age >= 18) & (self.car_use_draw < prob)
+
+    def add_tours(self,
+                  purposes: Dict[str, TourPurpose],
+                  tour_probs: numpy.ndarray) -> TourTable:
+        """Create tour table (same as `Person.add_tours()` for all persons).
+
+        Tours that are chosen again for same person (same purpose,
+        same occurrence, same source tour) get the same draws
+        as in previous iteration, like recycled `Tour` objects.
+
+        Parameters
+        ----------
+        purposes : dict
+            key : str
+                Tour purpose name (hw/ho/...)
+            value : datatypes.purpose.TourPurpose
+                The tour purpose object
+        tour_probs : numpy.ndarray
+            Cumulative tour combination probabilities (population group
+            x zone x combination), see
+            `models.tour_combinations.TourCombinationModel.calc_cumul_prob()`
+
+        Returns
+        -------
+        TourTable
+            New tours
+        """
+        names = list(purposes)
+        combinations = self.generation_model.tour_combinations
+        comb_idx = numpy.zeros(len(self), int)
+        for start in range(0, len(self), TOUR_COMBINATION_BLOCK_ROWS):
+            rows = slice(start, start + TOUR_COMBINATION_BLOCK_ROWS)
+            # Population group index is age group index, as in
+            # `TourCombinationModel.group_index()`
+            cumul = tour_probs[self.age_group[rows], self.zone[rows]]
+            comb_idx[rows] = (cumul < self.tour_combination_draw[
+                rows, numpy.newaxis]).sum(1)
+        # Flatten combinations to purpose indices
+        comb_len = numpy.array([len(c) for c in combinations], int)
+        comb_start = numpy.cumsum(comb_len) - comb_len
+        comb_purpose = numpy.array(
+            [names.index(name) for c in combinations for name in c], int)
+        comb_occurrence = numpy.array(
+            [c[:i].count(name) for c in combinations
+             for i, name in enumerate(c)], int)
+        counts = comb_len[comb_idx]
+        person = numpy.repeat(numpy.arange(len(self)), counts)
+        idx = (numpy.repeat(comb_start[comb_idx] - numpy.cumsum(counts)
+                            + counts, counts)
+               + numpy.arange(counts.sum()))
+        home = TourTable(
+            purposes, self, person, comb_purpose[idx], comb_occurrence[idx],
+            numpy.full(len(person), -1))
+        return home.add_non_home_tours()
+
+    def calc_income(self, income_models: Sequence[IncomeModel]):
+        """Calculate income (same as `Person.calc_income()` for all persons).
+
+        Parameters
+        ----------
+        income_models : list of IncomeModel
+            Income models, indexed by `self.income_model`
+        """
+        zone_numbers = numpy.zeros(max(self.zones) + 1, int)
+        for i, zone in self.zones.items():
+            zone_numbers[i] = zone.number
+        self.income = numpy.zeros(len(self), int)
+        for i, model in enumerate(income_models):
+            rows = numpy.flatnonzero((self.income_model == i) & (self.age >= 17))
+            b = model.param
+            log_income = model.log_income[
+                zone_numbers[self.zone[rows]]].to_numpy(float)
+            for sex, gender in ((Person.FEMALE, "female"), (Person.MALE, "male")):
+                if gender in b:
+                    log_income[self.sex[rows] == sex] += b[gender]
+            for j, age_group in enumerate(AGE_GROUPS):
+                if age_group in b["age_dummies"]:
+                    log_income[self.age_group[rows] == j] += (
+                        b["age_dummies"][age_group])
+            log_income += b["standard_deviation"] * self.streams.normal(
+                RandomStreams.INCOME, self.stream_id[rows])
+            self.income[rows] = numpy.exp(log_income).astype(int)
+
+    def output_fields(self) -> Dict[str, Any]:
+        """Get `PERSON_FIELDS` with string widths fitting person data."""
+        fields = dict(PERSON_FIELDS)
+        fields["age_group"] = _string_field(AGE_GROUPS)
+        fields["gender"] = _string_field(("female", "male"))
+        for attr in ("county", "municipality"):
+            fields[attr] = _string_field(
+                str(getattr(z, attr)) for z in self.zones.values())
+        return fields
+
+    def output_columns(self, rows: slice) -> Dict[str, numpy.ndarray]:
+        """Get `Person.attr` of persons as columns (see `output_fields()`)."""
+        fields = self.output_fields()
+        zone = self.zone[rows]
+        columns = {
+            "id": self.id[rows],
+            "age_group": numpy.array(AGE_GROUPS, fields["age_group"])[
+                self.age_group[rows]],
+            "gender": numpy.where(
+                self.sex[rows] == Person.FEMALE, "female", "male"
+                ).astype(fields["gender"]),
+            "is_car_user": self.is_car_user[rows],
+            "income": self.income[rows],
+        }
+        for attr in Person.zone_attr:
+            lookup = numpy.empty(max(self.zones) + 1, fields[attr])
+            for i, z in self.zones.items():
+                lookup[i] = getattr(z, attr)
+            columns[attr] = lookup[zone]
+        return columns
+
+    def print_records(self, resultdata: ResultsData, filename: str,
+                      fmt: str = "columnar"):
+        """Stream person attributes to file, one batch at a time.
+
+        Parameters
+        ----------
+        resultdata : datahandling.resultdata.ResultsData
+            Result data container (file is closed when flushing)
+        filename : str
+            Name of file (without file extension)
+        fmt : str (optional)
+            File format, see `datahandling.recordwriter.record_writer()`
+        """
+        fields = self.output_fields()
+        for start in range(0, len(self), RECORD_BATCH_SIZE):
+            resultdata.print_records(
+                self.output_columns(slice(start, start + RECORD_BATCH_SIZE)),
+                filename, fields, fmt)
+
+    def views(self) -> Iterator[PersonView]:
+        """Iterate over persons as `Person`-like objects (for output)."""
+        for i in range(len(self)):
+            yield PersonView(self, i)
+
+
+class TourTable:
+    """Columnar store of agent tours.
+
+    One row for each tour, with the same attributes and draws as
+    in `Tour`, stored as numpy arrays. Non-home tours are located
+    right after their source tour. Modes are stored as indices of
+    `purpose.modes` and zones as zone indices (-1 if not chosen).
+
+    Parameters
+    ----------
+    purposes : dict
+        key : str
+            Tour purpose name (hw/ho/...)
+        value : datatypes.purpose.TourPurpose
+            The tour purpose object
+    persons : PersonTable
+        Persons making the tours
+    person : numpy.ndarray
+        Row of person in `persons`
+    purpose : numpy.ndarray
+        Index of tour purpose in `purposes`
+    occurrence : numpy.ndarray
+        Number of preceding tours of same purpose and source purpose
+        in person's tour combination
+    source : numpy.ndarray
+        Row of source tour (-1 if home-based)
+    """
+    # Non-home tours generated from home-based tours,
+    # in the same order as in `Person.add_tours()`
+    work_based = ("wb_business", "wb_other")
+    other_based = "ob_other"
+
+    def __init__(self,
+                 purposes: Dict[str, TourPurpose],
+                 persons: PersonTable,
+                 person: numpy.ndarray,
+                 purpose: numpy.ndarray,
+                 occurrence: numpy.ndarray,
+                 source: numpy.ndarray):
+        self.purposes = purposes
+        self.purpose_list = list(purposes.values())
+        self.persons = persons
+        self.person = person
+        self.purpose = purpose
+        self.occurrence = occurrence
+        self.source = source
+        self.src_purpose = numpy.where(source >= 0, purpose[source], -1)
+        n = len(person)
+        self.orig = persons.zone[person]
+        self.mode = numpy.full(n, -1)
+        self.dest = numpy.full(n, -1)
+        self.sec_dest = numpy.full(n, -1)
+        self.needs_sec_dest = numpy.zeros(n, bool)
+        self.total_access = numpy.zeros(n)
+        self.cost = numpy.zeros(n)
+        self.gen_cost = numpy.zeros(n)
+        max_modes = max(len(p.modes) for p in self.purpose_list)
+        streams = persons.streams
+        ids = persons.stream_id[person]
+        codes = self._codes()
+        self.mode_draw = streams.gumbel(
+            RandomStreams.MODE, ids, codes, max_modes)
+        self.dest_draw = streams.random(RandomStreams.DEST, ids, codes)
+        self.sec_dest_gen_draw = streams.random(
+            RandomStreams.SEC_DEST_GEN, ids, codes)
+        self.sec_dest_draw = streams.random(RandomStreams.SEC_DEST, ids, codes)
+        self.non_home_draw = streams.random(
+            RandomStreams.NON_HOME, ids, codes, len(self.work_based))
+        self.statistics = TourStatistics()
+
+    def __len__(self) -> int:
+        return len(self.person)
+
+    def _codes(self) -> numpy.ndarray:
+        """Identify tours within person.
+
+        Code is based on purpose, source tour purpose and occurrence.
+        """
+        nr_purposes = len(self.purpose_list)
+        max_occurrence = max(
+            [len(c) for c in self.persons.generation_model.tour_combinations]
+            + [1])
+        return ((self.purpose * (nr_purposes+1) + self.src_purpose + 1)
+                * max_occurrence + self.occurrence)
+
+    def add_non_home_tours(self) -> TourTable:
+        """Add non-home tours generated from (these) home-based tours.
+
+        Returns
+        -------
+        TourTable
+            Home-based and non-home tours
+        """
+        names = list(self.purposes)
+        # Non-home tour generation probabilities for each home purpose
+        gen_prob = numpy.zeros((len(names), len(self.work_based)))
+        non_home_purpose = numpy.zeros((len(names), len(self.work_based)), int)
+        for i, purpose in enumerate(self.purpose_list):
+            if i not in self.purpose:
+                continue
+            if purpose.name == "hb_work":
+                for j, name in enumerate(self.work_based):
+                    gen_prob[i, j] = self.purposes[name].gen_model.param[
+                        purpose.name]
+                    non_home_purpose[i, j] = names.index(name)
+            else:
+                gen_prob[i, 0] = self.purposes[self.other_based].gen_model.param[
+                    purpose.name]
+                non_home_purpose[i, 0] = names.index(self.other_based)
+        is_generated = self.non_home_draw < gen_prob[self.purpose]
+        home_idx, slot = is_generated.nonzero()
+        n = len(self)
+        # Non-home tours are placed right after their source tour
+        order = numpy.argsort(numpy.concatenate(
+            [numpy.arange(n) * 3, home_idx*3 + slot + 1]), kind="stable")
+        position = numpy.empty(len(order), int)
+        position[order] = numpy.arange(len(order))
+        combined = TourTable(
+            self.purposes, self.persons,
+            numpy.concatenate([self.person, self.person[home_idx]])[order],
+            numpy.concatenate([
+                self.purpose, non_home_purpose[self.purpose[home_idx], slot]
+                ])[order],
+            numpy.concatenate([self.occurrence, self.occurrence[home_idx]])[order],
+            numpy.concatenate([
+                numpy.full(n, -1), position[home_idx]])[order])
+        return combined
+
+    def mode_names(self, name: str) -> numpy.ndarray:
+        """Boolean array of tours with given mode name."""
+        is_mode = numpy.zeros(len(self), bool)
+        for i, purpose in enumerate(self.purpose_list):
+            if name in purpose.modes:
+                is_mode |= ((self.purpose == i)
+                            & (self.mode == purpose.modes.index(name)))
+        return is_mode
+
+    def choose_modes(self):
+        """Choose tour modes (same as `Tour.choose_mode()` for all tours).
+
+        Assumes tour purpose models have already calculated
+        mode utilities. Home-based tours are chosen first,
+        as non-home tour mode depends on source tour mode.
+        Purpose tour counts are not updated here (see `count_tours()`).
+        """
+        is_car_user = self.persons.is_car_user[self.person]
+        is_home = self.source < 0
+        for home in (True, False):
+            for i, purpose in enumerate(self.purpose_list):
+                rows = numpy.flatnonzero((self.purpose == i) & (is_home == home))
+                if len(rows) == 0:
+                    continue
+                if home:
+                    groups = [(None, rows[~is_car_user[rows]]),
+                              ("car_users", rows[is_car_user[rows]])]
+                else:
+                    src = self.source[rows]
+                    groups = []
+                    for j, src_purpose in enumerate(self.purpose_list):
+                        for k, src_mode in enumerate(src_purpose.modes):
+                            group = rows[(self.purpose[src] == j)
+                                         & (self.mode[src] == k)]
+                            groups.append((
+                                f"{purpose.name}_parent_{src_mode}_share",
+                                group))
+                self._choose_modes(purpose, groups)
+
+    def _choose_modes(self, purpose: TourPurpose, groups: List[Any]):
+        nr_modes = len(purpose.modes)
+        for dummy, rows in groups:
+            if len(rows) == 0:
+                continue
+            utils = purpose.model.calc_individual_mode_utils(
+                self.orig[rows], dummy) + self.mode_draw[rows, :nr_modes]
+            mode_idx = utils.argmax(1)
+            self.mode[rows] = mode_idx
+            self.total_access[rows] = (-purpose.model.money_utility
+                * utils[numpy.arange(len(rows)), mode_idx])
+
+    def choose_destinations(self):
+        """Choose primary destinations (same as `Tour.choose_destination()`).
+
+        Assumes tour purpose models have already calculated
+        cumulative destination probabilities. Tours are marked for
+        secondary destination choice (`self.needs_sec_dest`).
+        Purpose tour counts are not updated here (see `count_tours()`).
+        """
+        for i, purpose in enumerate(self.purpose_list):
+            for m, mode in enumerate(purpose.modes):
+                rows = numpy.flatnonzero((self.purpose == i) & (self.mode == m))
+                if len(rows) == 0:
+                    continue
+                orig = self.orig[rows]
+                orig_rel = orig - purpose.bounds.start
+                dest = searchsorted_columns(
+                    purpose.model.cumul_dest_prob[mode], orig_rel,
+                    self.dest_draw[rows])
+                self.dest[rows] = dest
+                self.needs_sec_dest[rows] = self._is_sec_dest_tour(
+                    purpose, mode, orig, dest, rows)
+
+    def count_tours(self):
+        """Add tours with chosen mode and destination to purpose counts.
+
+        Generated and attracted tours are added directly.
+        Tour lengths, aggregates and within-zone tours are recorded
+        in `self.statistics`, to be built at end of iteration.
+        """
+        for purpose, mode, orig, dest, _ in self.od_groups():
+            generated = purpose.generated_tours[mode]
+            generated += numpy.bincount(
+                orig, minlength=len(generated)).astype(generated.dtype)
+            attracted = purpose.attracted_tours[mode]
+            attracted += numpy.bincount(
+                dest, minlength=len(attracted)).astype(attracted.dtype)
+            self.statistics.record(purpose, mode, orig, dest)
+
+    def _is_sec_dest_tour(self, purpose: TourPurpose, mode: str,
+                          orig: numpy.ndarray, dest: numpy.ndarray,
+                          rows: numpy.ndarray) -> numpy.ndarray:
+        if (getattr(purpose, "sec_dest_purpose", None) is None
+                or mode in ("walk", "car_pax")):
+            return numpy.zeros(len(rows), bool)
+        bounds = purpose.sec_dest_purpose.bounds
+        prob = purpose.sec_dest_purpose.gen_model.param[purpose.name][mode]
+        return ((bounds.start <= orig) & (orig < bounds.stop)
+                & (bounds.start <= dest) & (dest < bounds.stop)
+                & (self.sec_dest_gen_draw[rows] < prob))
+
+    def choose_secondary_destinations(self,
+                                      purpose: SecDestPurpose,
+                                      mode: str,
+                                      impedance: Dict[str, numpy.ndarray]):
+        """Choose secondary destinations for tours of one mode.
+
+        Same as `Tour.choose_secondary_destination()` for all tours
+        marked in `choose_destinations()`. Work-tour modes
+        (e.g., "car_work") are included in corresponding leisure mode.
+
+        Parameters
+        ----------
+        purpose : SecDestPurpose
+            Secondary destination purpose
+        mode : str
+            Mode (car_leisure/transit_leisure/...)
+        impedance : dict
+            Type (time/cost/dist) : numpy 2d matrix
+        """
+        is_mode = self.mode_names(mode)
+        if "leisure" in mode:
+            is_mode |= self.mode_names(mode.replace("leisure", "work"))
+        rows = numpy.flatnonzero(self.needs_sec_dest & is_mode)
+        if len(rows) == 0:
+            return
+        start = purpose.bounds.start
+        nr_zones = next(iter(impedance.values())).shape[1]
+        pair_key = (self.orig[rows] - start) * nr_zones + self.dest[rows] - start
+        pairs, pair_idx = numpy.unique(pair_key, return_inverse=True)
+        sec_dest = numpy.empty(len(rows), int)
+        block_size = max(SEC_DEST_BLOCK_BYTES // (8*nr_zones), 1)
+        for block_start in range(0, len(pairs), block_size):
+            block = pairs[block_start:block_start+block_size]
+            in_block = numpy.flatnonzero(
+                (pair_idx >= block_start)
+                & (pair_idx < block_start + len(block)))
+            cumul = purpose.calc_sec_dest_prob(
+                mode, impedance, block // nr_zones, block % nr_zones
+                ).cumsum(axis=0)
+            sec_dest[in_block] = start + searchsorted_columns(
+                cumul, pair_idx[in_block] - block_start,
+                self.sec_dest_draw[rows[in_block]])
+        self.sec_dest[rows] = sec_dest
+        # Work-tour modes are all assigned as leisure trips
+        attracted = purpose.attracted_tours[mode]
+        attracted += numpy.bincount(
+            sec_dest, minlength=len(attracted)).astype(attracted.dtype)
+
+    def calc_cost(self,
+                  impedance: Dict[str, Dict[str, Dict[str, numpy.ndarray]]]):
+        """Calculate tour costs (same as `Tour.calc_cost()` for all tours).
+
+        Parameters
+        ----------
+        impedance: dict
+            Time period (aht/pt/iht) : dict
+                Type (time/cost/dist) : dict
+                    Assignment class (car_work/transit/...) : numpy 2d matrix
+        """
+        for i, purpose in enumerate(self.purpose_list):
+            demand_type = assignment_classes[purpose.name]
+            periods = (("aht", "iht", "iht") if demand_type == "work"
+                       else ("pt", "pt", "pt"))
+            vot = 1 / vot_inv[demand_type]
+            for m, mode in enumerate(purpose.modes):
+                rows = numpy.flatnonzero((self.purpose == i) & (self.mode == m))
+                if len(rows) == 0:
+                    continue
+                time = self._get_cost(impedance, periods, "time", mode, rows)
+                self.cost[rows] = self._get_cost(
+                    impedance, periods, "cost", mode, rows)
+                self.gen_cost[rows] = self.cost[rows] + time*vot
+
+    def _get_cost(self, impedance, periods: Sequence[str], mtx_type: str,
+                  mode: str, rows: numpy.ndarray) -> numpy.ndarray:
+        cost = numpy.zeros(len(rows))
+        try:
+            departure_imp, sec_dest_imp, return_imp = (
+                impedance[tp][mtx_type][mode] for tp in periods)
+        except KeyError:
+            # bike and walk modes do not have cost matrices specified
+            return cost
+        orig = self.orig[rows]
+        dest = self.dest[rows]
+        sec_dest = self.sec_dest[rows]
+        has_sec = sec_dest >= 0
+        cost += departure_imp[orig, dest]
+        cost[has_sec] += sec_dest_imp[dest[has_sec], sec_dest[has_sec]]
+        cost[has_sec] += return_imp[sec_dest[has_sec], orig[has_sec]]
+        cost[~has_sec] += return_imp[dest[~has_sec], orig[~has_sec]]
+        return cost
+
+    def od_groups(self) -> Iterator[Tuple[
+            TourPurpose, str, numpy.ndarray, numpy.ndarray, numpy.ndarray]]:
+        """Iterate over zone indices of tours, grouped by purpose and mode.
+
+        Yields
+        ------
+        TourPurpose
+            Tour purpose
+        str
+            Mode (car_work/transit_leisure/...)
+        numpy.ndarray
+            Origin zone indices
+        numpy.ndarray
+            Destination zone indices
+        numpy.ndarray
+            Secondary destination zone indices (-1 if none)
+        """
+        for i, purpose in enumerate(self.purpose_list):
+            for m, mode in enumerate(purpose.modes):
+                rows = numpy.flatnonzero((self.purpose == i) & (self.mode == m))
+                if len(rows) > 0:
+                    yield (purpose, mode, self.orig[rows], self.dest[rows],
+                           self.sec_dest[rows])
+
+    def columns(self) -> Dict[str, numpy.ndarray]:
+        """Get all tour columns (e.g., for returning from worker process)."""
+        return {key: val for key, val in self.__dict__.items()
+            if isinstance(val, numpy.ndarray) and len(val) == len(self)}
+
+    def take_columns(self, is_selected: numpy.ndarray
+                     ) -> Dict[str, numpy.ndarray]:
+        """Get columns of subset of tours, with source rows renumbered.
+
+        Source tours of selected non-home tours must also be selected
+        (e.g., when selecting all tours of some persons).
+        """
+        columns = {key: val[is_selected]
+            for key, val in self.columns().items()}
+        position = numpy.cumsum(is_selected) - 1
+        columns["source"] = numpy.where(
+            columns["source"] >= 0, position[columns["source"]], -1)
+        return columns
+
+    @classmethod
+    def concatenate(cls,
+                    purposes: Dict[str, TourPurpose],
+                    persons: PersonTable,
+                    parts: Sequence[Tuple[int, Dict[str, numpy.ndarray]]]
+                    ) -> TourTable:
+        """Concatenate tables simulated for partitions of population.
+
+        Parameters
+        ----------
+        purposes : dict
+            key : str
+                Tour purpose name (hw/ho/...)
+            value : datatypes.purpose.TourPurpose
+                The tour purpose object
+        persons : PersonTable
+            Whole population
+        parts : list of tuple
+            int
+                First row of partition in `persons`
+            dict
+                Tour columns of partition (see `columns()`)
+
+        Returns
+        -------
+        TourTable
+            Tours of whole population
+        """
+        table = cls.__new__(cls)
+        table.purposes = purposes
+        table.purpose_list = list(purposes.values())
+        table.persons = persons
+        table.statistics = TourStatistics()
+        columns: Dict[str, List[numpy.ndarray]] = defaultdict(list)
+        nr_tours = 0
+        for person_start, part in parts:
+            part["person"] = part["person"] + person_start
+            part["source"] = numpy.where(
+                part["source"] >= 0, part["source"] + nr_tours, -1)
+            nr_tours += len(part["person"])
+            for key, val in part.items():
+                columns[key].append(val)
+        for key, vals in columns.items():
+            setattr(table, key, numpy.concatenate(vals))
+        return table
+
+    def output_fields(self) -> Dict[str, Any]:
+        """Get `TOUR_FIELDS` with string widths fitting tour data."""
+        fields = dict(TOUR_FIELDS)
+        fields["purpose_name"] = _string_field(
+            p.name for p in self.purpose_list)
+        fields["mode"] = _string_field(
+            mode for p in self.purpose_list for mode in p.modes)
+        return fields
+
+    def output_columns(self, rows: slice) -> Dict[str, numpy.ndarray]:
+        """Get `Tour.attr` of tours as columns (see `output_fields()`).
+
+        Sustainable accessibility is NaN for purposes where
+        accessibility has not been calculated.
+        """
+        purpose = self.purpose[rows]
+        mode = self.mode[rows]
+        orig = self.orig[rows]
+        fields = self.output_fields()
+        purpose_names = numpy.array(
+            [p.name for p in self.purpose_list], fields["purpose_name"])
+        mode_names = numpy.empty(len(mode), fields["mode"])
+        sustainable_access = numpy.full(len(mode), numpy.nan)
+        for i, p in enumerate(self.purpose_list):
+            is_purpose = purpose == i
+            mode_names[is_purpose] = numpy.array(p.modes)[mode[is_purpose]]
+            try:
+                access = p.model.accessibility[f"{p.name}_sustainable_scaled"]
+            except (AttributeError, KeyError):
+                continue
+            sustainable_access[is_purpose] = -access.to_numpy()[
+                orig[is_purpose] - p.bounds.start]
+        return {
+            "person_id": self.persons.id[self.person[rows]],
+            "purpose_name": purpose_names[purpose],
+            "mode": mode_names,
+            "total_access": self.total_access[rows],
+            "sustainable_access": sustainable_access,
+            "cost": self.cost[rows],
+            "gen_cost": self.gen_cost[rows],
+        }
+
+    def print_records(self, resultdata: ResultsData, filename: str,
+                      fmt: str = "columnar"):
+        """Stream tour attributes to file, one batch at a time.
+
+        Parameters
+        ----------
+        resultdata : datahandling.resultdata.ResultsData
+            Result data container (file is closed when flushing)
+        filename : str
+            Name of file (without file extension)
+        fmt : str (optional)
+            File format, see `datahandling.recordwriter.record_writer()`
+        """
+        fields = self.output_fields()
+        for start in range(0, len(self), RECORD_BATCH_SIZE):
+            resultdata.print_records(
+                self.output_columns(slice(start, start + RECORD_BATCH_SIZE)),
+                filename, fields, fmt)
+
+    def views(self) -> Iterator[TourView]:
+        """Iterate over tours as `Tour`-like objects.
+
+        Used for output and for adding demand to departure time model.
+        """
+        for i in range(len(self)):
+            yield TourView(self, i)
+
+
+# Simulation state shared with (forked) worker processes
+_simulation: Dict[str, Any] = {}
+
+
+def partition_persons(zone: numpy.ndarray,
+                      nr_partitions: int) -> List[Tuple[int, int]]:
+    """Partition population by home zone into contiguous row ranges.
+
+    Parameters
+    ----------
+    zone : numpy.ndarray
+        Home zone index of each person (in ascending order)
+    nr_partitions : int
+        Maximum number of partitions (of about equal size)
+
+    Returns
+    -------
+    list of tuple
+        Start and stop row of each partition
+    """
+    if (numpy.diff(zone) < 0).any():
+        msg = "Agent population is not ordered by home zone"
+        log.error(msg)
+        raise ValueError(msg)
+    zone_starts = numpy.flatnonzero(numpy.diff(zone)) + 1
+    targets = numpy.linspace(0, len(zone), nr_partitions + 1)[1:-1]
+    idx = numpy.searchsorted(zone_starts, targets)
+    bounds = numpy.unique(numpy.concatenate([
+        [0], numpy.append(zone_starts, len(zone))[idx], [len(zone)]]))
+    if len(bounds) == 1:
+        bounds = numpy.array([0, 0])
+    return [(int(start), int(stop))
+            for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def simulate_tours(persons: PersonTable,
+                   purposes: Dict[str, TourPurpose],
+                   tour_probs: numpy.ndarray,
+                   nr_processes: int = 1,
+                   previous: Optional[TourTable] = None,
+                   resimulate: Optional[numpy.ndarray] = None) -> TourTable:
+    """Create tours and choose their modes and primary destinations.
+
+    Population is partitioned by home zone, and partitions are
+    simulated in a process pool. As all draws come from counter-based
+    random streams, results are identical regardless of
+    the number of processes. Worker processes are forked, so they
+    share the models without copying. If forking is not available
+    on the platform, partitions are simulated in this process.
+
+    In incremental simulation, only persons in `resimulate` are
+    simulated, and other persons keep their tours from `previous`.
+
+    Parameters
+    ----------
+    persons : PersonTable
+        Population (ordered by home zone), with car use decided
+    purposes : dict
+        key : str
+            Tour purpose name (hw/ho/...)
+        value : datatypes.purpose.TourPurpose
+            The tour purpose object, with choice probabilities calculated
+    tour_probs : numpy.ndarray
+        Cumulative tour combination probabilities
+        (population group x zone x combination)
+    nr_processes : int (optional)
+        Number of worker processes
+    previous : TourTable (optional)
+        Tours of same population from previous iteration
+    resimulate : numpy.ndarray (optional)
+        Boolean array of persons to simulate (if `previous` is given)
+
+    Returns
+    -------
+    TourTable
+        Tours with modes and primary destinations chosen,
+        and added to purpose tour counts
+    """
+    if (nr_processes > 1
+            and "fork" not in multiprocessing.get_all_start_methods()):
+        log.warn("Process fork not available, agents simulated in one process")
+        nr_processes = 1
+    if previous is None or resimulate is None:
+        parts = _simulate(persons, purposes, tour_probs, nr_processes)
+    else:
+        rows = numpy.flatnonzero(resimulate)
+        parts = _simulate(
+            persons.take(rows), purposes, tour_probs, nr_processes)
+        for start, part in parts:
+            part["person"] = rows[part["person"] + start]
+        parts = [(0, previous.take_columns(~resimulate[previous.person]))
+                 ] + [(0, part) for _, part in parts]
+    tours = TourTable.concatenate(purposes, persons, parts)
+    tours.count_tours()
+    return tours
+
+
+def _simulate(persons: PersonTable,
+              purposes: Dict[str, TourPurpose],
+              tour_probs: numpy.ndarray,
+              nr_processes: int
+              ) -> List[Tuple[int, Dict[str, numpy.ndarray]]]:
+    partitions = partition_persons(persons.zone, nr_processes)
+    _simulation.update(
+        persons=persons, purposes=purposes, tour_probs=tour_probs)
+    try:
+        if len(partitions) > 1:
+            context = multiprocessing.get_context("fork")
+            with ProcessPoolExecutor(
+                    nr_processes, mp_context=context) as pool:
+                return list(pool.map(_simulate_partition, partitions))
+        else:
+            return [_simulate_partition(part) for part in partitions]
+    finally:
+        _simulation.clear()
+
+
+def _simulate_partition(partition: Tuple[int, int]
+                        ) -> Tuple[int, Dict[str, numpy.ndarray]]:
+    start, stop = partition
+    persons = _simulation["persons"].take(slice(start, stop))
+    tours = persons.add_tours(
+        _simulation["purposes"], _simulation["tour_probs"])
+    tours.choose_modes()
+    tours.choose_destinations()
+    return start, tours.columns()
+
+
+class ChoiceChanges:
+    """Changes in agent choice probabilities between iterations.
+
+    Used in incremental simulation, where persons keep their tours
+    from previous iteration if none of their choice probabilities
+    has changed more than tolerance. Change is measured as maximum
+    absolute change in cumulative probability: for tour generation
+    per home zone, and for mode and destination choice per
+    (tour purpose, origin zone). Mode probabilities are compared
+    without individual dummies, which do not change between iterations.
+    Persons whose car use has changed are always simulated again.
+
+    Probability matrices of previous iteration are kept in memory.
+
+    Parameters
+    ----------
+    tolerance : float
+        Maximum change in cumulative probability for keeping tours
+    """
+
+    def __init__(self, tolerance: float):
+        self.tolerance = tolerance
+        self._previous: Dict[Tuple[str, ...], numpy.ndarray] = {}
+
+    def select(self,
+               persons: PersonTable,
+               purposes: Dict[str, TourPurpose],
+               tour_probs: numpy.ndarray,
+               previous: Optional[TourTable],
+               was_car_user: numpy.ndarray) -> numpy.ndarray:
+        """Select persons to simulate, and store current probabilities.
+
+        Parameters
+        ----------
+        persons : PersonTable
+            Population, with car use decided
+        purposes : dict
+            key : str
+                Tour purpose name (hw/ho/...)
+            value : datatypes.purpose.TourPurpose
+                The tour purpose object, with choice probabilities calculated
+        tour_probs : numpy.ndarray
+            Cumulative tour combination probabilities
+            (population group x zone x combination)
+        previous : TourTable or None
+            Tours of previous iteration (None if no previous iteration)
+        was_car_user : numpy.ndarray
+            Car use of persons in previous iteration
+
+        Returns
+        -------
+        numpy.ndarray
+            Boolean array of persons to simulate
+        """
+        gen_change = 0
+        for group, cumul in enumerate(tour_probs):
+            gen_change = numpy.maximum(gen_change, self._max_change(
+                ("generation", str(group)), cumul, 1))
+        purpose_change = {}
+        for name, purpose in purposes.items():
+            change = numpy.zeros(purpose.bounds.stop)
+            zones = numpy.arange(purpose.bounds.start, purpose.bounds.stop)
+            utils = purpose.model.calc_individual_mode_utils(zones)
+            exps = numpy.exp(utils - utils.max(axis=1, keepdims=True))
+            change[zones] = self._max_change(
+                ("mode", name),
+                exps.cumsum(axis=1) / exps.sum(axis=1, keepdims=True), 1)
+            for mode in purpose.modes:
+                change[zones] = numpy.maximum(change[zones], self._max_change(
+                    ("dest", name, mode),
+                    purpose.model.cumul_dest_prob[mode], 0))
+            purpose_change[name] = change
+        if previous is None:
+            return numpy.ones(len(persons), bool)
+        resimulate = ((gen_change[persons.zone] > self.tolerance)
+                      | (persons.is_car_user != was_car_user))
+        is_changed = numpy.zeros(len(previous), bool)
+        for i, purpose in enumerate(previous.purpose_list):
+            rows = numpy.flatnonzero(previous.purpose == i)
+            is_changed[rows] = (purpose_change[purpose.name][
+                previous.orig[rows]] > self.tolerance)
+        resimulate[previous.person[is_changed]] = True
+        return resimulate
+
+    def _max_change(self, key: Tuple[str, ...], cumul: numpy.ndarray,
+                    axis: int) -> numpy.ndarray:
+        """Maximum change along probability axis (inf if no previous)."""
+        previous = self._previous.get(key)
+        self._previous[key] = cumul
+        nr_zones = cumul.shape[1 - axis]
+        if previous is None or previous.shape != cumul.shape:
+            return numpy.full(nr_zones, numpy.inf)
+        change = numpy.zeros(nr_zones)
+        block = max(CHOICE_CHANGE_BLOCK_BYTES // (8*nr_zones), 1)
+        for start in range(0, cumul.shape[axis], block):
+            idx = [slice(None), slice(None)]
+            idx[axis] = slice(start, start + block)
+            numpy.maximum(change, numpy.abs(
+                cumul[tuple(idx)] - previous[tuple(idx)]).max(axis=axis),
+                out=change)
+        return change
+
+
+class TourStatistics:
+    """Deferred collector of tour statistics in agent simulation.
+
+    Origins and destinations of tours are recorded during simulation.
+    Tour length histograms, aggregated demand for each mapping and
+    within-zone tours are built from them in one pass with `build()`.
+    """
+
+    def __init__(self):
+        self._records: Dict[Tuple[str, str], List[Any]] = {}
+
+    def record(self,
+               purpose: TourPurpose,
+               mode: str,
+               orig: numpy.ndarray,
+               dest: numpy.ndarray):
+        """Record tours with primary destination chosen.
+
+        Parameters
+        ----------
+        purpose : TourPurpose
+            Tour purpose
+        mode : str
+            Tour mode
+        orig : numpy.ndarray
+            Origin zone indices
+        dest : numpy.ndarray
+            Destination zone indices (relative to purpose dest interval)
+        """
+        key = (purpose.name, mode)
+        if key not in self._records:
+            self._records[key] = [purpose, [], []]
+        self._records[key][1].append(orig)
+        self._records[key][2].append(dest)
+
+    def build(self):
+        """Add recorded tours to purpose statistics and clear records."""
+        for (_, mode), (purpose, origs, dests) in self._records.items():
+            orig = numpy.concatenate(origs)
+            dest = numpy.concatenate(dests)
+            orig_rel = orig - purpose.bounds.start
+            purpose.histograms[mode].add_array(purpose.dist[orig_rel, dest])
+            for name in purpose.dest_mappings:
+                agg = purpose.aggregates[name][mode]
+                orig_codes = agg.index.get_indexer(
+                    purpose.orig_mappings[name].to_numpy())
+                dest_codes = agg.columns.get_indexer(
+                    purpose.dest_mappings[name].to_numpy())
+                counts = numpy.bincount(
+                    orig_codes[orig]*agg.shape[1] + dest_codes[dest],
+                    minlength=agg.size)
+                purpose.aggregates[name][mode] = agg + counts.reshape(agg.shape)
+            within = purpose.within_zone_tours[mode]
+            purpose.within_zone_tours[mode] = within + numpy.bincount(
+                orig_rel[orig == dest], minlength=len(within))
+        self._records.clear()
+
+
+class PersonView:
+    """`Person`-like view to row of `PersonTable` (for output)."""
+    gender = Person.gender
+    __str__ = Person.__str__
+
+    def __init__(self, table: PersonTable, i: int):
+        self._table = table
+        self._i = i
+
+    @property
+    def id(self) -> int:
+        return self._table.id[self._i]
+
+    @property
+    def zone(self) -> Zone:
+        return self._table.zones[self._table.zone[self._i]]
+
+    @property
+    def age(self) -> int:
+        return self._table.age[self._i]
+
+    @property
+    def age_group(self) -> str:
+        return AGE_GROUPS[self._table.age_group[self._i]]
+
+    @property
+    def sex(self) -> bool:
+        return self._table.sex[self._i]
+
+    @property
+    def is_car_user(self) -> bool:
+        return self._table.is_car_user[self._i]
+
+    @property
+    def income(self) -> int:
+        return self._table.income[self._i]
+
+
+class TourView:
+    """`Tour`-like view to row of `TourTable`.
+
+    Used for output and for adding demand to departure time model.
+    """
+    matrix = Tour.matrix
+    sustainable_access = Tour.sustainable_access
+    orig = Tour.orig
+    dest = Tour.dest
+    sec_dest = Tour.sec_dest
+    __str__ = Tour.__str__
+
+    def __init__(self, table: TourTable, i: int):
+        self._table = table
+        self._i = i
+        self.purpose = table.purpose_list[table.purpose[i]]
+        self.purpose_name = self.purpose.name
+
+    @property
+    def person_id(self) -> int:
+        return self._table.persons.id[self._table.person[self._i]]
+
+    @property
+    def mode(self) -> str:
+        return self.purpose.modes[self._table.mode[self._i]]
+
+    @property
+    def position(self):
+        t = self._table
+        i = self._i
+        if t.sec_dest[i] >= 0:
+            return (t.orig[i], t.dest[i], t.sec_dest[i])
+        return (t.orig[i], t.dest[i])
+
+    @property
+    def total_access(self) -> float:
+        return self._table.total_access[self._i]
+
+    @property
+    def cost(self) -> float:
+        return self._table.cost[self._i]
+
+    @property
+    def gen_cost(self) -> float:
+        return self._table.gen_cost[self._i]
@@ -1,5 +1,5 @@
 from __future__ import annotations
-from typing import Dict, Iterator, Optional, cast
+from typing import Dict, Iterator, List, Optional, Tuple, cast
 from copy import copy
 from collections import defaultdict
 import numpy # type: ignore
@@ -8,6 +8,7 @@ from datahandling.resultdata import ResultsData
 from datahandling.zonedata import ZoneData
 from datahandling.matrixdata import MatrixData
 import utils.log as log
+from utils.precision import demand_block_rows, float_dtype
 import parameters.zone as param
 import models.logit as logit
 from parameters.assignment import (
@@ -18,12 +19,18 @@ from parameters.assignment import (
 import parameters.cost as cost
 import models.generation as generation
 from datatypes.demand import Demand
+from datatypes.impedance_cache import DayImpedanceCache
 from datatypes.histogram import TourLengthHistogram
 from utils.freight_costs import calc_cost
 from models.logistics import DDMParameters
 from utils.calibrate import attempt_calibration
 
 
+# Size (bytes) of one (pair, secondary destination) matrix in
+# `SecDestPurpose.distribute_tour_block()`, small enough to stay in cache
+SEC_DEST_BLOCK_BYTES = 2**23
+
+
 class Purpose:
     """Generic container class without methods.
     
@@ -53,6 +60,8 @@ class Purpose:
         Dict of matrix adjustments for testing elasticities
     """
     distance: numpy.ndarray
+    # Shared by all purposes, cleared after each iteration
+    day_impedance = DayImpedanceCache()
 
     def __init__(self, 
                  specification: Dict[str,Optional[str]],
@@ -119,21 +128,26 @@ class Purpose:
         """
         rows = self.bounds
         cols = self.dest_interval
-        day_imp = defaultdict(lambda: defaultdict(float))
+        day_imp = {}
         for mode in self.impedance_share:
             share_sum = 0
             ass_class = mode.replace("pax", assignment_classes[self.name])
+            sources = defaultdict(list)
             for time_period in self.impedance_share[mode]:
                 for mtx_type in impedance[time_period]:
                     if ass_class in impedance[time_period][mtx_type]:
                         imp = impedance[time_period][mtx_type][ass_class]
                         share = self.impedance_share[mode][time_period]
                         share_sum += sum(share)
-                        day_imp[mode][mtx_type] += share[0] * imp[rows, cols]
-                        day_imp[mode][mtx_type] += share[1] * imp[cols, rows].T
-            if mode in day_imp and abs(share_sum/len(day_imp[mode]) - 2) > 0.001:
+                        sources[mtx_type].append((imp, share))
+            if sources and abs(share_sum/len(sources) - 2) > 0.001:
                 raise ValueError(f"False impedance shares: {self.name} : {mode}")
-        day_imp = {mode: dict(day_imp[mode]) for mode in day_imp}
+            if sources:
+                # Day-averaged matrices are shared with other purposes,
+                # so purpose-specific changes below are not made in place
+                day_imp[mode] = {mtx_type: self.day_impedance.get(
+                        ass_class, mtx_type, rows, cols, sources[mtx_type])
+                    for mtx_type in sources}
         # Apply cost change to validate model elasticities
         if self.mtx_adjustment is not None:
             for t in self.mtx_adjustment:
@@ -148,7 +162,8 @@ class Purpose:
                         # If t is "inv_time" for instance,
                         # `los_component` becomes "time".
                         los_component = t.split('_')[-1]
-                        day_imp[m][los_component] += (p-1) * day_imp[m][t]
+                        day_imp[m][los_component] = (day_imp[m][los_component]
+                                                     + (p-1) * day_imp[m][t])
                         msg = (f"Purpose {self.name}: "
                             + f"Added {round(100*(p-1))} % to {t} : {m}.")
                         log.warn(msg)
@@ -159,29 +174,34 @@ class Purpose:
             for mtx_type in day_imp[mode]:
                 if mtx_type == "cost":
                     try:
-                        day_imp[mode][mtx_type] *= cost.cost_discount[self.name][mode]
+                        day_imp[mode][mtx_type] = (day_imp[mode][mtx_type]
+                                                   * cost.cost_discount[self.name][mode])
                     except KeyError:
                         pass
                 if mtx_type == "time" and "car" in mode:
-                    day_imp[mode][mtx_type] += self.attraction_zone_data["avg_park_time"].values
+                    day_imp[mode][mtx_type] = (day_imp[mode][mtx_type]
+                                               + self.attraction_zone_data["avg_park_time"].values)
                 if mtx_type == "cost" and "car" in mode:
                     try:
-                        day_imp[mode][mtx_type] += (cost.activity_time[self.name] *
-                                                    cost.share_paying[self.name] *
-                                                    self.attraction_zone_data["avg_park_cost"].values)
+                        day_imp[mode][mtx_type] = (day_imp[mode][mtx_type]
+                                                   + (cost.activity_time[self.name] *
+                                                      cost.share_paying[self.name] *
+                                                      self.attraction_zone_data["avg_park_cost"].values))
                     except KeyError:
                         pass
                 if mtx_type == "cost" and mode in ["car_work", "car_leisure"]:
                     try:
-                        day_imp[mode][mtx_type] *= (1 - cost.sharing_factor[self.name] *
-                                                    (cost.car_drv_occupancy[self.name] - 1) /
-                                                    cost.car_drv_occupancy[self.name])
+                        day_imp[mode][mtx_type] = (day_imp[mode][mtx_type]
+                                                   * (1 - cost.sharing_factor[self.name] *
+                                                      (cost.car_drv_occupancy[self.name] - 1) /
+                                                      cost.car_drv_occupancy[self.name]))
                     except KeyError:
                         pass
                 if mtx_type == "cost" and mode == "car_pax":
                     try:
-                        day_imp[mode][mtx_type] *= (cost.sharing_factor[self.name] /
-                                                    cost.car_pax_occupancy[self.name])
+                        day_imp[mode][mtx_type] = (day_imp[mode][mtx_type]
+                                                   * (cost.sharing_factor[self.name] /
+                                                      cost.car_pax_occupancy[self.name]))
                     except KeyError:
                         pass
         return day_imp
@@ -482,7 +502,17 @@ class TourPurpose(Purpose):
         orig_agg = self.generation_zone_data.aggregations
         dest_agg = self.attraction_zone_data.aggregations
         for mode in self.modes:
-            mtx = (prob.pop(mode) * tours).T
+            mode_prob = prob.pop(mode)
+            if (demand_block_rows() is not None
+                    and numpy.ndim(mode_prob) == 2
+                    and mode_prob.dtype == numpy.result_type(
+                        mode_prob, tours)):
+                # Probability matrix is not needed after this,
+                # so it is overwritten with demand
+                mode_prob *= tours
+                mtx = mode_prob.T
+            else:
+                mtx = (mode_prob * tours).T
             try:
                 self.sec_dest_purpose.gen_model.add_secondary_tours(
                     mtx, mode, self)
@@ -598,8 +628,9 @@ class SecDestPurpose(Purpose):
             # If no o-d pairs have demand above threshold,
             # the sole destination with largest demand is picked
             dests = [generation.argmax()]
+            total = generation.sum()
             generation.fill(0)
-            generation[dests] = generation.sum()
+            generation[dests] = total
         else:
             generation[dests] *= generation.sum() / generation[dests].sum()
             generation[~dests] = 0
@@ -609,6 +640,106 @@ class SecDestPurpose(Purpose):
         self.attracted_tours[mode][self.bounds] += demand.sum(0)
         return Demand(self, mode, demand, orig_offset + orig)
 
+    def origin_blocks(self, mode: str, max_pairs: int) -> List[slice]:
+        """Split origins into blocks for `distribute_tour_block()`.
+
+        Parameters
+        ----------
+        mode : str
+            Mode (car/transit/bike)
+        max_pairs : int
+            Maximum number of origin-destination pairs
+            (above secondary destination threshold) in one block
+
+        Returns
+        -------
+        list of slice
+            Blocks of relative origin indices
+        """
+        tours = self.tours[mode]
+        counts = numpy.maximum(
+            (tours > param.secondary_destination_threshold).sum(1), 1)
+        cumsum = numpy.cumsum(counts)
+        blocks = []
+        start = 0
+        while start < len(counts):
+            done = cumsum[start-1] if start > 0 else 0
+            stop = max(int(numpy.searchsorted(
+                cumsum, done + max_pairs, side="right")), start + 1)
+            blocks.append(slice(start, stop))
+            start = stop
+        return blocks
+
+    def distribute_tour_block(self, mode: str,
+                              impedance: Dict[str, numpy.ndarray],
+                              origs: slice
+                              ) -> Tuple[numpy.ndarray, numpy.ndarray,
+                                         numpy.ndarray]:
+        """Decide the secondary destinations for tours from block of origins.
+
+        Same as `distribute_tours()` for each origin in block, but
+        all origin-destination pairs above secondary destination
+        threshold are evaluated together, as rows of one
+        (pair, secondary destination) matrix.
+        Attracted tours are not updated here, as blocks can be
+        calculated in parallel threads (see `SecDestDemand`).
+
+        Parameters
+        ----------
+        mode : str
+            Mode (car/transit/bike)
+        impedance : dict
+            Type (time/cost/dist) : numpy 2d matrix
+        origs : slice
+            Relative zone indices from which these tours origin
+
+        Returns
+        -------
+        numpy.ndarray
+            Sorted indices of destinations with demand
+        numpy.ndarray
+            Destination -> secondary destination demand,
+            summed over origins in block
+            (one row for each destination with demand)
+        numpy.ndarray
+            Matrix of secondary destination -> origin demand
+            (one column for each origin in block)
+        """
+        generation = self.tours[mode][origs, :]
+        # All o-d pairs below threshold are neglected,
+        # total demand is increased for other pairs.
+        dests = generation > param.secondary_destination_threshold
+        totals = generation.sum(1)
+        no_dests = numpy.flatnonzero(~dests.any(1))
+        # If no o-d pairs have demand above threshold,
+        # the sole destination with largest demand is picked
+        dests[no_dests, generation[no_dests].argmax(1)] = True
+        dests[totals == 0] = False
+        generation[~dests] = 0
+        generation *= logit.divide(totals, generation.sum(1))[:, numpy.newaxis]
+        orig_idx, dest_idx = dests.nonzero()
+        orig_pos = origs.start + orig_idx
+        nr_zones = next(iter(impedance.values())).shape[1]
+        dest_rows = numpy.unique(dest_idx)
+        demand = numpy.zeros((len(dest_rows), nr_zones), float_dtype())
+        orig_demand = numpy.zeros(
+            (nr_zones, origs.stop - origs.start), float_dtype())
+        if len(orig_idx) > 0:
+            prob = self.calc_sec_dest_prob(mode, impedance, orig_pos, dest_idx)
+            pair_demand = prob.T
+            pair_demand *= generation[orig_idx, dest_idx][:, numpy.newaxis]
+            # Pairs are ordered by origin, so rows can be summed
+            # by origin with `reduceat`
+            orig_starts = numpy.flatnonzero(numpy.diff(orig_idx, prepend=-1))
+            orig_demand[:, orig_idx[orig_starts]] = numpy.add.reduceat(
+                pair_demand, orig_starts, axis=0).T
+            # Destinations are unique within each origin
+            dest_pos = numpy.searchsorted(dest_rows, dest_idx)
+            for start, stop in zip(orig_starts, numpy.append(
+                    orig_starts[1:], len(orig_idx))):
+                demand[dest_pos[start:stop], :] += pair_demand[start:stop]
+        return dest_rows, demand, orig_demand
+
     def calc_sec_dest_prob(self, mode, impedance, orig, dests):
         """Calculate secondary destination probabilites.
         
@@ -620,9 +751,10 @@ class SecDestPurpose(Purpose):
             Mode (car/transit/bike)
         impedance : dict
             Type (time/cost/dist) : numpy 2d matrix
-        orig : int
-            Origin zone index
-        dests : list or boolean array
+        orig : int or numpy.ndarray
+            Origin zone index, or origin index array of same length
+            as `dests` (for batch of origin-destination pairs)
+        dests : list or boolean array or numpy.ndarray
             Destination zone indices
 
         Returns
@@ -632,8 +764,15 @@ class SecDestPurpose(Purpose):
         """
         dest_imp = {}
         for mtx_type in impedance:
+            if numpy.ndim(orig) > 0:
+                # Gather each origin column once, as contiguous rows
+                origs, orig_idx = numpy.unique(orig, return_inverse=True)
+                orig_imp = numpy.ascontiguousarray(
+                    impedance[mtx_type][:, origs].T)[orig_idx]
+            else:
+                orig_imp = impedance[mtx_type][:, orig]
             dest_imp[mtx_type] = (impedance[mtx_type][dests, :]
-                                  + impedance[mtx_type][:, orig]
+                                  + orig_imp
                                   - impedance[mtx_type][dests, orig][:, numpy.newaxis])
         return self.model.calc_prob(mode, dest_imp, orig, dests)
 
@@ -0,0 +1,135 @@
+from __future__ import annotations
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, FrozenSet, List, NamedTuple, Optional
+import multiprocessing
+
+import utils.log as log
+import parameters.assignment as param
+
+
+def nr_threads() -> int:
+    """Number of threads for parallel demand calculation.
+
+    Set with "number_of_processors" in
+    `parameters.assignment.performance_settings` ("max" or int).
+    """
+    nr = param.performance_settings["number_of_processors"]
+    if nr == "max":
+        return multiprocessing.cpu_count()
+    return max(nr, 1)
+
+
+class PurposeTask(NamedTuple):
+    """Demand calculation of one tour purpose.
+
+    Parameters
+    ----------
+    name : str
+        Purpose name, used in log messages
+    calc : callable
+        Function calculating demand, returns result for `commit`
+    commit : callable
+        Function adding result of `calc` to model system demand
+    depends_on : frozenset of int
+        Indices of tasks that must be calculated before this one starts
+    nbytes : float
+        Estimated memory use of task (from start to commit)
+    before : callable (optional)
+        Function called in main thread before task is started
+    in_main_thread : bool (optional)
+        Whether task must be run in main thread, after all preceding tasks
+        have been committed (e.g., if it adds demand directly)
+    """
+    name: str
+    calc: Callable[[], Any]
+    commit: Callable[[Any], None]
+    depends_on: FrozenSet[int]
+    nbytes: float
+    before: Optional[Callable[[], None]] = None
+    in_main_thread: bool = False
+
+
+class PurposeScheduler:
+    """Calculates demand of independent tour purposes concurrently.
+
+    Tasks are started in list order, as soon as the tasks they depend
+    on are finished and the estimated memory of tasks in progress
+    (from start to commit) stays within budget.
+    The calculation runs in a thread pool, since the heavy parts are
+    numpy operations that release the GIL.
+    Results are committed in the main thread in list order, so demand
+    matrices are summed in the same order as in sequential calculation
+    and results do not depend on thread timing.
+
+    Parameters
+    ----------
+    nr_threads : int
+        Number of worker threads
+    memory_budget : float
+        Maximum estimated memory (bytes) of tasks in progress.
+        One task is always allowed, even if it exceeds the budget.
+    """
+
+    def __init__(self, nr_threads: int, memory_budget: float):
+        self.nr_threads = nr_threads
+        self.memory_budget = memory_budget
+
+    def run(self, tasks: List[PurposeTask]):
+        """Run all tasks and commit their results in order.
+
+        Parameters
+        ----------
+        tasks : list of PurposeTask
+            Tasks in sequential calculation order
+        """
+        results: Dict[int, Any] = {}
+        running: Dict[Future, int] = {}
+        next_start = 0
+        next_commit = 0
+        started = set()
+        finished = set()
+        in_progress = 0.0
+        with ThreadPoolExecutor(self.nr_threads) as pool:
+            while next_commit < len(tasks):
+                while next_commit in results:
+                    tasks[next_commit].commit(results.pop(next_commit))
+                    in_progress -= tasks[next_commit].nbytes
+                    next_commit += 1
+                if next_commit == len(tasks):
+                    break
+                task = tasks[next_commit]
+                if task.in_main_thread and next_commit not in started:
+                    if not running:
+                        started.add(next_commit)
+                        in_progress += task.nbytes
+                        self._start(task)
+                        results[next_commit] = task.calc()
+                        finished.add(next_commit)
+                        continue
+                while next_start < len(tasks):
+                    task = tasks[next_start]
+                    if (task.in_main_thread
+                            or not task.depends_on <= finished
+                            or (running and in_progress + task.nbytes
+                                > self.memory_budget)):
+                        break
+                    started.add(next_start)
+                    self._start(task)
+                    running[pool.submit(task.calc)] = next_start
+                    in_progress += task.nbytes
+                    next_start += 1
+                while next_start in started:
+                    next_start += 1
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = running.pop(future)
+                    # Re-raises exception from worker thread
+                    results[i] = future.result()
+                    finished.add(i)
+
+    def _start(self, task: PurposeTask):
+        if task.before is not None:
+            task.before()
+        log.debug(f"Demand calculation started for {task.name}")
@@ -1,5 +1,5 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING, Dict, Tuple, List, cast
+from typing import TYPE_CHECKING, List, Optional, cast
 import numpy # type: ignore
 import pandas
 if TYPE_CHECKING:
@@ -7,8 +7,10 @@ if TYPE_CHECKING:
     from datahandling.zonedata import ZoneData
     from datatypes.purpose import TourPurpose
 from datatypes.person import Person
+from datatypes.population import PersonTable
 
 import utils.log as log
+from utils.random_streams import RandomStreams
 import parameters.zone as param
 from parameters.tour_combinations import tour_combination_area
 from datatypes.purpose import SecDestPurpose
@@ -80,70 +82,72 @@ class DemandModel:
     def create_population(self):
         """Create population for agent-based simulation.
 
-        Store list of `Person` instances in `self.population`.
+        Store persons in columnar form in `self.persons`
+        (see `PersonTable.synthesize()`), and number of persons
+        of each zone in `self.zone_population`.
+        All person draws come from counter-based random streams
+        (`self.streams`), keyed by zone number and number of
+        person slot within zone.
         """
-        numpy.random.seed(param.population_draw)
-        self.population = []
+        self.streams = RandomStreams(param.population_draw)
         zone_numbers = self.zone_data.zone_numbers[self.bounds]
-        self.zone_population = pandas.Series(0, zone_numbers)
-        # Group -1 is under-7-year-olds
-        age_range = numpy.arange(-1, len(param.age_groups))
-        for zone_number in zone_numbers:
-            weights = [self.zone_data[f"share_{age}"][zone_number]
-                for age in self._age_strings()]
-            # Append under-7 weight
-            weights = [max(1 - sum(weights), 0)] + weights
-            if sum(weights) > 1:
-                if sum(weights) > 1.005:
-                    msg = "Sum of age group shares for zone {} is {}".format(
-                        zone_number, sum(weights))
-                    log.error(msg)
-                    raise ValueError(msg)
-                else:
-                    weights = numpy.array(weights)
-                    rebalance = 1 / sum(weights)
-                    weights = rebalance * weights
-            zone_pop = int(round(self.zone_data["population"][zone_number]
-                                 * param.agent_demand_fraction))
-            zone = self.zone_data.zones[zone_number]
-            incmod = self._income_models[zone.municipality == "Helsinki"]
-            for _ in range(zone_pop):
-                i = numpy.random.choice(a=age_range, p=weights)
-                if i != -1:
-                    self.population.append(Person(
-                        zone, param.age_groups[i], self.tour_generation_model,
-                        self.car_use_model, incmod))
-                    self.zone_population[zone_number] += 1
-        numpy.random.seed(None)
+        shares = numpy.column_stack([
+            numpy.asarray(self.zone_data[f"share_{age}"][zone_numbers], float)
+            for age in self._age_strings()])
+        # Prepend under-7 weight
+        weights = numpy.column_stack(
+            [numpy.maximum(1 - shares.sum(axis=1), 0), shares])
+        weight_sums = weights.sum(axis=1)
+        if (weight_sums > 1.005).any():
+            i = (weight_sums > 1.005).argmax()
+            msg = "Sum of age group shares for zone {} is {}".format(
+                zone_numbers[i], weight_sums[i])
+            log.error(msg)
+            raise ValueError(msg)
+        # Rebalance zones where sum is slightly over one
+        weights /= numpy.maximum(weight_sums, 1)[:, numpy.newaxis]
+        zone_pop = numpy.round(
+            numpy.asarray(self.zone_data["population"][zone_numbers], float)
+            * param.agent_demand_fraction).astype(int)
+        zones = [self.zone_data.zones[number] for number in zone_numbers]
+        is_helsinki = numpy.array(
+            [zone.municipality == "Helsinki" for zone in zones], int)
+        self.persons = PersonTable.synthesize(
+            zones, weights, zone_pop, is_helsinki,
+            self.tour_generation_model, self.streams)
+        zone_index = numpy.array([zone.index for zone in zones], int)
+        self.zone_population = pandas.Series(
+            numpy.bincount(
+                self.persons.zone, minlength=zone_index.max(initial=-1) + 1
+                )[zone_index],
+            zone_numbers)
+        self._population: Optional[List[Person]] = None
+
+    @property
+    def population(self) -> List[Person]:
+        """List of `Person` instances of population (created on first use)."""
+        if self._population is None:
+            self._population = self.persons.to_persons(self._income_models)
+        return self._population
 
     def predict_income(self):
         for model in self._income_models:
             model.predict()
 
-    def generate_tour_probs(self) -> Dict[Tuple[int,int], numpy.ndarray]:
-        """Generate matrices of cumulative tour combination probabilities.
+    def generate_tour_probs(self) -> numpy.ndarray:
+        """Generate cumulative tour combination probabilities.
 
         Used in agent-based simulation.
 
         Returns
         -------
-        dict
-            Age (age_7-17/...) : tuple
-                Is car user (False/True) : numpy.array
-                    Matrix with cumulative tour combination probabilities
-                    for all zones
+        numpy.ndarray
+            Cumulative tour combination probabilities for all
+            population groups (age groups) and zones,
+            see `TourCombinationModel.calc_cumul_prob()`
         """
-        probs = {}
-        for age in self._age_strings():
-            probs[age] = [self._get_probs(age, is_car_user)
-                for is_car_user in (False, True)]
-        return probs
+        return self.tour_generation_model.calc_cumul_prob(self.bounds)
 
-    def _get_probs(self, age: str, is_car_user: bool) -> pandas.DataFrame:
-        probs = self.tour_generation_model.calc_prob(
-            age, is_car_user, self.bounds)
-        return pandas.DataFrame(probs).to_numpy().cumsum(axis=1)
-    
     def calculate_car_ownership(self, impedance):
         try:
             acc_purpose = self.purpose_dict["hb_leisure"]
@@ -6,6 +6,7 @@ from typing import TYPE_CHECKING, Dict
 
 from models.logit import GenerationLogit
 from models.logit import divide
+from utils.precision import float_dtype
 if TYPE_CHECKING:
     from datatypes.purpose import Purpose
     from datahandling.resultdata import ResultsData
@@ -43,7 +44,7 @@ class GenerationModel:
     def init_tours(self):
         """Initialize `tours` vector to 0."""
         self.tours = pandas.Series(
-            0.0, self.purpose.orig_zone_numbers, dtype=numpy.float32)
+            0.0, self.purpose.orig_zone_numbers, dtype=float_dtype())
 
     def add_tours(self):
         """Generate and add tours to zone vector."""
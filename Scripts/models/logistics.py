@@ -3,6 +3,8 @@ from typing import NamedTuple, Sequence, Union
 from concurrent.futures import ThreadPoolExecutor
 from threading import Lock
 
+from utils.precision import float_dtype
+
 class DDMParameters(NamedTuple):
     orig_lc_detour: float
     lc_dest_detour: float
@@ -128,8 +130,8 @@ def process_logistics_inference(model: DetourDistributionInference, n_zones: int
     # Process full matrix in origin batches in parallel
     k_plus1 = len(model.lc_indices) + 1
     batch_size = 15
-    final_demand = np.zeros((n_zones, n_zones), dtype=np.float32)
-    total_per_route = np.zeros((k_plus1,), dtype=np.float32)
+    final_demand = np.zeros((n_zones, n_zones), dtype=float_dtype())
+    total_per_route = np.zeros((k_plus1,), dtype=float_dtype())
     lock = Lock()
     
     # Create list of batch arguments including shared arrays
@@ -1,10 +1,14 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple, cast
+from typing import (TYPE_CHECKING, Any, Collection, Dict, Optional, Tuple,
+                    cast)
 import numpy # type: ignore
 import pandas
 import copy
 from collections import defaultdict
+from functools import reduce
 from utils.calibrate import attempt_calibration
+from utils.precision import demand_block_rows, float_dtype, stable_logsum
+from models.utility_plan import UtilityPlan, ZoneDataCache
 
 if TYPE_CHECKING:
     from datahandling.resultdata import ResultsData
@@ -21,6 +25,43 @@ def log(a: numpy.array):
 def divide(a, b):
     return numpy.divide(a, b, out=numpy.zeros_like(a), where=b!=0)
 
+def log_expsum(expsum, shift=None):
+    """Logsum from sum of (possibly max-shifted) exponentials."""
+    logsum = log(expsum)
+    return logsum if shift is None else logsum + shift
+
+def shifted_exps(utils: Dict[str, numpy.ndarray]
+                 ) -> Tuple[Dict[str, numpy.ndarray], numpy.ndarray]:
+    """Calculate exponentials of utilities shifted by their maximum.
+
+    Parameters
+    ----------
+    utils : dict
+        Alternative : numpy.ndarray
+            Utilities (-inf if alternative is not available)
+
+    Returns
+    -------
+    dict
+        Alternative : numpy.ndarray
+            Exponentials of shifted utilities
+    numpy.ndarray
+        Shift (maximum utility over alternatives)
+    """
+    shift = reduce(numpy.maximum, utils.values()).copy()
+    shift[~numpy.isfinite(shift)] = 0
+    exps = {key: numpy.exp(utils[key] - shift) for key in utils}
+    return exps, shift
+
+def row_blocks(nr_rows: int, block_rows: int):
+    """Split range of rows into slices of at most `block_rows` rows."""
+    return [slice(i, min(i + block_rows, nr_rows))
+        for i in range(0, nr_rows, block_rows)]
+
+def _row_impedance(impedance: Dict[str, numpy.ndarray], rows: slice):
+    return {key: val[rows] if numpy.ndim(val) == 2 else val
+        for key, val in impedance.items()}
+
 class LogitModel:
     """Generic logit model with mode/destination choice.
 
@@ -49,72 +90,134 @@ class LogitModel:
         self.dest_choice_param: Dict[str, Dict[str, Any]] = parameters["destination_choice"]
         self.mode_choice_param: Optional[Dict[str, Dict[str, Any]]] = parameters["mode_choice"]
         self.distance_boundary = parameters["distance_boundaries"]
+        self._plans: Dict[str, UtilityPlan] = {}
+        self._zone_utils = ZoneDataCache()
 
     def calc_mode_prob(self, impedance: Dict[str, numpy.ndarray]):
-        expsum, mode_exps = self._calc_mode_utils(impedance)
+        expsum, mode_exps, shift = self._calc_mode_utils(impedance)
         impedance.clear()
         self.mode_utils.clear()
         prob = {mode: divide(mode_exps.pop(mode), expsum).T
             for mode in self.mode_choice_param}
-        return prob, log(expsum)
+        return prob, log_expsum(expsum, shift)
 
-    def _calc_alt_util(self, mode: str, utility: numpy.ndarray,
+    def _calc_alt_exps(self, mode: str, utility: numpy.ndarray,
                        impedance: Dict[str, numpy.ndarray],
-                       b: Dict[str, Dict[str, float]]):
-        self._add_zone_util(utility, b["attraction"])
+                       b: Dict[str, Dict[str, float]],
+                       rows: Optional[slice] = None,
+                       log_keys: Collection[str] = (),
+                       as_util: bool = False):
         self._add_impedance(utility, impedance, b["impedance"])
         if "transform" in b:
             b_transf = b["transform"]
             transimp = numpy.zeros_like(utility)
-            self._add_zone_util(transimp, b_transf["attraction"])
+            self._add_zone_util(transimp, b_transf["attraction"], rows=rows)
             self._add_impedance(transimp, impedance, b_transf["impedance"])
             impedance["transform"] = transimp
-        self._add_log_impedance(utility, impedance, b["log"])
-        exps = numpy.exp(utility)
+        self._add_log_impedance(utility, impedance, b["log"], log_keys)
+        mask = None
         dist = self.purpose.dist
-        if mode != "logsum" and dist.shape == exps.shape:
+        if rows is not None and dist.ndim == 2:
+            dist = dist[rows]
+        if mode != "logsum" and dist.shape == utility.shape:
             # If this is the lower level in nested model
             l, u = self.distance_boundary[mode]
-            exps[(dist < l) | (dist >= u)] = 0
+            mask = (dist < l) | (dist >= u)
+        if as_util:
+            # Unavailable alternatives get utility -inf
+            return (utility if mask is None
+                    else numpy.where(mask, -numpy.inf, utility))
+        exps = numpy.exp(utility)
+        if mask is not None:
+            exps[mask] = 0
         return exps
 
     def _calc_mode_util(self, mode: str, impedance: Dict[str, numpy.ndarray],
-                        dummy: Optional[str] = None):
+                        dummy: Optional[str] = None,
+                        rows: Optional[slice] = None,
+                        log_keys: Collection[str] = (),
+                        as_util: bool = False):
         b = self.mode_choice_param[mode]
-        utility = numpy.zeros_like(next(iter(impedance.values())))
+        shape = numpy.shape(next(iter(impedance.values())))
+        orig_util = self._zone_utils.get(
+            (mode, dummy), self.zone_data, list(b["generation"]),
+            lambda: self._calc_mode_zone_util(mode, dummy))
+        utility = numpy.empty(shape, float_dtype())
+        utility.T[...] = orig_util if rows is None else orig_util[rows]
+        self._add_zone_util(utility, b["attraction"], rows=rows)
+        exps = self._calc_alt_exps(
+            mode, utility, impedance, b, rows, log_keys, as_util)
+        self.mode_utils[mode] = utility
+        return exps
+
+    def _calc_mode_zone_util(self, mode: str,
+                             dummy: Optional[str] = None) -> numpy.ndarray:
+        """Calculate the part of mode utility depending only on origin.
+
+        Includes constant, individual dummy and generation terms.
+        Calculated once (as vector for purpose origins) and kept in
+        `self._zone_utils` until the zone data used in these terms changes.
+        """
+        b = self.mode_choice_param[mode]
+        utility = numpy.zeros(
+            self.bounds.stop - self.bounds.start, float_dtype())
         utility += b["constant"]
         if dummy in b["individual_dummy"]:
             utility += b["individual_dummy"][dummy]
-        utility = self._add_zone_util(
-            utility.T, b["generation"], generation=True).T
-        exps = self._calc_alt_util(mode, utility, impedance, b)
-        self.mode_utils[mode] = utility
-        return exps
+        return self._add_zone_util(utility, b["generation"], generation=True)
 
     def _calc_mode_utils(self, impedance: Dict[str, Dict[str, numpy.ndarray]],
-                         dummy: Optional[str] = None):
+                         dummy: Optional[str] = None,
+                         rows: Optional[slice] = None):
+        """Calculate mode utility exponentials and their sum.
+
+        If `stable_logsum()` is set, exponentials are shifted by maximum
+        mode utility, which is returned as third value (otherwise None).
+        """
         mode_exps: Dict[str, numpy.ndarray] = {}
+        stable = stable_logsum()
         for mode in self.mode_choice_param:
-            mode_exps[mode] = self._calc_mode_util(mode, impedance[mode], dummy)
+            mode_exps[mode] = self._calc_mode_util(
+                mode, impedance[mode], dummy, rows, as_util=stable)
+        shift = None
+        if stable:
+            mode_exps, shift = shifted_exps(mode_exps)
         expsum: numpy.ndarray = sum(mode_exps.values())
-        return expsum, mode_exps
-
-    def _calc_dest_util(self, mode: str, impedance: dict) -> numpy.ndarray:
-        b = self.dest_choice_param[mode]
-        utility = numpy.zeros_like(next(iter(impedance.values())))
-        impedance["attraction_size"] = self._add_zone_util(
-            numpy.zeros_like(utility), b["attraction_size"])
-        dest_exp = self._calc_alt_util(mode, utility, impedance, b)
-        return dest_exp
+        return expsum, mode_exps, shift
+
+    def _calc_dest_util(self, mode: str, impedance: dict,
+                        rows: Optional[slice] = None,
+                        out: Optional[numpy.ndarray] = None,
+                        log_keys: Collection[str] = (),
+                        shift: Optional[numpy.ndarray] = None
+                        ) -> numpy.ndarray:
+        try:
+            plan = self._plans[mode]
+        except KeyError:
+            plan = UtilityPlan(
+                self.dest_choice_param[mode],
+                None if mode == "logsum" else self.distance_boundary[mode])
+            self._plans[mode] = plan
+        return plan.evaluate(
+            impedance, self.zone_data, self.bounds, self.purpose.dist,
+            rows, out, log_keys, shift)
     
     def _calc_sec_dest_util(self, mode, impedance, orig, dest):
         b = self.dest_choice_param[mode]
-        utility = numpy.zeros_like(next(iter(impedance.values())))
-        self._add_sec_zone_util(utility, b["attraction"], orig, dest)
+        shape = numpy.shape(next(iter(impedance.values())))
+        attraction, size = self._zone_utils.get(
+            (mode, shape[-1]), self.zone_data,
+            list(b["attraction"]) + list(b["attraction_size"]),
+            lambda: (self._add_sec_zone_util(
+                        numpy.zeros(shape[-1], float_dtype()),
+                        b["attraction"]),
+                     self._add_sec_zone_util(
+                        numpy.zeros(shape[-1], float_dtype()),
+                        b["attraction_size"])))
+        utility = numpy.empty(shape, float_dtype())
+        utility[...] = attraction
         self._add_impedance(utility, impedance, b["impedance"])
         dest_exps = numpy.exp(utility)
-        size = numpy.zeros_like(utility)
-        self._add_sec_zone_util(size, b["attraction_size"])
         impedance["attraction_size"] = size
         self._add_log_impedance(dest_exps, impedance, b["log"])
         if mode != "logsum":
@@ -139,7 +242,7 @@ class LogitModel:
             utility += b[i] * impedance[i]
         return utility
 
-    def _add_log_impedance(self, utility, impedance, b):
+    def _add_log_impedance(self, utility, impedance, b, log_keys=()):
         """Adds log transformations of impedance to utility.
 
         Parameters
@@ -151,13 +254,20 @@ class LogitModel:
             `time`, `cost`, and `dist` of which values are all ndarrays.
         b : dict
             The parameters for different impedance matrices
+        log_keys : collection of str (optional)
+            Impedance types that are given as logarithms
         """
         for i in b:
+            if i in log_keys:
+                imp = (numpy.logaddexp(impedance[i], 0) if b[i] < 0
+                       else impedance[i])
+                utility += b[i] * imp
+                continue
             imp = impedance[i] + 1 if b[i] < 0 else impedance[i]
             utility += b[i] * log(imp)
         return utility
 
-    def _add_zone_util(self, utility, b, generation=False):
+    def _add_zone_util(self, utility, b, generation=False, rows=None):
         """Adds simple linear zone terms to utility.
         
         Parameters
@@ -170,10 +280,16 @@ class LogitModel:
             Whether the effect of the zone term is added only to the
             geographical area in which this model is used based on the
             `self.bounds` attribute of this class.
+        rows : slice (optional)
+            Block of rows (relative to `self.bounds`) in `utility`,
+            for zone data matrices
         """
         zdata = self.zone_data
         for i in b:
-            utility += b[i] * zdata.get_data(i, self.bounds, generation)
+            data = zdata.get_data(i, self.bounds, generation)
+            if rows is not None and numpy.ndim(data) == 2:
+                data = data[rows]
+            utility += b[i] * data
         return utility
     
     def _add_sec_zone_util(self, utility, b):
@@ -252,6 +368,7 @@ class ModeDestModel(LogitModel):
         """Calculate utility exponentials for walk and bike.
 
         The exponentials will be used for mode choice at a later stage.
+        If `stable_logsum()` is set, utilities are stored instead.
 
         Parameters
         ----------
@@ -315,10 +432,10 @@ class ModeDestModel(LogitModel):
             Mode (car/transit/bike/walk) : numpy 2-d matrix
                 Choice probabilities
         """
-        mode_exps, mode_expsum, dest_exps, dest_expsums = self._calc_utils(
-            impedance)
+        mode_exps, mode_expsum, dest_exps, dest_expsums, shift = (
+            self._calc_utils(impedance))
         if calc_accessibility:
-            self._calc_accessibility(mode_exps, mode_expsum)
+            self._calc_accessibility(mode_exps, mode_expsum, shift)
         mode_probs = self._calc_mode_prob(mode_exps, mode_expsum)
         if mode_probs is None:
             self._stashed_exps += [dest_exps, dest_expsums]
@@ -368,13 +485,34 @@ class ModeDestModel(LogitModel):
         calc_accessibility : bool (optional)
             Whether to calclulate and store accessibility indicators
         """
-        mode_exps, mode_expsum, dest_exps, _ = self._calc_utils(impedance)
+        mode_exps, mode_expsum, dest_exps, _, shift = self._calc_utils(
+            impedance)
         if calc_accessibility:
-            self._calc_accessibility(mode_exps, mode_expsum)
+            self._calc_accessibility(mode_exps, mode_expsum, shift)
         self.cumul_dest_prob = {}
         for mode in self.mode_choice_param:
             cumsum = dest_exps.pop(mode).T.cumsum(axis=0)
             self.cumul_dest_prob[mode] = cumsum / cumsum[-1]
+        self._fill_individual_mode_utils()
+
+    def _fill_individual_mode_utils(self):
+        """Fill table of agent mode utilities for each individual dummy.
+
+        Agent mode utilities depend only on (zone, individual dummy),
+        so they are calculated once per iteration for all zones.
+        """
+        modes = self.purpose.modes
+        base = numpy.empty((len(self.mode_utils[modes[0]]), len(modes)))
+        for i, mode in enumerate(modes):
+            base[:, i] = self.mode_utils[mode]
+        self.individual_mode_utils: Dict[Optional[str], numpy.ndarray] = {
+            None: base}
+        for i, mode in enumerate(modes):
+            b = self.mode_choice_param[mode]["individual_dummy"]
+            for dummy in b:
+                if dummy not in self.individual_mode_utils:
+                    self.individual_mode_utils[dummy] = base.copy()
+                self.individual_mode_utils[dummy][:, i] += b[dummy]
     
     def _calc_individual_prob(self, mod_modes: list[str], dummy: str,
                               mode_exps: Dict[str, numpy.ndarray]):
@@ -429,14 +567,37 @@ class ModeDestModel(LogitModel):
         float
             Total accessibility for individual (eur)
         """
-        modes = self.purpose.modes
-        mode_utils = numpy.empty(len(modes))
-        for i, mode in enumerate(modes):
-            mode_utils[i] = self.mode_utils[mode][zone]
-            b = self.mode_choice_param[mode]["individual_dummy"]
-            if individual_dummy in b:
-                mode_utils[i] += b[individual_dummy]
-        return mode_utils
+        return self._individual_mode_utils(individual_dummy)[zone]
+
+    def calc_individual_mode_utils(self, zones: numpy.ndarray,
+                                   individual_dummy: Optional[str] = None
+                                   ) -> numpy.ndarray:
+        """Calculate mode utilities for many agents with same dummy.
+
+        Same as `calc_individual_mode_prob()`, but for an array of zones.
+        Utilities are looked up from table filled in `calc_basic_prob()`.
+
+        Parameters
+        ----------
+        zones : numpy.ndarray
+            Indices of zones where the agents live
+        individual_dummy : str (optional)
+            Name of individual dummy to take into account in utility
+
+        Returns
+        -------
+        numpy.ndarray
+            Mode utilities (agents x purpose modes)
+        """
+        return self._individual_mode_utils(individual_dummy)[zones]
+
+    def _individual_mode_utils(self, individual_dummy: Optional[str]
+                               ) -> numpy.ndarray:
+        try:
+            return self.individual_mode_utils[individual_dummy]
+        except KeyError:
+            # Dummy without parameters does not change utilities
+            return self.individual_mode_utils[None]
 
     def _calc_utils(self,
                     impedance: Dict[str, Dict[str, Dict[str, numpy.ndarray]]]):
@@ -446,30 +607,66 @@ class ModeDestModel(LogitModel):
                 mode_exps[mode] = self.soft_mode_exps[mode]
         except AttributeError:
             pass
+        shift = None
+        if stable_logsum():
+            # `_calc_exps` returned utilities, which are shifted here
+            mode_exps, shift = shifted_exps(mode_exps)
         mode_expsum: numpy.ndarray = sum(mode_exps.values())
         logsum = pandas.Series(
-            log(mode_expsum), self.purpose.orig_zone_numbers,
+            log_expsum(mode_expsum, shift), self.purpose.orig_zone_numbers,
             name=self.purpose.name)
-        self.zone_data._values[self.purpose.name] = logsum
-        return mode_exps, mode_expsum, dest_exps, dest_expsums
+        self.zone_data.set_values(self.purpose.name, logsum)
+        return mode_exps, mode_expsum, dest_exps, dest_expsums, shift
 
     def _calc_exps(self,
                    impedance: Dict[str, Dict[str, Dict[str, numpy.ndarray]]]):
+        """Calculate destination exponentials and mode utilities.
+
+        If `stable_logsum()` is set, destination exponentials are
+        shifted by maximum destination utility, and mode utilities
+        are returned instead of mode exponentials.
+        """
         dest_expsums: Dict[str, numpy.ndarray] = {}
         dest_exps: Dict[str, numpy.ndarray] = {}
         mode_exps: Dict[str, numpy.ndarray] = {}
+        block_rows = demand_block_rows()
+        stable = stable_logsum()
         for mode in list(impedance):
-            dest_exps[mode] = self._calc_dest_util(mode, impedance.pop(mode))
-            try:
-                expsum = dest_exps[mode].sum(1)
-            except ValueError:
-                expsum = dest_exps[mode].sum()
+            mode_impedance = impedance.pop(mode)
+            shape = numpy.shape(next(iter(mode_impedance.values())))
+            shift = numpy.empty(shape[:-1], float_dtype()) if stable else None
+            if block_rows is not None and len(shape) == 2:
+                # Destination exponentials are calculated directly into
+                # one matrix, without full-size temporary matrices
+                dest_exps[mode] = numpy.empty(shape, float_dtype())
+                expsum = numpy.empty(shape[0], float_dtype())
+                for rows in row_blocks(shape[0], block_rows):
+                    exps = self._calc_dest_util(
+                        mode, _row_impedance(mode_impedance, rows), rows,
+                        dest_exps[mode][rows],
+                        shift=None if shift is None else shift[rows])
+                    expsum[rows] = exps.sum(1)
+                del mode_impedance
+            else:
+                dest_exps[mode] = self._calc_dest_util(
+                    mode, mode_impedance, shift=shift)
+                try:
+                    expsum = dest_exps[mode].sum(1)
+                except ValueError:
+                    expsum = dest_exps[mode].sum()
             dest_expsums[mode] = {"logsum": expsum}
             label = self.purpose.name + "_" + mode
             logsum = pandas.Series(
-                log(expsum), self.purpose.orig_zone_numbers, name=label)
-            self.zone_data._values[label] = logsum
-            mode_exps[mode] = self._calc_mode_util(mode, dest_expsums[mode])
+                log_expsum(expsum, shift), self.purpose.orig_zone_numbers,
+                name=label)
+            self.zone_data.set_values(label, logsum)
+            if stable:
+                mode_exps[mode] = self._calc_mode_util(
+                    mode, {"logsum": logsum.values}, log_keys=("logsum",),
+                    as_util=True)
+            else:
+                mode_exps[mode] = self._calc_mode_util(
+                    mode, dest_expsums[mode])
         return mode_exps, dest_exps, dest_expsums
 
     def _calc_mode_prob(self, mode_exps: Dict[str, numpy.ndarray],
@@ -507,15 +704,31 @@ class ModeDestModel(LogitModel):
                    dest_expsums: Dict[str, numpy.ndarray]
                    ) -> Dict[str, numpy.ndarray]:
         prob = {}
+        block_rows = demand_block_rows()
         for mode in dest_expsums:
-            dest_exp = dest_exps.pop(mode).T
             dest_expsum = dest_expsums[mode]["logsum"]
-            dest_prob = divide(dest_exp, dest_expsum)
-            prob[mode] = sum(mode_probs[mode]) * dest_prob
+            if block_rows is not None and dest_exps[mode].ndim == 2:
+                # Probabilities are written over destination exponentials,
+                # with the same operations as in unblocked calculation
+                dest_exp = dest_exps.pop(mode)
+                mode_prob = sum(mode_probs[mode])
+                for rows in row_blocks(len(dest_exp), block_rows):
+                    block = dest_exp[rows]
+                    expsum = dest_expsum[rows, numpy.newaxis]
+                    nonzero = expsum != 0
+                    numpy.divide(block, expsum, out=block, where=nonzero)
+                    block[~nonzero[:, 0]] = 0
+                    block *= mode_prob[rows, numpy.newaxis]
+                prob[mode] = dest_exp.T
+            else:
+                dest_exp = dest_exps.pop(mode).T
+                dest_prob = divide(dest_exp, dest_expsum)
+                prob[mode] = sum(mode_probs[mode]) * dest_prob
         return prob
 
     def _calc_accessibility(self, mode_exps: Dict[str, numpy.ndarray],
-                            mode_expsum: numpy.ndarray):
+                            mode_expsum: numpy.ndarray,
+                            shift: Optional[numpy.ndarray] = None):
         """Calculate logsum-based accessibility measures.
 
         Individual dummy variables are not included.
@@ -533,11 +746,12 @@ class ModeDestModel(LogitModel):
                 sustainable_expsum += mode_exps[mode]
         label = f"{self.purpose.name}_sustainable"
         logsum_sustainable = pandas.Series(
-            log(sustainable_expsum), self.purpose.orig_zone_numbers, name=label)
-        self.zone_data._values[label] = logsum_sustainable
+            log_expsum(sustainable_expsum, shift),
+            self.purpose.orig_zone_numbers, name=label)
+        self.zone_data.set_values(label, logsum_sustainable)
         self.accessibility["sustainable"] = logsum_sustainable
         self.accessibility["car"] = pandas.Series(
-            log(car_expsum), self.purpose.orig_zone_numbers,
+            log_expsum(car_expsum, shift), self.purpose.orig_zone_numbers,
             name=f"{self.purpose.name}_car")
         for key in ["all", "sustainable", "car"]:
             scaled_access = self.money_utility * self.accessibility[key]
@@ -596,6 +810,9 @@ class DestModeModel(LogitModel):
         for mode in self.mode_choice_param:
             for i in self.mode_choice_param[mode]["individual_dummy"]:
                 dummies.add(i)
+        block_rows = demand_block_rows()
+        if block_rows is not None:
+            return self._calc_blocked_prob(impedance, dummies, block_rows)
         no_dummy_share = 1.0
         prob = defaultdict(float)
         for dummy in dummies:
@@ -612,19 +829,20 @@ class DestModeModel(LogitModel):
 
     def _calc_prob(self, impedance: Dict[str, Dict[str, numpy.ndarray]],
                    dummy: Optional[str] = None, store_logsum: bool = False):
-        mode_expsum, mode_exps = self._calc_mode_utils(impedance, dummy)
+        mode_expsum, mode_exps, mode_shift = self._calc_mode_utils(
+            impedance, dummy)
         self.mode_utils = {}
-        dest_exps = self._calc_dest_util("logsum", {"logsum": mode_expsum})
+        dest_exps, shift = self._calc_upper_exps(mode_expsum, mode_shift)
         try:
             dest_expsum = dest_exps.sum(1)
         except ValueError:
             dest_expsum = dest_exps.sum()
         if store_logsum:
             logsum = pandas.Series(
-                log(dest_expsum), self.purpose.orig_zone_numbers,
+                log_expsum(dest_expsum, shift), self.purpose.orig_zone_numbers,
                 name=self.purpose.name)
             self.accessibility = {"all": logsum}
-            self.zone_data._values[self.purpose.name] = logsum
+            self.zone_data.set_values(self.purpose.name, logsum)
         prob: Dict[str, numpy.ndarray] = {}
         dest_prob = divide(dest_exps.T, dest_expsum)
         for mode in self.mode_choice_param:
@@ -632,9 +850,83 @@ class DestModeModel(LogitModel):
             prob[mode] = mode_prob * dest_prob
         return prob
 
+    def _calc_blocked_prob(self,
+                           impedance: Dict[str, Dict[str, numpy.ndarray]],
+                           dummies: set[str], block_rows: int
+                           ) -> Dict[str, numpy.ndarray]:
+        """Calculate choice probabilities block of origin rows at a time.
+
+        Gives the same result as unblocked calculation, but only
+        the probability matrices are allocated for all origins.
+        """
+        shape = numpy.shape(next(iter(
+            next(iter(impedance.values())).values())))
+        shares = {}
+        no_dummy_share = 1.0
+        for dummy in dummies:
+            shares[dummy] = self.zone_data.get_data(
+                dummy, self.bounds, generation=True)
+            no_dummy_share -= shares[dummy]
+        shares[None] = no_dummy_share
+        prob = {mode: numpy.zeros(shape, float_dtype())
+            for mode in self.mode_choice_param}
+        logsum_values = numpy.empty(shape[0], float_dtype())
+        for rows in row_blocks(shape[0], block_rows):
+            block_impedance = {mode: _row_impedance(impedance[mode], rows)
+                for mode in self.mode_choice_param}
+            for dummy, share in shares.items():
+                tmp_prob, logsum_block = self._calc_block_prob(
+                    block_impedance, rows, dummy)
+                if dummy is None:
+                    logsum_values[rows] = logsum_block
+                if numpy.ndim(share) > 0:
+                    share = share[rows, numpy.newaxis]
+                for mode in self.mode_choice_param:
+                    prob[mode][rows] += share * tmp_prob.pop(mode)
+        self.mode_utils = {}
+        logsum = pandas.Series(
+            logsum_values, self.purpose.orig_zone_numbers,
+            name=self.purpose.name)
+        self.accessibility = {"all": logsum}
+        self.zone_data.set_values(self.purpose.name, logsum)
+        return {mode: prob[mode].T for mode in prob}
+
+    def _calc_block_prob(self,
+                         impedance: Dict[str, Dict[str, numpy.ndarray]],
+                         rows: slice, dummy: Optional[str] = None):
+        mode_expsum, mode_exps, mode_shift = self._calc_mode_utils(
+            impedance, dummy, rows)
+        dest_exps, shift = self._calc_upper_exps(mode_expsum, mode_shift, rows)
+        dest_expsum = dest_exps.sum(1)
+        prob: Dict[str, numpy.ndarray] = {}
+        dest_prob = divide(dest_exps, dest_expsum[:, numpy.newaxis])
+        for mode in self.mode_choice_param:
+            mode_prob = divide(mode_exps.pop(mode), mode_expsum)
+            prob[mode] = mode_prob * dest_prob
+        return prob, log_expsum(dest_expsum, shift)
+
+    def _calc_upper_exps(self, mode_expsum: numpy.ndarray,
+                         mode_shift: Optional[numpy.ndarray] = None,
+                         rows: Optional[slice] = None
+                         ) -> Tuple[numpy.ndarray, Optional[numpy.ndarray]]:
+        """Calculate destination exponentials using mode choice logsums.
+
+        If mode exponentials are shifted (`stable_logsum()` is set),
+        destination exponentials are shifted as well,
+        and the shift is returned as second value (otherwise None).
+        """
+        if mode_shift is None:
+            return self._calc_dest_util(
+                "logsum", {"logsum": mode_expsum}, rows), None
+        shift = numpy.empty(mode_expsum.shape[:-1], float_dtype())
+        dest_exps = self._calc_dest_util(
+            "logsum", {"logsum": log_expsum(mode_expsum, mode_shift)}, rows,
+            log_keys=("logsum",), shift=shift)
+        return dest_exps, shift
+
     def calc_basic_prob(self, impedance):
-        mode_expsum, _ = self._calc_mode_utils(impedance)
-        dest_exps = self._calc_dest_util("logsum", {"logsum": mode_expsum})
+        mode_expsum, _, mode_shift = self._calc_mode_utils(impedance)
+        dest_exps, _ = self._calc_upper_exps(mode_expsum, mode_shift)
         cumsum = dest_exps.T.cumsum(axis=0)
         self.cumul_dest_prob = cumsum / cumsum[-1]
 
@@ -720,7 +1012,7 @@ class GenerationLogit(LogitModel):
         # First calc probabilites without individual dummies
         for nr in self.param:
             b = self.param[nr]
-            utility = numpy.zeros(self.bounds.stop, dtype=numpy.float32)
+            utility = numpy.zeros(self.bounds.stop, dtype=float_dtype())
             utility += b["constant"]
             utility = self._add_zone_util(utility, b["generation"], True)
             self.exps[nr] = numpy.minimum(numpy.exp(utility), 99999)
@@ -744,11 +1036,11 @@ class GenerationLogit(LogitModel):
         self.calc_basic_prob()
         prob = {}
         for nr in self.param:
-            prob[nr] = numpy.zeros(self.bounds.stop, dtype=numpy.float32)
+            prob[nr] = numpy.zeros(self.bounds.stop, dtype=float_dtype())
         # Calculate probability with individual dummies and combine
         for dummy in self.param["0"]["individual_dummy"]:
             nr_exp = {}
-            nr_expsum = numpy.zeros(self.bounds.stop, dtype=numpy.float32)
+            nr_expsum = numpy.zeros(self.bounds.stop, dtype=float_dtype())
             for nr in self.param:
                 b = self.param[nr]["individual_dummy"][dummy]
                 nr_exp[nr] = self.exps[nr] * numpy.exp(b)
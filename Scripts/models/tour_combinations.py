@@ -1,7 +1,8 @@
-from typing import Union, Dict, Tuple
+from typing import Union, Dict, Sequence, Tuple
 import numpy # type: ignore
 
 import parameters.tour_combinations as param
+import parameters.zone as zone_param
 
 
 class TourCombinationModel:
@@ -17,6 +18,9 @@ class TourCombinationModel:
     zone_data : ZoneData
         Data used for all demand calculations
     """
+    # Age groups (age_7_17/...) in population group axis
+    age_groups = ["age_{}_{}".format(*age_group)
+        for age_group in zone_param.age_groups]
 
     def __init__(self, zone_data):
         self.zone_data = zone_data
@@ -32,7 +36,7 @@ class TourCombinationModel:
         """Calculate choice probabilities for each tour combination.
 
         Calculation is done for one specific population group
-        (age + is car user or not) and probabilities are returned for every
+        (age group) and probabilities are returned for every
         possible tour combination.
 
         Parameters
@@ -50,55 +54,116 @@ class TourCombinationModel:
             value : numpy.ndarray
                 Choice probabilities per zone
         """
-        prob = {}
+        prob = self._calc_nested_prob([age_group], zones)[0]
+        return {tour_combination: prob[..., j]
+            for j, tour_combination in enumerate(self.tour_combinations)}
+
+    def group_index(self, age_group: str) -> int:
+        """Index of population group in `calc_cumul_prob()` result."""
+        return self.age_groups.index(age_group)
+
+    def calc_cumul_prob(self, zones: slice) -> numpy.ndarray:
+        """Calculate cumulative choice probabilities for all groups.
+
+        Parameters
+        ----------
+        zones : slice
+            Zone data slice
+
+        Returns
+        -------
+        numpy.ndarray
+            Cumulative choice probabilities (population group x zone x
+            tour combination), see `group_index()` for group axis and
+            `self.tour_combinations` for combination axis
+        """
+        prob = self._calc_nested_prob(self.age_groups, zones)
+        shape = (len(self.age_groups), len(self.zone_data.zone_numbers[zones]),
+                 len(self.tour_combinations))
+        return numpy.broadcast_to(prob, shape).cumsum(axis=2)
+
+    def _calc_nested_prob(self,
+                          age_groups: Sequence[str],
+                          zones: Union[int, slice]) -> numpy.ndarray:
+        """Calculate choice probabilities for age groups.
+
+        Zone terms of utility are calculated once per tour combination
+        and age group dummies are broadcast along group axis.
+
+        Parameters
+        ----------
+        age_groups : list of str
+            Age groups (age_7-17/age_18-29/...)
+        zones : int or slice
+            Zone number (for agent model) or zone data slice
+
+        Returns
+        -------
+        numpy.ndarray
+            Choice probabilities (age group x zone x tour combination),
+            without zone axis if utilities do not depend on zone
+        """
+        age_groups = numpy.asarray(age_groups)
+        zone_utils = []
+        for nr_tours in self.param:
+            for b in self.param[nr_tours].values():
+                util = b["constant"]
+                for i in b["zone"]:
+                    util = util + b["zone"][i] * numpy.asarray(
+                        self.zone_data[i][zones], float)
+                zone_utils.append(util)
+        shape = (len(age_groups),) + numpy.broadcast_shapes(
+            *[numpy.shape(util) for util in zone_utils])
+        prob = numpy.zeros(shape + (len(self.tour_combinations),))
+        nests = {}
         nr_tours_exps = {}
-        nr_tours_expsum = 0
+        nr_tours_expsum = numpy.zeros(shape)
+        j = 0
         for nr_tours in self.param:
             # Upper level of nested logit model
-            combination_exps = {}
-            combination_expsum = 0
+            combination_expsum = numpy.zeros(shape)
+            start = j
             for tour_combination in self.param[nr_tours]:
                 # Lower level of nested logit model
                 try:
                     cond = self.conditions[tour_combination]
                 except KeyError:
-                    is_allowed = True
+                    is_allowed = numpy.ones(len(age_groups), bool)
                 else:
                     # If this tour pattern is exclusively for this age group
                     # or if this age group is excluded from this tour pattern
-                    is_allowed = (age_group == cond[1] if cond[0]
-                        else age_group != cond[1])
-                if is_allowed:
-                    b = self.param[nr_tours][tour_combination]
-                    util = b["constant"]
-                    for i in b["zone"]:
-                        util += b["zone"][i] * self.zone_data[i][zones]
-                    dummies = b["individual_dummy"]
-                    util += dummies[age_group]
-                    combination_exps[tour_combination] = numpy.exp(util)
-                else:
-                    combination_exps[tour_combination] = 0.0
-                combination_expsum += combination_exps[tour_combination]
-            for tour_combination in self.param[nr_tours]:
-                prob[tour_combination] = numpy.divide(
-                    combination_exps[tour_combination], combination_expsum,
-                    out=numpy.zeros_like(combination_expsum),
-                    where=combination_expsum!=0)
-            util = 0
-            nr_tours_exps[nr_tours] = numpy.exp(util)
-            scale_param = param.tour_number_scale
-            nr_tours_exps[nr_tours] *= numpy.power(combination_expsum, scale_param)
+                    is_allowed = ((age_groups == cond[1]) if cond[0]
+                        else (age_groups != cond[1]))
+                dummies = self.param[nr_tours][tour_combination][
+                    "individual_dummy"]
+                group_util = numpy.zeros(len(age_groups))
+                for k in numpy.flatnonzero(is_allowed):
+                    group_util[k] = dummies[age_groups[k]]
+                group_util = group_util.reshape((-1,) + (1,)*(len(shape) - 1))
+                exps = prob[..., j]
+                exps[is_allowed] = numpy.exp(
+                    group_util + zone_utils[j])[is_allowed]
+                combination_expsum += exps
+                j += 1
+            nests[nr_tours] = slice(start, j)
+            expsum = combination_expsum[..., numpy.newaxis]
+            numpy.divide(
+                prob[..., start:j], expsum, out=prob[..., start:j],
+                where=expsum!=0)
+            nr_tours_exps[nr_tours] = numpy.power(
+                combination_expsum, param.tour_number_scale)
             nr_tours_expsum += nr_tours_exps[nr_tours]
         # Probability of no tours at all (empty tuple) is deduced from
         # other combinations (after calibration)
-        prob[()] = 1
+        no_tours_prob = numpy.ones(shape)
         for nr_tours in self.param:
             if nr_tours != 0:
                 nr_tours_prob = nr_tours_exps[nr_tours] / nr_tours_expsum
                 # Tour number probability is calibrated
                 nr_tours_prob *= self.increases[nr_tours]
-                prob[()] -= nr_tours_prob
-                for tour_combination in self.param[nr_tours]:
-                    # Upper and lower level probabilities are combined
-                    prob[tour_combination] *= nr_tours_prob
+                no_tours_prob -= nr_tours_prob
+                # Upper and lower level probabilities are combined
+                prob[..., nests[nr_tours]] *= nr_tours_prob[..., numpy.newaxis]
+        if () in self.tour_combinations:
+            prob[..., self.tour_combinations.index(())] = no_tours_prob
         return prob
@@ -0,0 +1,374 @@
+from __future__ import annotations
+from typing import (TYPE_CHECKING, Any, Callable, Collection, Dict, List,
+                    Optional, Tuple)
+import threading
+import numpy # type: ignore
+
+from utils.precision import float_dtype
+if TYPE_CHECKING:
+    from datahandling.zonedata import ZoneData
+
+
+# Target size (bytes) of one row block, small enough to stay in cache
+BLOCK_BYTES = 2**18
+
+# Scratch buffers are reused between calls, one set for each thread
+_scratch = threading.local()
+
+
+def _buffer(name: str, shape: Tuple[int, ...], dtype) -> numpy.ndarray:
+    buffers: Dict[str, numpy.ndarray] = _scratch.__dict__.setdefault(
+        "buffers", {})
+    buf = buffers.get(name)
+    if buf is None or buf.shape != shape or buf.dtype != dtype:
+        buf = numpy.empty(shape, dtype)
+        buffers[name] = buf
+    return buf
+
+
+class ZoneDataCache:
+    """Values calculated from zone data, kept between model iterations.
+
+    An entry is recalculated only if some of the zone data variables
+    it depends on have been set after the entry was calculated
+    (e.g., car ownership or logsums of other purposes).
+    """
+
+    def __init__(self):
+        self._entries: Dict[Any, Tuple[Any, Any]] = {}
+
+    def get(self, key: Any, zone_data: ZoneData, zone_keys: List[str],
+            calc: Callable[[], Any]) -> Any:
+        """Get cached value, recalculating it if zone data has changed.
+
+        Parameters
+        ----------
+        key : hashable
+            Identifier of value (e.g., mode and matrix shape)
+        zone_data : ZoneData
+            Zone data that value is calculated from
+        zone_keys : list of str
+            Zone data variables that value depends on
+        calc : callable
+            Function for calculating value
+
+        Returns
+        -------
+        Any
+            Value returned by `calc`
+        """
+        revisions = [zone_data.revision(i) for i in zone_keys]
+        try:
+            cached_data, cached_revisions, value = self._entries[key]
+        except KeyError:
+            pass
+        else:
+            if cached_data is zone_data and cached_revisions == revisions:
+                return value
+        value = calc()
+        self._entries[key] = (zone_data, revisions, value)
+        return value
+
+    def clear(self):
+        self._entries.clear()
+
+
+class _Term:
+    """One term `coef * x` of utility function.
+
+    Parameters
+    ----------
+    kind : str
+        "zone" (zone data), "linear" (impedance),
+        or "log" (log of impedance, size or transformed impedance)
+    coef : float
+        Parameter value
+    key : str
+        Zone data variable or impedance type
+    """
+
+    def __init__(self, kind: str, coef: float, key: str):
+        self.kind = kind
+        self.coef = coef
+        self.key = key
+
+
+class _Invariant:
+    """Parts of utility that do not depend on impedance."""
+
+    def __init__(self, base: Optional[numpy.ndarray],
+                 arrays: Dict[str, Any],
+                 vectors: Dict[int, numpy.ndarray]):
+        self.base = base
+        self.arrays = arrays
+        self.vectors = vectors
+
+
+class UtilityPlan:
+    """Evaluation plan for destination choice utility of one mode.
+
+    Compiled once from parameter dict, the plan evaluates all zone,
+    linear and log terms in place, block of rows at a time, using
+    scratch buffers that are reused between calls within one thread.
+    Terms that depend only on zone data (attraction terms, log of
+    attraction size) and the distance boundary mask are calculated once
+    and kept until the zone data they depend on changes.
+    The result is identical to adding the terms one by one on full
+    matrices, as terms are added in the same order with the same
+    floating-point operations (provided that impedance matrices are
+    already of model float type).
+
+    Parameters
+    ----------
+    b : dict
+        Destination choice parameters for mode
+        (attraction/impedance/log/attraction_size/transform)
+    distance_boundary : tuple of float (optional)
+        Lower and upper bound for tour distance, outside of which
+        utility exponential is set to zero
+    """
+
+    def __init__(self, b: Dict[str, Any],
+                 distance_boundary: Optional[Tuple[float, float]] = None):
+        self.distance_boundary = distance_boundary
+        self.zone_terms = self._zone_terms(b["attraction"])
+        self.terms: List[_Term] = self._linear_terms(b["impedance"])
+        self.derived: Dict[str, List[_Term]] = {
+            "attraction_size": self._zone_terms(b["attraction_size"]),
+        }
+        if "transform" in b:
+            self.derived["transform"] = (
+                self._zone_terms(b["transform"]["attraction"])
+                + self._linear_terms(b["transform"]["impedance"]))
+        self.terms += [_Term("log", b["log"][i], i) for i in b["log"]]
+        derived_terms = [t for terms in self.derived.values() for t in terms]
+        self.zone_keys = list(dict.fromkeys(
+            t.key for t in self.zone_terms + derived_terms
+            if t.kind == "zone"))
+        self._cache = ZoneDataCache()
+        self._mask: Optional[Tuple[numpy.ndarray,
+                                   Optional[numpy.ndarray]]] = None
+
+    @staticmethod
+    def _zone_terms(b: Dict[str, float]) -> List[_Term]:
+        return [_Term("zone", b[i], i) for i in b]
+
+    @staticmethod
+    def _linear_terms(b: Dict[str, float]) -> List[_Term]:
+        return [_Term("linear", b[i], i) for i in b]
+
+    def evaluate(self,
+                 impedance: Dict[str, numpy.ndarray],
+                 zone_data: ZoneData,
+                 bounds: slice,
+                 dist: Optional[numpy.ndarray] = None,
+                 rows: Optional[slice] = None,
+                 out: Optional[numpy.ndarray] = None,
+                 log_keys: Collection[str] = (),
+                 shift: Optional[numpy.ndarray] = None) -> numpy.ndarray:
+        """Calculate utility exponentials.
+
+        Parameters
+        ----------
+        impedance : dict
+            Type (time/cost/dist) : numpy 2-d matrix
+        zone_data : ZoneData
+            Zone data for attraction terms
+        bounds : slice
+            Origin zone bounds of purpose
+        dist : numpy.ndarray (optional)
+            Distance matrix (for all purpose origins)
+            for distance boundaries
+        rows : slice (optional)
+            Block of rows (relative to purpose bounds) to calculate,
+            if impedance matrices contain only these rows
+        out : numpy.ndarray (optional)
+            Array where result is written
+        log_keys : collection of str (optional)
+            Impedance types that are given as logarithms
+            (e.g., logsums instead of expsums)
+        shift : numpy.ndarray (optional)
+            If given, the maximum utility of each row is subtracted
+            before exponentiation and stored in this array
+            (with one dimension less than impedance matrices)
+
+        Returns
+        -------
+        numpy.ndarray
+            Utility exponentials (same shape as impedance matrices)
+        """
+        shape = numpy.shape(next(iter(impedance.values())))
+        dtype = float_dtype()
+        if out is None:
+            out = numpy.empty(shape, dtype)
+        if rows is None:
+            full_shape = shape
+            rows = slice(0, shape[0]) if len(shape) == 2 else slice(None)
+        else:
+            full_shape = (bounds.stop - bounds.start,) + shape[1:]
+        invariant: _Invariant = self._cache.get(
+            (bounds.start, bounds.stop, full_shape, dtype), zone_data,
+            self.zone_keys,
+            lambda: self._invariant(zone_data, bounds, full_shape, dtype))
+        arrays = {key: _rows(val, rows)
+            for key, val in invariant.arrays.items()}
+        for term in self.terms + self.derived.get("transform", []):
+            if term.kind != "zone" and term.key not in self.derived:
+                arrays[term.key] = impedance[term.key]
+        base = (None if invariant.base is None
+                else _rows(invariant.base, rows))
+        mask = None
+        if (self.distance_boundary is not None
+                and numpy.shape(dist) == full_shape):
+            mask = self._distance_mask(dist)
+            if mask is not None:
+                mask = _rows(mask, rows)
+        if len(shape) == 2:
+            block_rows = max(1, BLOCK_BYTES // (dtype.itemsize*shape[1] or 1))
+            blocks = [slice(r, min(r+block_rows, shape[0]))
+                      for r in range(0, shape[0], block_rows)]
+            block_shape: Tuple[int, ...] = (min(block_rows, shape[0]), shape[1])
+        else:
+            blocks = [slice(None)]
+            block_shape = shape
+        tmp = _buffer("tmp", block_shape, dtype)
+        derived = _buffer("derived", block_shape, dtype)
+        for block in blocks:
+            u = out[block]
+            n = len(u)
+            if base is None:
+                u[...] = 0
+            else:
+                u[...] = _rows(base, block)
+            self._eval_block(
+                u, block, self.terms, arrays, invariant.vectors,
+                tmp[:n], derived[:n], log_keys)
+            if shift is None:
+                numpy.exp(u, out=u)
+                if mask is not None:
+                    u[mask[block]] = 0
+            else:
+                if mask is not None:
+                    u[mask[block]] = -numpy.inf
+                shift[block if u.ndim == 2 else ()] = subtract_max(u)
+                numpy.exp(u, out=u)
+        return out
+
+    def _invariant(self, zone_data: ZoneData, bounds: slice,
+                   shape: Tuple[int, ...], dtype) -> _Invariant:
+        """Calculate parts of utility that depend only on zone data."""
+        arrays = {key: zone_data.get_data(key, bounds)
+            for key in self.zone_keys}
+        base = None
+        if self.zone_terms:
+            # Attraction terms come first in utility function,
+            # so their sum is the starting value for each row block
+            ndim = max(numpy.ndim(arrays[t.key]) for t in self.zone_terms)
+            base = numpy.zeros(shape[len(shape)-ndim:], dtype)
+            for t in self.zone_terms:
+                base += t.coef * arrays[t.key]
+        vectors: Dict[int, numpy.ndarray] = {}
+        if len(shape) == 2:
+            for term in self.terms:
+                if term.kind == "log" and term.key in self.derived:
+                    sub_terms = self.derived[term.key]
+                    if all(t.kind == "zone" and numpy.ndim(arrays[t.key]) < 2
+                            for t in sub_terms):
+                        size = numpy.zeros(shape[1], dtype)
+                        for t in sub_terms:
+                            size += t.coef * arrays[t.key]
+                        vectors[id(term)] = term.coef * _log(
+                            size + 1 if term.coef < 0 else size)
+        return _Invariant(base, arrays, vectors)
+
+    def _distance_mask(self,
+                       dist: numpy.ndarray) -> Optional[numpy.ndarray]:
+        """Get mask for destinations outside distance boundaries.
+
+        Mask is kept as long as the same distance matrix is used.
+        Returns None if no destination is outside boundaries.
+        """
+        if self._mask is not None and _same_view(self._mask[0], dist):
+            return self._mask[1]
+        low, high = self.distance_boundary
+        mask = (dist < low) | (dist >= high)
+        # Reference to `dist` is kept, so that its memory is not reused
+        self._mask = (dist, mask if mask.any() else None)
+        return self._mask[1]
+
+    def _eval_block(self, u: numpy.ndarray, rows: slice, terms: List[_Term],
+                    arrays: Dict[str, Any], vectors: Dict[int, numpy.ndarray],
+                    tmp: numpy.ndarray, derived: Optional[numpy.ndarray],
+                    log_keys: Collection[str] = ()):
+        for term in terms:
+            if id(term) in vectors:
+                numpy.add(u, vectors[id(term)], out=u)
+                continue
+            if term.kind in ("zone", "linear"):
+                numpy.multiply(_rows(arrays[term.key], rows), term.coef,
+                               out=tmp)
+            else:
+                key = term.key
+                if key in self.derived:
+                    # Derived matrix is evaluated into its own buffer,
+                    # using `tmp` for its terms
+                    derived[...] = 0
+                    self._eval_block(
+                        derived, rows, self.derived[key], arrays, {},
+                        tmp, None)
+                    base = derived
+                elif key in log_keys:
+                    # log(x + 1) = log(exp(log(x)) + exp(0))
+                    if term.coef < 0:
+                        numpy.logaddexp(_rows(arrays[key], rows), 0, out=tmp)
+                    else:
+                        tmp[...] = _rows(arrays[key], rows)
+                    numpy.multiply(tmp, term.coef, out=tmp)
+                    numpy.add(u, tmp, out=u)
+                    continue
+                else:
+                    base = _rows(arrays[key], rows)
+                if term.coef < 0:
+                    numpy.add(base, 1, out=tmp)
+                    base = tmp
+                with numpy.errstate(divide="ignore"):
+                    numpy.log(base, out=tmp)
+                numpy.multiply(tmp, term.coef, out=tmp)
+            numpy.add(u, tmp, out=u)
+
+
+def subtract_max(utility: numpy.ndarray) -> numpy.ndarray:
+    """Subtract maximum of last axis from utility (in place).
+
+    Exponentials of shifted utilities do not overflow, and logsum is
+    `shift + log(sum(exp(utility)))`. Rows without finite maximum
+    (e.g., all alternatives unavailable) are not shifted.
+
+    Parameters
+    ----------
+    utility : numpy.ndarray
+        Utilities, alternatives in last axis
+
+    Returns
+    -------
+    numpy.ndarray
+        Subtracted maximum (shift) for each row
+    """
+    shift = numpy.asarray(utility.max(axis=-1, initial=-numpy.inf))
+    shift[~numpy.isfinite(shift)] = 0
+    utility -= shift[..., numpy.newaxis]
+    return shift
+
+
+def _rows(a: Any, rows: slice):
+    return a[rows] if numpy.ndim(a) == 2 else a
+
+
+def _same_view(a: numpy.ndarray, b: numpy.ndarray) -> bool:
+    return (a.__array_interface__["data"][0] == b.__array_interface__["data"][0]
+            and a.shape == b.shape and a.strides == b.strides)
+
+
+def _log(a: numpy.ndarray) -> numpy.ndarray:
+    with numpy.errstate(divide="ignore"):
+        return numpy.log(a)
@@ -178,6 +178,27 @@ performance_settings = {
     "number_of_processors": "max",
     "network_acceleration": True,
     "u_turns_allowed": True,
+    # Float type of demand model matrices ("float32"/"float64"),
+    # not passed to Emme
+    "float_precision": "float32",
+    # Maximum estimated memory (GB) of tour purposes calculated
+    # concurrently in demand model, not passed to Emme
+    "demand_memory_gb": 8,
+    # Number of origin rows calculated at a time in demand model
+    # probabilities (None: all at once), not passed to Emme
+    "demand_block_rows": None,
+    # Whether logit models shift utilities by their maximum before
+    # exponentiation (needed with float32), not passed to Emme
+    "stable_logsum": False,
+    # Maximum memory (GB) of day-averaged impedance matrices shared
+    # between tour purposes within iteration, not passed to Emme
+    "impedance_cache_gb": 2,
+    # Number of worker processes in agent simulation (results
+    # do not depend on it), not passed to Emme
+    "agent_processes": 1,
+    # Number of latest iterations for which model state checkpoints
+    # are kept on disk (at least 1), not passed to Emme
+    "checkpoints_kept": 2,
 }
 # Inversed value of time [min/eur]
 vot_inv = {
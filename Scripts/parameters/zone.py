@@ -11,6 +11,17 @@ agent_demand_fraction = 1.0
 # None = different population for each run
 population_draw = 31
 
+# File format of agent and tour output:
+# "columnar" = compressed Parquet (if pyarrow is installed) or HDF5,
+# streamed in batches; "text" = tab-separated text file
+agent_output_format = "columnar"
+
+# Incremental agent simulation: persons whose choice probabilities
+# (maximum change in cumulative probability) have changed less than
+# tolerance since previous iteration keep their tours.
+# None = whole population is simulated in each iteration
+agent_resimulation_tolerance: Union[float, None] = None
+
 # Age groups in zone data
 age_groups: List[Tuple[int, int]] = [ #changed to list for type checker
         (7, 17),
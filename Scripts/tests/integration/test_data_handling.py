@@ -2,11 +2,19 @@ import unittest
 import pandas
 import os
 import numpy
+import openmatrix as omx
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
 from pathlib import Path
 
 import utils.log as log
+from datahandling.checkpoint import IterationCheckpoint
 from datahandling.zonedata import ZoneData
-from datahandling.matrixdata import MatrixData
+from datahandling.matrixdata import (
+    LazyMatrix, MatrixData, StorageOptions, ZoneAggregator,
+    ZoneReconciliation)
 import parameters.assignment as param
 
 
@@ -47,6 +55,152 @@ class MatrixDataTest(unittest.TestCase):
             print("validating matrix type", matrix_type)
             self._validate_matrix_operations(m, matrix_type)
 
+    def test_handle_pool(self):
+        m = MatrixData(RESULTS_PATH / "Matrices" / "uusimaa")
+        with m.open("beeline", "") as mtx:
+            zone_numbers = mtx.zone_numbers
+        with m.open("beeline", "") as mtx:
+            self.assertIs(mtx.zone_numbers, zone_numbers)
+        self.assertEqual(len(m._handles), 1)
+        MatrixData.invalidate(next(iter(m._handles)))
+        self.assertEqual(len(m._handles), 0)
+        with m.open("beeline", "") as mtx:
+            numpy.testing.assert_array_equal(mtx.zone_numbers, zone_numbers)
+        m.close()
+        self.assertEqual(len(m._handles), 0)
+
+    def test_handle_pool_threads(self):
+        m = MatrixData(RESULTS_PATH / "Matrices" / "uusimaa")
+        with m.open("beeline", "") as mtx:
+            pass
+        file_name = next(iter(m._handles))
+        barrier = threading.Barrier(4)
+        open_file = omx.open_file
+
+        def slow_open(*args, **kwargs):
+            time.sleep(0.01)
+            return open_file(*args, **kwargs)
+
+        def get_handle(_):
+            barrier.wait()
+            return m._get_handle(file_name)
+
+        MatrixData.invalidate(file_name)
+        with patch("openmatrix.open_file", side_effect=slow_open) as opened:
+            with ThreadPoolExecutor(4) as pool:
+                handles = list(pool.map(get_handle, range(4)))
+        # File is opened once and the pooled handle is shared
+        self.assertEqual(opened.call_count, 1)
+        self.assertTrue(all(handle is handles[0] for handle in handles))
+        m.close()
+
+    def test_background_writer(self):
+        m = MatrixData(RESULTS_PATH / "Matrices" / "writer_test")
+        zones = numpy.array([5, 6, 7])
+        data = numpy.arange(9, dtype=numpy.float32).reshape(3, 3)
+        m.write("demand", "aht", zones, {"car_work": data}, copy=False)
+        with m.open("demand", "aht", zones, transport_classes=[]) as mtx:
+            numpy.testing.assert_array_equal(mtx["car_work"], data)
+        m.write("demand", "aht", zones, {"car_work": numpy.array([[None]])})
+        with self.assertRaises(Exception):
+            m.join()
+        m.join()
+        m.close()
+
+    def test_zone_aggregation(self):
+        zones = numpy.array([5, 6, 7, 8, 9])
+        mapping = pandas.Series([20, 10, 20, 30, 10], zones)
+        mtx = numpy.arange(25, dtype=numpy.float32).reshape(5, 5)
+        aggregator = ZoneAggregator.get(mapping)
+        self.assertIs(aggregator, ZoneAggregator.get(mapping.copy()))
+        expected = pandas.DataFrame(mtx, zones, zones)
+        for _ in range(2):
+            expected = expected.groupby(mapping).agg("sum").T
+        numpy.testing.assert_array_equal(
+            aggregator.aggregate(mtx), expected.values)
+        numpy.testing.assert_array_equal(aggregator.zone_numbers, [10, 20, 30])
+
+    def test_zone_reconciliation(self):
+        file_zones = numpy.array([5, 7, 9])
+        network_zones = numpy.array([5, 6, 7, 8, 9])
+        plan = ZoneReconciliation.get(file_zones, network_zones)
+        self.assertIs(plan, ZoneReconciliation.get(file_zones, network_zones))
+        self.assertEqual(plan.missing_zones, [6, 8])
+        self.assertEqual(plan.extra_zones.size, 0)
+        mtx = numpy.arange(1, 10, dtype=numpy.float32).reshape(3, 3)
+        expected = pandas.DataFrame(mtx, file_zones, file_zones).reindex(
+            index=network_zones, columns=network_zones, fill_value=0)
+        numpy.testing.assert_array_equal(plan.expand(mtx), expected.values)
+        plan = ZoneReconciliation(numpy.array([5, 10]), network_zones)
+        self.assertEqual(plan.extra_zones.tolist(), [10])
+
+    def test_storage_options(self):
+        with self.assertRaises(ValueError):
+            StorageOptions("no_such_lib").checked()
+        with self.assertRaises(ValueError):
+            StorageOptions(level=10).checked()
+        storage = StorageOptions("zlib", 5, 2).checked()
+        matrix_data = MatrixData(
+            RESULTS_PATH / "Matrices" / "storage_test", storage)
+        zones = numpy.array([1, 2, 3])
+        mtx = numpy.arange(9, dtype=numpy.float32).reshape(3, 3)
+        with matrix_data.open("demand", "aht", zones, m="w") as omx:
+            omx["car"] = mtx
+        with matrix_data.open("demand", "aht", transport_classes=[]) as omx:
+            node = omx._file["car"]
+            self.assertEqual(node.chunkshape, (2, 3))
+            self.assertEqual(node.filters.complevel, 5)
+            numpy.testing.assert_array_equal(omx["car"], mtx)
+        matrix_data.close()
+
+    def test_lazy_matrix(self):
+        matrix_data = MatrixData(RESULTS_PATH / "Matrices" / "lazy_test")
+        zones = numpy.arange(1, 11)
+        data = numpy.arange(100, dtype=numpy.float32).reshape(10, 10)
+        with matrix_data.open("time", "aht", zones, m="w") as omx:
+            omx["car_work"] = data
+        with matrix_data.open("time", "aht", transport_classes=[]) as omx:
+            mtx = omx.lazy("car_work", block_size=4)
+        numpy.testing.assert_array_equal(mtx[1:3, 5:10], data[1:3, 5:10])
+        self.assertEqual(mtx.nr_blocks_read, 2)
+        self.assertEqual(mtx[9, 0], data[9, 0])
+        self.assertEqual(mtx.nr_blocks_read, 3)
+        doubled = 2 * mtx + mtx
+        self.assertEqual(doubled.nr_blocks_read, 0)
+        numpy.testing.assert_array_equal(doubled[0:4, 0:2], 3 * data[0:4, 0:2])
+        self.assertEqual(mtx.nr_blocks_read, 4)
+        numpy.testing.assert_array_equal(numpy.asarray(mtx), data)
+        numpy.testing.assert_array_equal(mtx.T, data.T)
+        self.assertIsInstance(numpy.exp(mtx), numpy.ndarray)
+        matrix_data.close()
+
+    def test_lazy_matrix_threads(self):
+        data = numpy.arange(400, dtype=numpy.float32).reshape(20, 20)
+        reads = []
+        barrier = threading.Barrier(4)
+
+        def read(rows, cols):
+            reads.append((rows.start, cols.start))
+            time.sleep(0.001)
+            return data[rows, cols].copy()
+
+        def use(i):
+            barrier.wait()
+            if i % 2 == 0:
+                return numpy.asarray(mtx).sum()
+            return mtx[0:20, 0:20].sum()
+
+        for _ in range(5):
+            reads.clear()
+            mtx = LazyMatrix(read, data.shape, data.dtype, block_size=4)
+            with ThreadPoolExecutor(4) as pool:
+                sums = list(pool.map(use, range(4)))
+            self.assertEqual(sums, [data.sum()] * 4)
+            # Each block is read once, even if whole matrix is read
+            # concurrently with block reads
+            self.assertEqual(len(reads), 25)
+            self.assertEqual(len(set(reads)), 25)
+
     def _validate_matrix_operations(self, matrix_data: MatrixData,
                                     matrix_type: str):
         emme_scenarios = ["aht", "pt", "iht"]
@@ -62,6 +216,25 @@ class MatrixDataTest(unittest.TestCase):
                     a = mtx[ass_class]
 
 
+class IterationCheckpointTest(unittest.TestCase):
+
+    def test_checkpoint_retention(self):
+        checkpoints = IterationCheckpoint(
+            RESULTS_PATH / "checkpoints" / "retention_test", nr_kept=2)
+        mtx = numpy.arange(4.0).reshape(2, 2)
+        for iteration in range(1, 5):
+            checkpoints.save(
+                iteration, {"aht": {"time": {"car_work": mtx * iteration}}},
+                {"aht": {"car_work": mtx}}, [{"rel_gap": 0.1}], [])
+        saved = sorted(path.name for path in checkpoints.path.iterdir())
+        self.assertEqual(saved, ["iteration_3", "iteration_4"])
+        impedance, _, _, _ = checkpoints.load(3)
+        numpy.testing.assert_array_equal(
+            impedance["aht"]["time"]["car_work"], mtx * 3)
+        with self.assertRaises(FileNotFoundError):
+            checkpoints.load(2)
+
+
 class ZoneDataTest(unittest.TestCase):
 
     def _get_freight_data_2016(self):
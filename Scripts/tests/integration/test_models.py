@@ -1,12 +1,15 @@
 import unittest
+from unittest.mock import patch
+from contextlib import ExitStack
 import numpy
 from pathlib import Path
 
 import utils.log as log
 from travel_iteration import ModelSystem, AgentModelSystem
 from assignment.mock_assignment import MockAssignmentModel
-from datahandling.matrixdata import MatrixData
+from datahandling.matrixdata import LazyMatrix, MatrixData
 from datatypes.demand import Demand
+import parameters.assignment as param
 from tests.integration.test_data_handling import (
     TEST_DATA_PATH,
     RESULTS_PATH,
@@ -58,6 +61,113 @@ class ModelTest(unittest.TestCase):
         
         print("Model system test done")
 
+    def _model_system(self) -> ModelSystem:
+        ass_model = MockAssignmentModel(MatrixData(
+            RESULTS_PATH / "Matrices" / "uusimaa"))
+        return ModelSystem(
+            ZONEDATA_PATH, COSTDATA_PATH, ZONEDATA_PATH,
+            BASE_MATRICES_PATH, RESULTS_PATH, ass_model, "uusimaa")
+
+    def _demand(self, model: ModelSystem) -> dict:
+        return {(ap.name, ass_class): model.dtm.demand[ap.name][ass_class]
+            for ap in model.ass_model.assignment_periods
+            for ass_class in ap.assignment_modes}
+
+    def _run_iteration(self, **settings) -> dict:
+        """Run one iteration with performance settings patched."""
+        with patch.dict(param.performance_settings, settings):
+            model = self._model_system()
+            model.run_iteration(model.assign_base_demand())
+            return self._demand(model)
+
+    def test_float_precision(self):
+        log.initialize(Config())
+        results = {}
+        for precision in ("float64", "float32"):
+            results[precision] = self._run_iteration(
+                float_precision=precision)
+            self.assertEqual(
+                next(iter(results[precision].values())).dtype, precision)
+        max_dev = 0.0
+        max_rel_dev = 0.0
+        for key, mtx in results["float64"].items():
+            dev = numpy.abs(results["float32"][key] - mtx).max()
+            max_dev = max(max_dev, dev)
+            max_rel_dev = max(max_rel_dev, dev / max(mtx.max(), 1.0))
+        print("Max deviation float32 vs float64: {:.3g} ({:.3g} relative)".format(
+            max_dev, max_rel_dev))
+        self.assertLess(max_rel_dev, 1e-3)
+
+    def test_stable_logsum(self):
+        log.initialize(Config())
+        results = {}
+        for precision, stable in (("float64", False), ("float64", True),
+                                  ("float32", True)):
+            results[(precision, stable)] = self._run_iteration(
+                float_precision=precision, stable_logsum=stable)
+        # Tolerances documented in README (`STABLE_LOGSUM`)
+        for key, tolerance in ((("float64", True), 1e-9),
+                               (("float32", True), 1e-3)):
+            max_rel_dev = 0.0
+            for mtx_key, mtx in results[("float64", False)].items():
+                dev = numpy.abs(results[key][mtx_key] - mtx).max()
+                max_rel_dev = max(max_rel_dev, dev / max(mtx.max(), 1.0))
+            print("Max relative deviation with stable logsum ({}): {:.3g}".format(
+                key[0], max_rel_dev))
+            self.assertLess(max_rel_dev, tolerance)
+
+    def test_impedance_cache(self):
+        log.initialize(Config())
+        results = {}
+        for cache_gb in (0, 2):
+            with patch.dict(param.performance_settings,
+                            impedance_cache_gb=cache_gb):
+                model = self._model_system()
+                impedance = model.assign_base_demand()
+                purpose = model.dm.purpose_dict["hb_leisure"]
+                first = purpose.transform_impedance(impedance)
+                second = purpose.transform_impedance(impedance)
+                # Base matrix is shared, purpose-specific changes are not
+                self.assertIs(
+                    first["bike"]["dist"] is second["bike"]["dist"],
+                    cache_gb > 0)
+                self.assertIsNot(
+                    first["car_leisure"]["cost"], second["car_leisure"]["cost"])
+                numpy.testing.assert_array_equal(
+                    first["car_leisure"]["cost"], second["car_leisure"]["cost"])
+                model.run_iteration(impedance)
+                results[cache_gb] = self._demand(model)
+        for key, mtx in results[0].items():
+            numpy.testing.assert_array_equal(results[2][key], mtx)
+
+    def test_resume(self):
+        log.initialize(Config())
+        models = []
+        for resume in (False, True):
+            model = self._model_system()
+            with ExitStack() as stack:
+                # Assignment periods must be initialized also on resume
+                init_calls = [stack.enter_context(patch.object(
+                        ap, name, wraps=getattr(ap, name)))
+                    for ap in model.ass_model.assignment_periods
+                    for name in ("init_assign", "assign_trucks_init")]
+                if resume:
+                    impedance = model.resume(1)
+                    self.assertEqual(model.mode_share, models[0].mode_share[:1])
+                else:
+                    impedance = model.run_iteration(
+                        model.assign_base_demand(), 1)
+            for init_call in init_calls:
+                init_call.assert_called_once_with()
+            model.run_iteration(impedance, 2)
+            models.append(model)
+        self.assertEqual(len(models[1].convergence), 2)
+        for mode, share in models[0].mode_share[-1].items():
+            self.assertAlmostEqual(models[1].mode_share[-1][mode], share)
+        self.assertAlmostEqual(
+            models[1].convergence[-1]["rel_gap"],
+            models[0].convergence[-1]["rel_gap"])
+
     def test_long_dist_models(self):
         print("Testing model system for long trips...")
         ass_model = MockAssignmentModel(
@@ -86,7 +196,10 @@ class ModelTest(unittest.TestCase):
         self.assertIs(type(impedances["time"]), dict)
         self.assertEquals(len(impedances["time"]), 6)
         self.assertIsNotNone(impedances["time"]["transit_work"])
-        self.assertIs(type(impedances["time"]["transit_work"]), numpy.ndarray)
+        # Mock assignment returns matrices which are read lazily in blocks
+        # (lazy reading is tested in `test_data_handling`)
+        self.assertIsInstance(
+            impedances["time"]["transit_work"], LazyMatrix)
         self.assertEquals(impedances["time"]["transit_work"].ndim, 2)
         self.assertEquals(len(impedances["time"]["transit_work"]), 34)
 
@@ -97,7 +210,10 @@ class ModelTest(unittest.TestCase):
         self.assertIsNotNone(impedances["cost"])
         self.assertIs(type(impedances["time"]), dict)
         self.assertIsNotNone(impedances["time"]["transit_work"])
-        self.assertIs(type(impedances["time"]["transit_work"]), numpy.ndarray)
+        # Mock assignment returns matrices which are read lazily in blocks
+        # (lazy reading is tested in `test_data_handling`)
+        self.assertIsInstance(
+            impedances["time"]["transit_work"], LazyMatrix)
         self.assertEquals(impedances["time"]["transit_work"].ndim, 2)
         self.assertEquals(len(impedances["time"]["transit_work"]), 34)
 
@@ -9,6 +9,7 @@ from utils.validate_network import validate
 from assignment.emme_bindings.mock_project import MockProject
 from assignment.emme_assignment import EmmeAssignmentModel
 from datahandling.resultdata import ResultsData
+from utils.precision import emme_performance_settings
 from tests.integration.test_data_handling import TEST_DATA_PATH, RESULTS_PATH
 
 
@@ -115,3 +116,9 @@ class EmmeAssignmentTest(unittest.TestCase):
                                                           self.resultdata.path)
         ass_model.freight_network.read_ship_impedances(is_export=True)
         self.resultdata.flush()
+
+    def test_emme_performance_settings(self):
+        # Emme rejects unknown keys in performance settings
+        self.assertLessEqual(
+            set(emme_performance_settings()),
+            {"number_of_processors", "network_acceleration", "u_turns_allowed"})
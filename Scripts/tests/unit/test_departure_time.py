@@ -116,3 +116,59 @@ class DepartureTimeTest(unittest.TestCase):
         self.assertEquals(dtm.demand["pt"]["car_leisure"].ndim, 2)
         self.assertEquals(dtm.demand["aht"]["bike"].shape[1], 8)
         self.assertNotEquals(dtm.demand["iht"]["car_leisure"][0, 1], 0)
+
+    def test_add_tours(self):
+        class Period:
+            def __init__(self, name):
+                self.name = name
+                self.assignment_modes = [
+                    "car_work", "car_leisure", "transit_leisure"]
+        class Purpose:
+            pass
+        sec_purpose = Purpose()
+        sec_purpose.demand_share = {
+            "car_leisure": {
+                "aht": [[0.011, 0.048], [0.001, 0.078]],
+                "pt": [[0.042, 0.028], [0.025, 0.022]],
+            },
+        }
+        purpose = Purpose()
+        purpose.sec_dest_purpose = sec_purpose
+        purpose.modes = ["car_leisure", "transit_leisure"]
+        purpose.demand_share = {
+            "car_leisure": {"aht": [0.05, 0.02], "pt": [0.3, 0.25]},
+            "transit_leisure": {"aht": [0.07, 0.03], "pt": [0.2, 0.35]},
+        }
+        rng = numpy.random.default_rng(0)
+        nr_tours = 200
+        orig = rng.integers(0, 8, nr_tours)
+        dest = rng.integers(0, 8, nr_tours)
+        sec_dest = numpy.where(
+            rng.random(nr_tours) < 0.3, rng.integers(0, 8, nr_tours), -1)
+        mode = rng.integers(0, 2, nr_tours)
+        sec_dest[mode == 1] = -1
+        class Tours:
+            def od_groups(self):
+                for m, name in enumerate(purpose.modes):
+                    rows = mode == m
+                    yield (purpose, name, orig[rows], dest[rows],
+                           sec_dest[rows])
+        class Tour:
+            matrix = numpy.array([[1.0]])
+        periods = [Period("aht"), Period("pt")]
+        expected = DepartureTimeModel(8, periods)
+        for i in range(nr_tours):
+            tour = Tour()
+            tour.purpose = purpose
+            tour.mode = purpose.modes[mode[i]]
+            tour.dest = dest[i]
+            tour.position = ((orig[i], dest[i]) if sec_dest[i] < 0
+                             else (orig[i], dest[i], sec_dest[i]))
+            expected.add_demand(tour)
+        dtm = DepartureTimeModel(8, periods)
+        dtm.add_tours(Tours())
+        for tp in ("aht", "pt"):
+            for ass_class in purpose.modes:
+                numpy.testing.assert_allclose(
+                    dtm.demand[tp][ass_class], expected.demand[tp][ass_class],
+                    rtol=1e-5)
@@ -3,11 +3,16 @@
 import numpy
 import pandas
 import unittest
+from unittest.mock import patch
 import json
 from pathlib import Path
 
 from datahandling.zonedata import ZoneData
-from models.logit import ModeDestModel, DestModeModel
+from models.logit import LogitModel, ModeDestModel, DestModeModel
+import models.utility_plan
+import parameters.assignment as assignment_param
+from utils.precision import float_dtype
+from utils.benchmark_logit import reference_dest_util
 from datatypes.purpose import attempt_calibration
 from datahandling.resultdata import ResultsData
 from tests.integration.test_data_handling import RESULTS_PATH, ZONEDATA_PATH
@@ -85,6 +90,205 @@ class LogitModelTest(unittest.TestCase):
                     for mode in ("car_leisure", "transit_leisure", "bike", "walk"):
                         self._validate(prob[mode])
 
+    def test_utility_plan(self):
+        class Purpose:
+            pass
+        pur = Purpose()
+        zd = ZoneData(ZONEDATA_PATH, ZONE_INDEXES, "uusimaa", car_dist_cost=0.12)
+        mtx = numpy.arange(720, dtype=numpy.float32)
+        mtx.shape = (24, 30)
+        mtx[numpy.diag_indices(24)] = 0
+        pur.bounds = slice(0, 24)
+        pur.dist = mtx
+        zd["beeline"] = mtx
+        block_bytes = models.utility_plan.BLOCK_BYTES
+        # Small blocks, so that matrix is split into several row blocks
+        models.utility_plan.BLOCK_BYTES = 5 * 30 * mtx.itemsize
+        parameters_path = Path(__file__).parents[2] / "parameters" / "demand"
+        try:
+            for file in parameters_path.rglob("*.json"):
+                parameters = json.loads(file.read_text("utf-8"))
+                if parameters["destination_choice"] is None:
+                    continue
+                pur.name = parameters["name"]
+                model = LogitModel(pur, parameters, zd, None)
+                for mode, b in model.dest_choice_param.items():
+                    keys = (list(b["impedance"]) + list(b["log"])
+                            + list(b.get("transform", {}).get("impedance", [])))
+                    impedance = {key: mtx for key in keys
+                        if key not in ("attraction_size", "transform")}
+                    expected = reference_dest_util(
+                        model, mode, dict(impedance))
+                    numpy.testing.assert_array_equal(
+                        model._calc_dest_util(mode, dict(impedance)),
+                        expected, f"{pur.name}: {mode}")
+        finally:
+            models.utility_plan.BLOCK_BYTES = block_bytes
+
+    def test_zone_data_cache(self):
+        class Purpose:
+            pass
+        pur = Purpose()
+        zd = ZoneData(ZONEDATA_PATH, ZONE_INDEXES, "uusimaa", car_dist_cost=0.12)
+        mtx = numpy.arange(720, dtype=numpy.float32)
+        mtx.shape = (24, 30)
+        pur.bounds = slice(0, 24)
+        pur.dist = mtx
+        pur.name = "hb_leisure"
+        parameters_path = Path(__file__).parents[2] / "parameters" / "demand"
+        parameters = json.loads(
+            (parameters_path / "hb_leisure.json").read_text("utf-8"))
+        model = LogitModel(pur, parameters, zd, None)
+        mode = "car_leisure"
+        b = model.dest_choice_param[mode]
+        impedance = {"time": mtx, "cost": mtx, "dist": mtx}
+        first = model._calc_dest_util(mode, dict(impedance))
+        numpy.testing.assert_array_equal(
+            model._calc_dest_util(mode, dict(impedance)), first)
+        key = next(iter(b["attraction_size"]))
+        zd[key] = 2 * zd[key] + 1
+        second = model._calc_dest_util(mode, dict(impedance))
+        self.assertFalse(numpy.array_equal(first, second))
+        expected = reference_dest_util(model, mode, dict(impedance))
+        numpy.testing.assert_array_equal(second, expected)
+        mode_imp = {"logsum": numpy.arange(24, dtype=numpy.float32)}
+        dummy = next(iter(model.mode_choice_param[mode]["individual_dummy"]))
+        first = model._calc_mode_util(mode, dict(mode_imp))
+        utility = model.mode_utils[mode]
+        with_dummy = model._calc_mode_util(mode, dict(mode_imp), dummy)
+        self.assertFalse(numpy.array_equal(first, with_dummy))
+        numpy.testing.assert_array_equal(
+            model._calc_mode_util(mode, dict(mode_imp)), first)
+        self.assertIsNot(model.mode_utils[mode], utility)
+
+    def test_individual_mode_utils(self):
+        class Purpose:
+            pass
+        pur = Purpose()
+        zd = ZoneData(ZONEDATA_PATH, ZONE_INDEXES, "uusimaa", car_dist_cost=0.12)
+        pur.bounds = slice(0, 24)
+        pur.dist = numpy.ones((24, 30), numpy.float32)
+        pur.name = "hb_leisure"
+        parameters_path = Path(__file__).parents[2] / "parameters" / "demand"
+        parameters = json.loads(
+            (parameters_path / "hb_leisure.json").read_text("utf-8"))
+        model = ModeDestModel(pur, parameters, zd, None)
+        pur.modes = ["car_leisure", "car_pax", "transit_leisure", "bike", "walk"]
+        mode_imp = {"logsum": numpy.arange(24, dtype=numpy.float32)}
+        for mode in pur.modes:
+            model._calc_mode_util(mode, dict(mode_imp))
+        model._fill_individual_mode_utils()
+        dummies = {None, "no_such_dummy"}
+        for mode in pur.modes:
+            dummies.update(model.mode_choice_param[mode]["individual_dummy"])
+        zones = numpy.array([3, 0, 3, 23])
+        for dummy in dummies:
+            expected = numpy.empty((len(zones), len(pur.modes)))
+            for i, mode in enumerate(pur.modes):
+                expected[:, i] = model.mode_utils[mode][zones]
+                b = model.mode_choice_param[mode]["individual_dummy"]
+                if dummy in b:
+                    expected[:, i] += b[dummy]
+            numpy.testing.assert_array_equal(
+                model.calc_individual_mode_utils(zones, dummy), expected)
+            numpy.testing.assert_array_equal(
+                model.calc_individual_mode_prob(zones[0], dummy), expected[0])
+
+    def test_blocked_prob(self):
+        settings = assignment_param.performance_settings
+        with patch.dict(settings, float_precision="float64"):
+            expected = self._calc_purpose_probs()
+            with patch.dict(settings, demand_block_rows=5):
+                result = self._calc_purpose_probs()
+        self.assertGreater(len(expected), 1)
+        for name, (prob, logsum) in expected.items():
+            pandas.testing.assert_series_equal(result[name][1], logsum)
+            if prob is None:
+                self.assertIsNone(result[name][0])
+                continue
+            for mode in prob:
+                numpy.testing.assert_array_equal(
+                    result[name][0][mode], prob[mode], f"{name}: {mode}")
+
+    def test_stable_logsum(self):
+        settings = assignment_param.performance_settings
+        with patch.dict(settings, float_precision="float64",
+                        stable_logsum=False):
+            expected = self._calc_purpose_probs()
+            expected_offset = self._calc_purpose_probs(offset=1000)
+        with patch.dict(settings, float_precision="float64",
+                        stable_logsum=True):
+            result64 = self._calc_purpose_probs()
+        with patch.dict(settings, float_precision="float32",
+                        stable_logsum=True, demand_block_rows=5):
+            # Impedances large enough to make exponentials underflow
+            # in single precision without shifting
+            result32 = self._calc_purpose_probs(offset=1000)
+        for name in expected:
+            for result, reference, rtol, atol in (
+                    (result64, expected, 1e-12, 1e-15),
+                    (result32, expected_offset, 1e-4, 1e-6)):
+                prob, logsum = reference[name]
+                numpy.testing.assert_allclose(
+                    result[name][1], logsum, rtol, err_msg=name)
+                if prob is None:
+                    continue
+                for mode in prob:
+                    numpy.testing.assert_allclose(
+                        result[name][0][mode], prob[mode], rtol, atol,
+                        err_msg=f"{name}: {mode}")
+
+    def _calc_purpose_probs(self, offset=0):
+        """Calculate probabilities and logsums for all purposes.
+
+        Uses current float precision and other performance settings.
+        Impedance matrices (but not distance boundaries) are shifted
+        by `offset`.
+        """
+        class Purpose:
+            pass
+        pur = Purpose()
+        zd = ZoneData(
+            ZONEDATA_PATH, ZONE_INDEXES, "uusimaa", car_dist_cost=0.12)
+        mtx = numpy.arange(720, dtype=float_dtype())
+        mtx.shape = (24, 30)
+        mtx[numpy.diag_indices(24)] = 0
+        pur.bounds = slice(0, 24)
+        pur.orig_zone_numbers = INTERNAL_ZONES
+        pur.dist = mtx
+        zd["beeline"] = mtx
+        mtx = mtx + offset
+        parameters_path = Path(__file__).parents[2] / "parameters" / "demand"
+        results = {}
+        for file in parameters_path.rglob("*.json"):
+            parameters = json.loads(file.read_text("utf-8"))
+            if (parameters["destination_choice"] is None
+                    or parameters["mode_choice"] is None
+                    or parameters["struct"] not in ("dest>mode", "mode>dest")):
+                continue
+            attempt_calibration(parameters)
+            pur.name = parameters["name"]
+            impedance = {}
+            for mode in parameters["mode_choice"]:
+                keys = set()
+                for b in (parameters["destination_choice"].get(mode, {}),
+                          parameters["mode_choice"][mode]):
+                    keys.update(b.get("impedance", []))
+                    keys.update(b.get("log", []))
+                    keys.update(b.get("transform", {}).get("impedance", []))
+                impedance[mode] = {key: mtx for key in keys
+                    if key not in ("attraction_size", "transform", "logsum")}
+            if not all(impedance.values()):
+                # Long-distance modes use logsums of access mode models
+                continue
+            model = (DestModeModel
+                if parameters["struct"] == "dest>mode"
+                else ModeDestModel)(pur, parameters, zd, None)
+            with numpy.errstate(over="ignore", under="ignore"):
+                prob = model.calc_prob(impedance)
+            results[pur.name] = (prob, zd[pur.name].copy())
+        return results
+
     def _validate(self, prob):
         self.assertIs(type(prob), numpy.ndarray)
         self.assertEquals(prob.ndim, 2)
@@ -20,6 +20,8 @@ class PersonTest(unittest.TestCase):
                 "hb_work": 0.3,
                 "hb_other": 0.7,
             }
+            def group_index(self, age_group):
+                return 0
         class Purpose:
             zone_data = ZoneData()
             gen_model = GenMod()
@@ -43,6 +45,6 @@ class PersonTest(unittest.TestCase):
             [0.3, 0.6, 1.0],
             [0.3, 0.6, 1.0],
         ])
-        probs = {"age_18_29": data}
+        probs = numpy.stack([data, data])
         p.add_tours(purposes, probs)
         p.add_tours(purposes, probs)
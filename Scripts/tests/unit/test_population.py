@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from collections import defaultdict
+import numpy
+import pandas
+import unittest
+
+from datatypes.histogram import TourLengthHistogram
+from datatypes.population import (
+    PERSON_FIELDS, TOUR_FIELDS, ChoiceChanges, PersonTable,
+    partition_persons, searchsorted_columns, simulate_tours, stream_ids)
+from datatypes.tour import Tour
+from models.logit import ModeDestModel
+from utils.random_streams import RandomStreams
+import parameters.zone as param
+
+
+NR_ZONES = 8
+WORK_MODES = ["car_work", "transit_work", "walk"]
+LEISURE_MODES = ["car_leisure", "transit_leisure", "walk"]
+PURPOSES = {
+    "hb_work": WORK_MODES,
+    "hb_leisure": LEISURE_MODES,
+    "wb_business": WORK_MODES,
+    "wb_other": LEISURE_MODES,
+    "ob_other": LEISURE_MODES,
+}
+
+
+class Zone:
+    def __init__(self, index):
+        self.index = index
+        self.number = 100 + index
+        self.county = "Uusimaa"
+        self.municipality = "Espoo" if index < 4 else "Vantaa"
+
+
+class GenMod:
+    tour_combinations = [
+        (),
+        ("hb_work",),
+        ("hb_leisure",),
+        ("hb_work", "hb_leisure"),
+        ("hb_leisure", "hb_leisure"),
+    ]
+    param = {
+        "hb_work": 0.4,
+        "hb_leisure": 0.5,
+    }
+
+
+class Model:
+    calc_individual_mode_prob = ModeDestModel.calc_individual_mode_prob
+    calc_individual_mode_utils = ModeDestModel.calc_individual_mode_utils
+    _individual_mode_utils = ModeDestModel._individual_mode_utils
+    _fill_individual_mode_utils = ModeDestModel._fill_individual_mode_utils
+    money_utility = 0.2
+
+    def __init__(self, purpose, rng):
+        self.purpose = purpose
+        self.mode_utils = {mode: rng.normal(size=NR_ZONES)
+            for mode in purpose.modes}
+        self.mode_choice_param = {mode: {"individual_dummy": {}}
+            for mode in purpose.modes}
+        self.mode_choice_param[purpose.modes[0]]["individual_dummy"] = {
+            "car_users": 1.5,
+            f"{purpose.name}_parent_car_work_share": 2.0,
+        }
+        cumsum = rng.uniform(0, 1, (NR_ZONES, NR_ZONES)).cumsum(axis=0)
+        self.cumul_dest_prob = {mode: cumsum / cumsum[-1]
+            for mode in purpose.modes}
+        self._fill_individual_mode_utils()
+
+
+class SecDestPurpose:
+    bounds = slice(0, NR_ZONES)
+
+    def __init__(self):
+        self.gen_model = GenMod()
+        self.gen_model.param = {"hb_leisure": {
+            "car_leisure": 0.6, "transit_leisure": 0.3}}
+        self.attracted_tours = {mode: numpy.zeros(NR_ZONES, int)
+            for mode in LEISURE_MODES}
+
+    def calc_sec_dest_prob(self, mode, impedance, orig, dests):
+        orig_imp = impedance["time"][:, orig]
+        if numpy.ndim(orig) > 0:
+            orig_imp = orig_imp.T
+        weight = numpy.exp(-0.1 * (impedance["time"][dests, :] + orig_imp))
+        return (weight / weight.sum(axis=1, keepdims=True)).T
+
+
+class NoSecDestPurpose:
+    # `Tour.choose_destination()` expects bounds for all purposes
+    bounds = slice(0, 0)
+
+
+class Purpose:
+    def __init__(self, name, seed):
+        rng = numpy.random.default_rng(seed)
+        self.name = name
+        self.modes = PURPOSES[name]
+        self.bounds = slice(0, NR_ZONES)
+        self.gen_model = GenMod()
+        self.sec_dest_purpose = None
+        self.model = Model(self, rng)
+        self.dist = rng.uniform(0, 60, (NR_ZONES, NR_ZONES))
+        zone_numbers = 100 + numpy.arange(NR_ZONES)
+        self.orig_mappings = {"area": pandas.Series(
+            ["a", "a", "b", "b", "b", "c", "c", "c"], zone_numbers)}
+        self.dest_mappings = self.orig_mappings
+        self.generated_tours = {}
+        self.attracted_tours = {}
+        self.histograms = {}
+        self.aggregates = {"area": {}}
+        self.within_zone_tours = {}
+        for mode in self.modes:
+            self.generated_tours[mode] = numpy.zeros(NR_ZONES, int)
+            self.attracted_tours[mode] = numpy.zeros(NR_ZONES, int)
+            self.histograms[mode] = TourLengthHistogram(name)
+            self.aggregates["area"][mode] = pandas.DataFrame(
+                0, ["a", "b", "c"], ["a", "b", "c"])
+            self.within_zone_tours[mode] = pandas.Series(0, zone_numbers)
+        # Name used in `Tour.choose_destination()`
+        self.own_zone_demand = self.within_zone_tours
+
+
+class CarUseModel:
+    def calc_individual_prob(self, age_group, gender):
+        return numpy.linspace(0.2, 0.8, NR_ZONES)
+
+
+class PopulationTest(unittest.TestCase):
+    def _purposes(self):
+        purposes = {name: Purpose(name, i)
+            for i, name in enumerate(PURPOSES)}
+        purposes["hb_leisure"].sec_dest_purpose = SecDestPurpose()
+        return purposes
+
+    def _persons(self, nr_persons=300):
+        rng = numpy.random.default_rng(3)
+        return PersonTable(
+            {i: Zone(i) for i in range(NR_ZONES)},
+            numpy.sort(rng.integers(0, NR_ZONES, nr_persons)),
+            rng.integers(0, 5, nr_persons),
+            rng.integers(7, 99, nr_persons),
+            rng.random(nr_persons) < 0.5,
+            numpy.zeros(nr_persons, int),
+            GenMod(),
+            RandomStreams(31),
+            numpy.arange(nr_persons, dtype=numpy.uint64))
+
+    def _tour_probs(self, seed=4):
+        rng = numpy.random.default_rng(seed)
+        # Population groups: 5 age groups
+        cumsum = rng.uniform(
+            0, 1, (5, NR_ZONES, len(GenMod.tour_combinations))
+            ).cumsum(axis=2)
+        return cumsum / cumsum[:, :, -1:]
+
+    def test_searchsorted_columns(self):
+        rng = numpy.random.default_rng(0)
+        cumul = rng.uniform(0, 1, (20, 7)).cumsum(axis=0)
+        cols = rng.integers(0, 7, 500)
+        values = rng.uniform(0, cumul[-1].max() + 1, 500)
+        expected = [numpy.searchsorted(cumul[:, col], val)
+            for col, val in zip(cols, values)]
+        numpy.testing.assert_array_equal(
+            searchsorted_columns(cumul, cols, values), expected)
+
+    def test_add_tours(self):
+        persons = self._persons()
+        persons.decide_car_use(CarUseModel())
+        self.assertFalse(persons.is_car_user[persons.age < 18].any())
+        self.assertTrue(persons.is_car_user.any())
+        purposes = self._purposes()
+        tour_probs = self._tour_probs()
+        tours = persons.add_tours(purposes, tour_probs)
+        names = list(purposes)
+        for p in range(len(persons)):
+            comb = GenMod.tour_combinations[numpy.searchsorted(
+                tour_probs[persons.age_group[p], persons.zone[p]],
+                persons.tour_combination_draw[p])]
+            rows = numpy.flatnonzero(tours.person == p)
+            home = rows[tours.source[rows] < 0]
+            self.assertEqual(
+                tuple(names[i] for i in tours.purpose[home]), comb)
+        # Non-home tours follow their source tour
+        non_home = numpy.flatnonzero(tours.source >= 0)
+        self.assertGreater(len(non_home), 0)
+        self.assertTrue((tours.source[non_home] < non_home).all())
+        numpy.testing.assert_array_equal(
+            tours.person[tours.source[non_home]], tours.person[non_home])
+        for i in non_home:
+            src_name = names[tours.purpose[tours.source[i]]]
+            self.assertIn(names[tours.purpose[i]],
+                (("wb_business", "wb_other") if src_name == "hb_work"
+                 else ("ob_other",)))
+        # Tours chosen again keep their draws
+        again = persons.add_tours(purposes, self._tour_probs(seed=5))
+        def keys(table):
+            return table.person * 10000 + table._codes()
+        _, idx, again_idx = numpy.intersect1d(
+            keys(tours), keys(again), return_indices=True)
+        self.assertGreater(len(idx), 0)
+        self.assertLess(len(idx), len(tours))
+        numpy.testing.assert_array_equal(
+            again.mode_draw[again_idx], tours.mode_draw[idx])
+        numpy.testing.assert_array_equal(
+            again.dest_draw[again_idx], tours.dest_draw[idx])
+
+    def test_choices(self):
+        persons = self._persons()
+        persons.decide_car_use(CarUseModel())
+        purposes = self._purposes()
+        tours = simulate_tours(persons, purposes, self._tour_probs())
+        rng = numpy.random.default_rng(5)
+        impedance = {"time": rng.uniform(1, 30, (NR_ZONES, NR_ZONES))}
+        sec_purpose = purposes["hb_leisure"].sec_dest_purpose
+        for mode in LEISURE_MODES[:2]:
+            tours.choose_secondary_destinations(sec_purpose, mode, impedance)
+        # Statistics are built only at end of iteration
+        self.assertEqual(
+            purposes["hb_work"].histograms["car_work"].histogram.sum(), 0)
+        tours.statistics.build()
+        self.assertTrue((tours.sec_dest >= 0).any())
+        # Same choices with tour objects
+        ref_purposes = self._purposes()
+        ref_sec_purpose = ref_purposes["hb_leisure"].sec_dest_purpose
+        for purpose in ref_purposes.values():
+            if purpose.sec_dest_purpose is None:
+                purpose.sec_dest_purpose = NoSecDestPurpose()
+        sec_dest_tours = {mode: [defaultdict(list) for _ in range(NR_ZONES)]
+            for mode in LEISURE_MODES}
+        objects = []
+        for i in range(len(tours)):
+            purpose = ref_purposes[tours.purpose_list[tours.purpose[i]].name]
+            if tours.source[i] < 0:
+                origin = Zone(tours.orig[i])
+            else:
+                origin = objects[tours.source[i]]
+            tour = Tour(purpose, origin, tours.person[i])
+            tour._mode_draw = tours.mode_draw[i, :len(purpose.modes)]
+            tour._dest_draw = tours.dest_draw[i]
+            tour._sec_dest_gen_draw = tours.sec_dest_gen_draw[i]
+            tour._sec_dest_draw = tours.sec_dest_draw[i]
+            tour.choose_mode(persons.is_car_user[tours.person[i]])
+            tour.choose_destination(sec_dest_tours)
+            objects.append(tour)
+        for mode in LEISURE_MODES[:2]:
+            for orig in range(NR_ZONES):
+                dests = list(sec_dest_tours[mode][orig])
+                probs = ref_sec_purpose.calc_sec_dest_prob(
+                    mode, impedance, orig, dests).cumsum(axis=0)
+                for j, dest in enumerate(dests):
+                    for tour in sec_dest_tours[mode][orig][dest]:
+                        tour.choose_secondary_destination(probs[:, j])
+        views = list(tours.views())
+        for view, tour in zip(views, objects):
+            self.assertEqual(view.mode, tour.mode)
+            self.assertEqual(view.position, tour.position)
+            self.assertAlmostEqual(view.total_access, tour.total_access)
+        for name in purposes:
+            for mode in purposes[name].modes:
+                purpose = purposes[name]
+                reference = ref_purposes[name]
+                numpy.testing.assert_array_equal(
+                    purpose.generated_tours[mode],
+                    reference.generated_tours[mode])
+                numpy.testing.assert_array_equal(
+                    purpose.attracted_tours[mode],
+                    reference.attracted_tours[mode])
+                numpy.testing.assert_allclose(
+                    purpose.histograms[mode].histogram,
+                    reference.histograms[mode].histogram)
+                pandas.testing.assert_frame_equal(
+                    purpose.aggregates["area"][mode],
+                    reference.aggregates["area"][mode])
+                pandas.testing.assert_series_equal(
+                    purpose.within_zone_tours[mode],
+                    reference.own_zone_demand[mode])
+        for mode in LEISURE_MODES:
+            numpy.testing.assert_array_equal(
+                sec_purpose.attracted_tours[mode],
+                ref_sec_purpose.attracted_tours[mode])
+        # Costs
+        imp = {tp: {mtx_type: {mode: rng.uniform(1, 30, (NR_ZONES, NR_ZONES))
+                    for mode in WORK_MODES[:2] + LEISURE_MODES[:2]}
+                for mtx_type in ("time", "cost")}
+            for tp in ("aht", "pt", "iht")}
+        tours.calc_cost(imp)
+        for view, tour in zip(views, objects):
+            tour.calc_cost(imp)
+            self.assertAlmostEqual(view.cost, tour.cost)
+            self.assertAlmostEqual(view.gen_cost, tour.gen_cost)
+
+    def test_output_columns(self):
+        persons = self._persons()
+        persons.decide_car_use(CarUseModel())
+        purposes = self._purposes()
+        access = pandas.Series(numpy.linspace(1, 2, NR_ZONES))
+        purposes["hb_work"].model.accessibility = {
+            "hb_work_sustainable_scaled": access}
+        # Name longer than 16 characters is not cut
+        purposes["ob_other"].name = "hb_leisure_overnight"
+        tours = simulate_tours(persons, purposes, self._tour_probs())
+        self.assertIn(
+            "hb_leisure_overnight",
+            tours.output_columns(slice(0, len(tours)))["purpose_name"])
+        columns = persons.output_columns(slice(10, 20))
+        self.assertEqual(list(columns), list(PERSON_FIELDS))
+        for i, person in enumerate(list(persons.views())[10:20]):
+            self.assertEqual(
+                "\t".join(str(columns[attr][i]) for attr in PERSON_FIELDS),
+                str(person))
+        columns = tours.output_columns(slice(0, len(tours)))
+        self.assertEqual(list(columns), list(TOUR_FIELDS))
+        for i, tour in enumerate(tours.views()):
+            self.assertEqual(columns["person_id"][i], tour.person_id)
+            self.assertEqual(columns["purpose_name"][i], tour.purpose_name)
+            self.assertEqual(columns["mode"][i], tour.mode)
+            if tour.purpose_name == "hb_work":
+                self.assertEqual(
+                    columns["sustainable_access"][i], -access[tours.orig[i]])
+            else:
+                self.assertTrue(numpy.isnan(columns["sustainable_access"][i]))
+
+    def test_incremental_simulation(self):
+        persons = self._persons()
+        persons.decide_car_use(CarUseModel())
+        was_car_user = persons.is_car_user
+        purposes = self._purposes()
+        tour_probs = self._tour_probs()
+        changes = ChoiceChanges(0.01)
+        resimulate = changes.select(
+            persons, purposes, tour_probs, None, was_car_user)
+        self.assertTrue(resimulate.all())
+        previous = simulate_tours(persons, purposes, tour_probs)
+        # Destination probabilities change in one origin zone
+        model = purposes["hb_work"].model
+        cumul = model.cumul_dest_prob["car_work"].copy()
+        cumul[:-1, 2] = cumul[:-1, 2]**2
+        model.cumul_dest_prob = dict(model.cumul_dest_prob, car_work=cumul)
+        resimulate = changes.select(
+            persons, purposes, tour_probs, previous, was_car_user)
+        has_work_tour = numpy.zeros(len(persons), bool)
+        has_work_tour[previous.person[
+            (previous.purpose == 0) & (previous.orig == 2)]] = True
+        numpy.testing.assert_array_equal(resimulate, has_work_tour)
+        self.assertTrue(0 < resimulate.sum() < len(persons))
+        tours = simulate_tours(
+            persons, purposes, tour_probs, 1, previous, resimulate)
+        full = simulate_tours(persons, purposes, tour_probs)
+        is_kept = ~resimulate[previous.person]
+        kept = previous.take_columns(is_kept)
+        for key, val in tours.take_columns(
+                ~resimulate[tours.person]).items():
+            numpy.testing.assert_array_equal(val, kept[key])
+        is_new = resimulate[full.person]
+        new = full.take_columns(is_new)
+        for key, val in tours.take_columns(resimulate[tours.person]).items():
+            numpy.testing.assert_array_equal(val, new[key])
+        # Unchanged probabilities
+        resimulate = changes.select(
+            persons, purposes, tour_probs, tours, persons.is_car_user)
+        self.assertFalse(resimulate.any())
+
+    def test_synthesize(self):
+        zones = [Zone(i) for i in range(NR_ZONES)]
+        rng = numpy.random.default_rng(6)
+        weights = rng.uniform(0, 1, (NR_ZONES, 6))
+        weights /= weights.sum(axis=1, keepdims=True)
+        zone_pop = rng.integers(0, 40, NR_ZONES)
+        income_model = (numpy.arange(NR_ZONES) == 3).astype(int)
+        streams = RandomStreams(31)
+        persons = PersonTable.synthesize(
+            zones, weights, zone_pop, income_model, GenMod(), streams)
+        # Same persons as drawn one zone at a time
+        zone, age_group, age, sex = [], [], [], []
+        for z, w, n in zip(zones, weights, zone_pop):
+            ids = stream_ids(z.number, numpy.arange(n))
+            idx = numpy.minimum(numpy.cumsum(w).searchsorted(
+                streams.random(RandomStreams.AGE_GROUP, ids), "right"),
+                len(w) - 1) - 1
+            age_draw = streams.random(RandomStreams.AGE, ids)
+            sex_draw = streams.random(RandomStreams.SEX, ids)
+            for i, age_u, sex_u in zip(idx, age_draw, sex_draw):
+                if i != -1:
+                    lower, upper = param.age_groups[i]
+                    zone.append(z.index)
+                    age_group.append(i)
+                    age.append(lower + int(age_u * (upper-lower+1)))
+                    sex.append(sex_u < 0.5)
+        numpy.testing.assert_array_equal(persons.zone, zone)
+        numpy.testing.assert_array_equal(persons.age_group, age_group)
+        numpy.testing.assert_array_equal(persons.age, age)
+        numpy.testing.assert_array_equal(persons.sex, sex)
+        numpy.testing.assert_array_equal(
+            persons.income_model, persons.zone == 3)
+        objects = persons.to_persons(["model", "helsinki_model"])
+        self.assertEqual(len(objects), len(persons))
+        for i in (0, -1):
+            self.assertEqual(objects[i].id, persons.id[i])
+            self.assertEqual(objects[i].zone.index, zone[i])
+            self.assertEqual(objects[i].age, age[i])
+            self.assertEqual(objects[i].stream_id, persons.stream_id[i])
+
+    def test_partitions(self):
+        zone = numpy.array([0, 0, 0, 1, 1, 2, 4, 4, 4, 4])
+        self.assertEqual(
+            partition_persons(zone, 3), [(0, 5), (5, 10)])
+        self.assertEqual(partition_persons(zone, 1), [(0, 10)])
+        self.assertEqual(partition_persons(zone[:0], 2), [(0, 0)])
+        with self.assertRaises(ValueError):
+            partition_persons(zone[::-1], 2)
+
+    def test_simulate_in_processes(self):
+        persons = self._persons()
+        persons.decide_car_use(CarUseModel())
+        results = []
+        for nr_processes in (1, 3):
+            purposes = self._purposes()
+            tours = simulate_tours(
+                persons, purposes, self._tour_probs(), nr_processes)
+            results.append((tours, purposes))
+        (tours, purposes), (parallel, parallel_purposes) = results
+        for key, val in tours.columns().items():
+            numpy.testing.assert_array_equal(val, getattr(parallel, key))
+        for name in purposes:
+            for mode in purposes[name].modes:
+                numpy.testing.assert_array_equal(
+                    purposes[name].generated_tours[mode],
+                    parallel_purposes[name].generated_tours[mode])
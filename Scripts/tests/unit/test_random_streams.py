@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import numpy
+import unittest
+
+from utils.random_streams import RandomStreams, philox4x32
+
+
+class RandomStreamsTest(unittest.TestCase):
+    def test_philox(self):
+        # Known-answer vectors of Philox-4x32-10 (Random123)
+        vectors = [
+            ((0, 0, 0, 0), (0, 0),
+             (0x6627e8d5, 0xe169c58d, 0xbc57ac4c, 0x9b00dbd8)),
+            ((0xffffffff,) * 4, (0xffffffff,) * 2,
+             (0x408f276d, 0x41c83b0e, 0xa20bc7c6, 0x6d5451fd)),
+            ((0x243f6a88, 0x85a308d3, 0x13198a2e, 0x03707344),
+             (0xa4093822, 0x299f31d0),
+             (0xd16cfe09, 0x94fdcceb, 0x5001e420, 0x24126ea1)),
+        ]
+        for counter, key, expected in vectors:
+            result = philox4x32([numpy.array([c]) for c in counter], key)
+            self.assertEqual(tuple(int(r[0]) for r in result), expected)
+
+    def test_streams(self):
+        streams = RandomStreams(31)
+        ids = numpy.arange(20000, dtype=numpy.uint64)
+        draws = streams.random(RandomStreams.DEST, ids)
+        self.assertTrue(((draws > 0) & (draws < 1)).all())
+        self.assertLess(abs(draws.mean() - 0.5), 0.01)
+        # Draws depend only on id, not on other ids drawn at same time
+        numpy.testing.assert_array_equal(
+            streams.random(RandomStreams.DEST, ids[::-7]), draws[::-7])
+        # Different purposes, sub-ids and seeds give different draws
+        for other in (streams.random(RandomStreams.MODE, ids),
+                      streams.random(RandomStreams.DEST, ids, ids + 1),
+                      RandomStreams(32).random(RandomStreams.DEST, ids)):
+            self.assertLess(abs(numpy.corrcoef(draws, other)[0, 1]), 0.05)
+        rows = streams.gumbel(RandomStreams.MODE, ids[:10], size=3)
+        self.assertEqual(rows.shape, (10, 3))
+        numpy.testing.assert_array_equal(
+            streams.gumbel(RandomStreams.MODE, ids[:10], size=2), rows[:, :2])
+        normal = streams.normal(RandomStreams.INCOME, ids)
+        self.assertAlmostEqual(normal.mean(), 0, places=1)
+        self.assertAlmostEqual(normal.std(), 1, places=1)
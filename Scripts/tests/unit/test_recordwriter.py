@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from pathlib import Path
+import tempfile
+import unittest
+import numpy
+import pandas
+import tables
+
+from datahandling.recordwriter import record_writer
+
+
+FIELDS = {
+    "id": numpy.int64,
+    "mode": "U16",
+    "cost": numpy.float64,
+    "is_car_user": bool,
+}
+
+
+class RecordWriterTest(unittest.TestCase):
+    def _columns(self, start, stop):
+        ids = numpy.arange(start, stop)
+        return {
+            "id": ids,
+            "mode": numpy.where(ids % 2 == 0, "car_work", "kävely"),
+            "cost": ids / 10,
+            "is_car_user": ids % 3 == 0,
+        }
+
+    def _write(self, path, fmt):
+        writer = record_writer(path, FIELDS, fmt, batch_size=16)
+        # Appends both smaller and larger than batch size
+        for start, stop in ((0, 5), (5, 45), (45, 50)):
+            writer.append(self._columns(start, stop))
+        writer.close()
+        self.assertEqual(writer.nr_records, 50)
+        return writer.path
+
+    def test_hdf5(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = self._write(Path(tmpdir) / "tours", "hdf5")
+            self.assertEqual(path.suffix, ".h5")
+            with tables.open_file(path) as f:
+                records = f.root.records.read()
+        expected = self._columns(0, 50)
+        for name in FIELDS:
+            values = records[name]
+            if values.dtype.kind == 'S':
+                values = numpy.char.decode(values, "utf-8")
+            numpy.testing.assert_array_equal(values, expected[name])
+
+    def test_text(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = self._write(Path(tmpdir) / "tours", "text")
+            self.assertEqual(path.suffix, ".txt")
+            df = pandas.read_csv(path, sep="\t")
+        self.assertEqual(list(df.columns), list(FIELDS))
+        expected = self._columns(0, 50)
+        for name in FIELDS:
+            numpy.testing.assert_array_equal(df[name], expected[name])
+
+    def test_string_overflow(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            writer = record_writer(Path(tmpdir) / "tours", FIELDS, "text")
+            columns = self._columns(0, 2)
+            columns["mode"] = numpy.array(["car_work", "hb_leisure_overnight"])
+            with self.assertRaises(ValueError):
+                writer.append(columns)
+            writer.close()
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            record_writer(Path("tours"), FIELDS, "csv")
@@ -0,0 +1,71 @@
+import threading
+import time
+import unittest
+
+from demand.scheduler import PurposeScheduler, PurposeTask
+
+
+class PurposeSchedulerTest(unittest.TestCase):
+
+    def _tasks(self, deps, nbytes=1, main_thread=()):
+        self.events = []
+        self.committed = []
+        self.running = 0
+        self.max_running = 0
+        lock = threading.Lock()
+        def calc(i):
+            with lock:
+                self.events.append(("start", i))
+                self.running += 1
+                self.max_running = max(self.max_running, self.running)
+            # Later tasks finish first, if run concurrently
+            time.sleep(0.01 * (len(deps) - i))
+            with lock:
+                self.running -= 1
+                self.events.append(("end", i))
+            return i
+        return [PurposeTask(
+                str(i), lambda i=i: calc(i), self.committed.append,
+                frozenset(d), nbytes, in_main_thread=(i in main_thread))
+            for i, d in enumerate(deps)]
+
+    def test_order_and_dependencies(self):
+        deps = [[], [], [0, 1], [], [2]]
+        PurposeScheduler(4, 100).run(self._tasks(deps))
+        self.assertEqual(self.committed, list(range(len(deps))))
+        for i, d in enumerate(deps):
+            for j in d:
+                self.assertLess(self.events.index(("end", j)),
+                                self.events.index(("start", i)))
+        self.assertGreater(self.max_running, 1)
+
+    def test_memory_budget(self):
+        PurposeScheduler(4, 2).run(self._tasks([[]] * 6, nbytes=1))
+        self.assertEqual(self.committed, list(range(6)))
+        self.assertEqual(self.max_running, 2)
+        # Task exceeding budget is run alone
+        PurposeScheduler(4, 2).run(self._tasks([[]] * 3, nbytes=5))
+        self.assertEqual(self.committed, list(range(3)))
+        self.assertEqual(self.max_running, 1)
+
+    def test_main_thread_task(self):
+        main_thread = threading.current_thread()
+        threads = []
+        tasks = self._tasks([[], [], [], []], main_thread=(2,))
+        task = tasks[2]
+        def calc():
+            threads.append(threading.current_thread())
+            self.assertEqual(self.committed, [0, 1])
+            return task.calc()
+        tasks[2] = task._replace(calc=calc)
+        PurposeScheduler(4, 100).run(tasks)
+        self.assertEqual(threads, [main_thread])
+        self.assertEqual(self.committed, [0, 1, 2, 3])
+
+    def test_error(self):
+        def fail():
+            raise ValueError("test")
+        tasks = self._tasks([[], []])
+        tasks[1] = tasks[1]._replace(calc=fail)
+        with self.assertRaises(ValueError):
+            PurposeScheduler(2, 100).run(tasks)
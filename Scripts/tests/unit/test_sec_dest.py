@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from concurrent.futures import ThreadPoolExecutor
+import numpy
+import unittest
+
+from assignment.departure_time import DepartureTimeModel
+from datatypes.demand import SecDestDemand
+from datatypes.purpose import SecDestPurpose
+from models.logit import SecDestModel
+
+
+NR_ZONES = 12
+MODE = "car_leisure"
+
+
+class Period:
+    def __init__(self, name):
+        self.name = name
+        self.assignment_modes = ["car_work", MODE]
+
+
+class ZoneData:
+    def __init__(self):
+        rng = numpy.random.default_rng(1)
+        self._values = {"population": rng.uniform(0, 100, NR_ZONES)}
+
+    def get_data(self, key, bounds, generation=False):
+        return self._values[key][bounds]
+
+    def revision(self, key):
+        return 0
+
+
+class SecDestTest(unittest.TestCase):
+    def _purpose(self):
+        purpose = SecDestPurpose.__new__(SecDestPurpose)
+        purpose.name = "hoo"
+        purpose.bounds = slice(0, NR_ZONES)
+        purpose.dest_interval = slice(0, NR_ZONES)
+        purpose.demand_share = {MODE: {
+            "aht": [[0.1, 0.05], [0.02, 0.08]],
+            "pt": [[0.3, 0.1], [0.2, 0.25]],
+        }}
+        parameters = {
+            "destination_choice": {MODE: {
+                "attraction": {"population": 0.01},
+                "impedance": {"time": -0.05, "cost": -0.1},
+                "log": {},
+                "attraction_size": {},
+            }},
+            "mode_choice": None,
+            "distance_boundaries": {MODE: (0, 60)},
+        }
+        purpose.model = SecDestModel(purpose, parameters, ZoneData(), None)
+        purpose.attracted_tours = {MODE: numpy.zeros(NR_ZONES)}
+        rng = numpy.random.default_rng(0)
+        tours = rng.uniform(0, 0.3, (NR_ZONES, NR_ZONES))
+        # Origin with no pair above threshold, and origin without tours
+        tours[3] = 0.01
+        tours[5] = 0
+        purpose.tours = {MODE: tours}
+        return purpose
+
+    def _distribute(self, purpose, impedance, blocks, nr_threads):
+        demand = SecDestDemand(
+            purpose, MODE, NR_ZONES, NR_ZONES, 3 * nr_threads)
+        def distribute(block_nrs):
+            for i in block_nrs:
+                demand.add_block(i, blocks[i], *purpose.distribute_tour_block(
+                    MODE, impedance, blocks[i]))
+        with ThreadPoolExecutor(nr_threads) as pool:
+            futures = [pool.submit(
+                    distribute, range(i, len(blocks), nr_threads))
+                for i in range(nr_threads)]
+            for future in futures:
+                future.result()
+        purpose.attracted_tours[MODE] += demand.matrix.sum(0)
+        return demand
+
+    def test_distribute_tour_block(self):
+        rng = numpy.random.default_rng(2)
+        impedance = {mtx_type: rng.uniform(1, 30, (NR_ZONES, NR_ZONES))
+            for mtx_type in ("time", "cost", "dist")}
+        periods = [Period("aht"), Period("pt")]
+        expected = DepartureTimeModel(NR_ZONES, periods, ["car_work", MODE])
+        reference = self._purpose()
+        for orig in range(NR_ZONES):
+            expected.add_demand(
+                reference.distribute_tours(MODE, impedance, orig))
+        purpose = self._purpose()
+        blocks = purpose.origin_blocks(MODE, 7)
+        self.assertGreater(len(blocks), 1)
+        self.assertEqual(blocks[0].start, 0)
+        self.assertEqual(blocks[-1].stop, NR_ZONES)
+        demand = self._distribute(purpose, impedance, blocks, 3)
+        sequential = self._distribute(self._purpose(), impedance, blocks, 1)
+        # Sum does not depend on number of threads
+        numpy.testing.assert_array_equal(demand.matrix, sequential.matrix)
+        numpy.testing.assert_array_equal(
+            demand.orig_matrix, sequential.orig_matrix)
+        result = DepartureTimeModel(NR_ZONES, periods, ["car_work", MODE])
+        result.add_sec_dest_demand(demand, 1)
+        parallel = DepartureTimeModel(NR_ZONES, periods, ["car_work", MODE])
+        parallel.add_sec_dest_demand(demand, 4)
+        for tp in ("aht", "pt"):
+            numpy.testing.assert_allclose(
+                result.demand[tp][MODE], expected.demand[tp][MODE],
+                rtol=1e-5, atol=1e-9)
+            numpy.testing.assert_array_equal(
+                parallel.demand[tp][MODE], result.demand[tp][MODE])
+        numpy.testing.assert_allclose(
+            purpose.attracted_tours[MODE], reference.attracted_tours[MODE],
+            rtol=1e-5)
+        self.assertAlmostEqual(
+            purpose.attracted_tours[MODE].sum(),
+            self._purpose().tours[MODE].sum(), places=5)
+
+    def test_cancel(self):
+        purpose = self._purpose()
+        demand = SecDestDemand(purpose, MODE, NR_ZONES, NR_ZONES, 2)
+        with ThreadPoolExecutor(1) as pool:
+            # Block 1 waits for block 0, which is never added
+            future = pool.submit(
+                demand.add_block, 1, slice(0, 1), numpy.array([0]),
+                numpy.ones((1, NR_ZONES)), numpy.ones((NR_ZONES, 1)))
+            demand.cancel()
+            with self.assertRaises(RuntimeError):
+                future.result()
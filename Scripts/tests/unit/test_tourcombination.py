@@ -5,6 +5,7 @@ import pandas
 import unittest
 from datahandling.zonedata import ZoneData
 from models.tour_combinations import TourCombinationModel
+import parameters.tour_combinations as tc_param
 from tests.integration.test_data_handling import ZONEDATA_PATH
 
 
@@ -21,3 +22,60 @@ class TourCombinationModelTest(unittest.TestCase):
         zd = ZoneData(ZONEDATA_PATH, zi, "uusimaa", car_dist_cost=0.12)
         zd._values["hb_edu_student"] = pandas.Series(0.0, INTERNAL_ZONES)
         model = TourCombinationModel(zd)
+
+    def test_cumul_prob(self):
+        zi = numpy.array(INTERNAL_ZONES + EXTERNAL_ZONES)
+        zd = ZoneData(ZONEDATA_PATH, zi, "uusimaa", car_dist_cost=0.12)
+        zd._values["hb_edu_student"] = pandas.Series(
+            numpy.linspace(0, 1, len(INTERNAL_ZONES)), INTERNAL_ZONES)
+        model = TourCombinationModel(zd)
+        dummies = {age_group: 0.1*i
+            for i, age_group in enumerate(model.age_groups)}
+        model.param = {
+            0: {(): {
+                "constant": 0.0, "zone": {},
+                "individual_dummy": dict.fromkeys(model.age_groups, 0.0)}},
+            1: {
+                ("hb_work",): {
+                    "constant": 0.5, "zone": {"hb_edu_student": -1.0},
+                    "individual_dummy": dummies},
+                ("hb_edu_basic",): {
+                    "constant": -0.5, "zone": {},
+                    "individual_dummy": {"age_7_17": 1.0}},
+            },
+            2: {("hb_work", "hb_leisure"): {
+                "constant": -1.0, "zone": {"hb_edu_student": 0.5},
+                "individual_dummy": dummies}},
+        }
+        model.conditions = {("hb_edu_basic",): (True, "age_7_17")}
+        model.increases = {1: 1.1, 2: 0.9}
+        model.tour_combinations = [combination for nr_tours in model.param
+            for combination in model.param[nr_tours]]
+        bounds = slice(0, len(INTERNAL_ZONES))
+        cumul = model.calc_cumul_prob(bounds)
+        self.assertEqual(cumul.shape, (
+            len(model.age_groups), len(INTERNAL_ZONES),
+            len(model.tour_combinations)))
+        for age_group in model.age_groups:
+            prob = model.calc_prob(age_group, bounds)
+            expected = numpy.column_stack([
+                numpy.broadcast_to(prob[combination], len(INTERNAL_ZONES))
+                for combination in model.tour_combinations]).cumsum(axis=1)
+            numpy.testing.assert_allclose(
+                cumul[model.group_index(age_group)], expected)
+        # Nested logit written out for one zone and group
+        x = numpy.asarray(zd["hb_edu_student"][bounds])[-1]
+        scale = tc_param.tour_number_scale
+        one_exps = [numpy.exp(0.5 - x + 0.0), numpy.exp(-0.5 + 1.0)]
+        one_prob = 1.1 * sum(one_exps)**scale / (
+            1 + sum(one_exps)**scale + numpy.exp(-1.0 + 0.5*x)**scale)
+        two_prob = 0.9 * numpy.exp(-1.0 + 0.5*x)**scale / (
+            1 + sum(one_exps)**scale + numpy.exp(-1.0 + 0.5*x)**scale)
+        expected = numpy.array([
+            1 - one_prob - two_prob,
+            one_prob * one_exps[0] / sum(one_exps),
+            one_prob * one_exps[1] / sum(one_exps),
+            two_prob]).cumsum()
+        numpy.testing.assert_allclose(
+            cumul[model.group_index("age_7_17"), -1], expected)
+        numpy.testing.assert_allclose(cumul[:, :, -1], 1)
@@ -1,12 +1,10 @@
-import threading
-import multiprocessing
 import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
 from typing import Any, Callable, Dict, List, Set, Union, Iterable, Optional, cast
 import numpy # type: ignore
 import pandas
-import random
-from collections import defaultdict
 from assignment.abstract_assignment import AssignmentModel
 from assignment.emme_assignment import EmmeAssignmentModel
 from assignment.assignment_period import AssignmentPeriod
@@ -16,16 +14,19 @@ import utils.log as log
 import assignment.departure_time as dt
 from datahandling.resultdata import ResultsData
 from datahandling.zonedata import ZoneData
-from datahandling.matrixdata import MatrixData
+from datahandling.matrixdata import MatrixData, StorageOptions
+from datahandling.checkpoint import IterationCheckpoint
 from demand.trips import DemandModel
+from demand.scheduler import PurposeScheduler, PurposeTask, nr_threads
 from demand.external import ExternalPurpose
 from datatypes.purpose import new_tour_purpose
-from datatypes.purpose import Purpose, TourPurpose, SecDestPurpose
-from datatypes.person import Person
-from datatypes.tour import Tour
-from datatypes.demand import Demand
+from datatypes.purpose import (
+    Purpose, TourPurpose, SecDestPurpose, SEC_DEST_BLOCK_BYTES)
+from datatypes.population import ChoiceChanges, TourTable, simulate_tours
+from datatypes.demand import Demand, SecDestDemand
 import parameters.assignment as param
 import parameters.zone as zone_param
+from utils.precision import agent_processes, float_dtype
 
 
 class ModelSystem:
@@ -54,6 +55,8 @@ class ModelSystem:
     freight_matrices_path: Path (optional)
         Directory path where freight demand is found.
         If None, freight demand is taken from base matrices.
+    storage : StorageOptions (optional)
+        Compression and chunk layout for result matrices
     """
 
     def __init__(self,
@@ -65,7 +68,8 @@ class ModelSystem:
                  assignment_model: AssignmentModel,
                  submodel: str,
                  long_dist_matrices_path: Optional[Path] = None,
-                 freight_matrices_path: Optional[Path] = None):
+                 freight_matrices_path: Optional[Path] = None,
+                 storage: Optional[StorageOptions] = None):
         self.ass_model = cast(Union[MockAssignmentModel,EmmeAssignmentModel], assignment_model) #type checker hint
         self.zone_numbers: numpy.ndarray = self.ass_model.zone_numbers
 
@@ -89,7 +93,11 @@ class ModelSystem:
 
         # Output data
         self.resultdata = ResultsData(results_path)
-        self.resultmatrices = MatrixData(results_path / "Matrices" / submodel)
+        self.resultmatrices = MatrixData(
+            results_path / "Matrices" / submodel, storage)
+        self.checkpoints = IterationCheckpoint(
+            results_path / "checkpoints" / submodel,
+            param.performance_settings["checkpoints_kept"])
         parameters_path = Path(__file__).parent / "parameters" / "demand"
         home_based_work_purposes = []
         home_based_leisure_purposes = []
@@ -160,30 +168,101 @@ class ModelSystem:
             secondary destinations are calculated for all modes
         """
         log.info("Demand calculation started...")
-        for purpose in self.dm.tour_purposes:
-            if isinstance(purpose, SecDestPurpose):
-                purpose_impedance = purpose.calc_prob(
-                    previous_iter_impedance, is_last_iteration)
-                purpose.generate_tours()
-                if is_last_iteration:
-                    for mode in purpose.model.dest_choice_param:
-                        self._distribute_sec_dests(
-                            purpose, mode, purpose_impedance)
-                else:
-                    self._distribute_sec_dests(
-                        purpose, "car_leisure", purpose_impedance)
-            else:
-                if param.assignment_classes[purpose.name] == "leisure":
-                    for tp_imp in previous_iter_impedance.values():
-                        for imp in tp_imp.values():
-                            for mode in ("car_work", "transit_work"):
-                                imp.pop(mode, None)
-                for mode_demand in purpose.calc_demand(
-                        previous_iter_impedance, is_last_iteration):
-                    self.dtm.add_demand(mode_demand)
+        scheduler = PurposeScheduler(
+            nr_threads(),
+            param.performance_settings["demand_memory_gb"] * 2**30)
+        scheduler.run(self._purpose_tasks(
+            previous_iter_impedance, is_last_iteration))
         previous_iter_impedance.clear()
+        Purpose.day_impedance.clear()
         log.info("Demand calculation completed")
 
+    def _purpose_tasks(self, previous_iter_impedance,
+                       is_last_iteration) -> List[PurposeTask]:
+        """Create demand calculation tasks for tour purposes.
+
+        Purposes with origin in source purposes (including secondary
+        destinations) wait for their sources. Sources of the same
+        secondary-destination purpose are calculated one at a time
+        (in order), as they all add tours to it. Leisure purposes wait
+        for work purposes, as work-mode impedances are removed
+        before leisure demand is calculated.
+        """
+        purposes = self.dm.tour_purposes
+        index = {purpose.name: i for i, purpose in enumerate(purposes)}
+        work_purposes = set()
+        depends_on: List[Set[int]] = [set() for _ in purposes]
+        for i, purpose in enumerate(purposes):
+            sources = [index[source.name]
+                for source in getattr(purpose, "sources", [])]
+            depends_on[i].update(sources)
+            if isinstance(purpose, SecDestPurpose):
+                for prev, source in zip(sources, sources[1:]):
+                    depends_on[source].add(prev)
+            elif param.assignment_classes[purpose.name] == "leisure":
+                depends_on[i].update(work_purposes)
+            else:
+                work_purposes.add(i)
+        tasks = []
+        for i, purpose in enumerate(purposes):
+            if isinstance(purpose, SecDestPurpose):
+                tasks.append(PurposeTask(
+                    purpose.name,
+                    partial(self._add_sec_dest_demand, purpose,
+                            previous_iter_impedance, is_last_iteration),
+                    lambda _: None, frozenset(depends_on[i]),
+                    self._estimate_purpose_bytes(purpose),
+                    in_main_thread=True))
+            else:
+                is_leisure = (
+                    param.assignment_classes[purpose.name] == "leisure")
+                tasks.append(PurposeTask(
+                    purpose.name,
+                    partial(self._calc_purpose_demand, purpose,
+                            previous_iter_impedance, is_last_iteration),
+                    self._add_purpose_demand, frozenset(depends_on[i]),
+                    self._estimate_purpose_bytes(purpose),
+                    before=(partial(self._remove_work_impedance,
+                                    previous_iter_impedance)
+                            if is_leisure else None)))
+        return tasks
+
+    @staticmethod
+    def _estimate_purpose_bytes(purpose: Purpose) -> int:
+        # Impedance (time, cost, dist), utility, probability
+        # and demand matrices for each mode
+        nr_rows = purpose.bounds.stop - purpose.bounds.start
+        nr_cols = purpose.dest_interval.stop - purpose.dest_interval.start
+        nr_modes = len(getattr(purpose, "modes", [None]))
+        return 6 * nr_modes * nr_rows * nr_cols * float_dtype().itemsize
+
+    @staticmethod
+    def _remove_work_impedance(impedance):
+        for tp_imp in impedance.values():
+            for imp in tp_imp.values():
+                for mode in ("car_work", "transit_work"):
+                    imp.pop(mode, None)
+
+    @staticmethod
+    def _calc_purpose_demand(purpose: TourPurpose, impedance,
+                             is_last_iteration: bool) -> List[Demand]:
+        return list(purpose.calc_demand(impedance, is_last_iteration))
+
+    def _add_purpose_demand(self, demand: List[Demand]):
+        for mode_demand in demand:
+            self.dtm.add_demand(mode_demand)
+
+    def _add_sec_dest_demand(self, purpose: SecDestPurpose, impedance,
+                             is_last_iteration: bool):
+        purpose_impedance = purpose.calc_prob(impedance, is_last_iteration)
+        purpose.generate_tours()
+        if is_last_iteration:
+            for mode in purpose.model.dest_choice_param:
+                self._distribute_sec_dests(purpose, mode, purpose_impedance)
+        else:
+            self._distribute_sec_dests(
+                purpose, "car_leisure", purpose_impedance)
+
     def _add_external_demand(self,
                              long_dist_matrices: MatrixData,
                              long_dist_classes: Iterable[str]):
@@ -201,10 +280,42 @@ class ModelSystem:
                     car_matrices[ass_class] = demand.matrix
             log.info(f"Demand imported from {long_dist_matrices.path}")
         if car_matrices:
+            self.resultmatrices.write(
+                "demand", "vrk", zone_numbers, car_matrices, copy=False)
+
+    def _init_model_run(self, car_time_files: Optional[List[str]] = None):
+        # create attributes and background variables to network
+        self.ass_model.prepare_network(self.car_dist_cost, car_time_files)
+        self.dtm = dt.DirectDepartureTimeModel(self.ass_model)
+
+        self.ass_model.calc_transit_cost(self.transit_cost)
+        Purpose.distance = self.ass_model.beeline_dist
+        if not isinstance(self.ass_model, MockAssignmentModel):
             with self.resultmatrices.open(
-                    "demand", "vrk", zone_numbers, m='w') as mtx:
-                for ass_class in car_matrices:
-                    mtx[ass_class] = car_matrices[ass_class]
+                    "beeline", "", self.ass_model.zone_numbers, m="w") as mtx:
+                mtx["all"] = Purpose.distance
+
+        # Add beeline distance dummy
+        zd = self._zone_datas["domestic"]
+        idx = numpy.isin(self.zone_numbers, zd.zone_numbers)
+        zd["beeline"] = Purpose.distance[numpy.ix_(idx, idx)]
+
+    def _init_assignment(self, is_car_end_assignment: bool = False):
+        # Set up assignment periods and add external demand,
+        # needed before first assignment of a model run
+        for ap in self.ass_model.assignment_periods:
+            if not is_car_end_assignment:
+                ap.init_assign()
+        if self.long_dist_matrices is not None:
+            self.dtm.init_demand(param.long_dist_simple_classes)
+            self._add_external_demand(
+                self.long_dist_matrices, param.long_dist_simple_classes)
+        if self.freight_matrices is not None:
+            self.dtm.init_demand(param.truck_classes)
+            self._add_external_demand(
+                self.freight_matrices, param.truck_classes)
+        for ap in self.ass_model.assignment_periods:
+            ap.assign_trucks_init()
 
     # possibly merge with init
     def assign_base_demand(self, 
@@ -236,16 +347,7 @@ class ModelSystem:
             in `#car_time_xxx`. Overrides `use_free_flow_speeds`.
             List can be empty, if car times are already stored on network.
         """
-        # create attributes and background variables to network
-        self.ass_model.prepare_network(self.car_dist_cost, car_time_files)
-        self.dtm = dt.DirectDepartureTimeModel(self.ass_model)
-
-        self.ass_model.calc_transit_cost(self.transit_cost)
-        Purpose.distance = self.ass_model.beeline_dist
-        if not isinstance(self.ass_model, MockAssignmentModel):
-            with self.resultmatrices.open(
-                    "beeline", "", self.ass_model.zone_numbers, m="w") as mtx:
-                mtx["all"] = Purpose.distance
+        self._init_model_run(car_time_files)
         for ap in self.ass_model.assignment_periods:
             tp = ap.name
             log.info(f"Initializing assignment for period {tp}...")
@@ -258,21 +360,9 @@ class ModelSystem:
                         transport_classes=ap.assignment_modes) as mtx:
                     for ass_class in ap.assignment_modes:
                         self.dtm.demand[tp][ass_class] = mtx[ass_class]
-            if not is_car_end_assignment:
-                ap.init_assign()
-        if self.long_dist_matrices is not None:
-            self.dtm.init_demand(param.long_dist_simple_classes)
-            self._add_external_demand(
-                self.long_dist_matrices, param.long_dist_simple_classes)
-        if self.freight_matrices is not None:
-            self.dtm.init_demand(param.truck_classes)
-            self._add_external_demand(
-                self.freight_matrices, param.truck_classes)
+        self._init_assignment(is_car_end_assignment)
 
-        # Add beeline distance dummy
         zd = self._zone_datas["domestic"]
-        idx = numpy.isin(self.zone_numbers, zd.zone_numbers)
-        zd["beeline"] = Purpose.distance[numpy.ix_(idx, idx)]
 
         # Perform traffic assignment and get result impedance,
         # for each time period
@@ -280,7 +370,6 @@ class ModelSystem:
         for ap in self.ass_model.assignment_periods:
             tp = ap.name
             log.info(f"--- ASSIGNING PERIOD {tp.upper()} ---")
-            ap.assign_trucks_init()
             impedance[tp] = (ap.end_assign(not is_car_end_assignment)
                              if is_end_assignment
                              else ap.assign(self.travel_modes))
@@ -292,6 +381,7 @@ class ModelSystem:
             self.ass_model.aggregate_results(
                 self.resultdata, zd.aggregations.municipality_mapping)
             self._calculate_noise_areas()
+            self.resultmatrices.join()
             self.resultdata.flush()
         return impedance
 
@@ -314,6 +404,7 @@ class ModelSystem:
             secondary destinations are calculated for all modes,
             congested assignment is performed,
             and matrix and assignment results are printed.
+            After numbered iterations, model state is saved to checkpoint.
         Returns
         -------
         dict
@@ -386,9 +477,58 @@ class ModelSystem:
             self.ass_model.aggregate_results(
                 self.resultdata, zd.aggregations.municipality_mapping)
             self._calculate_noise_areas()
+            self.resultmatrices.join()
             self.resultdata.flush()
+        elif isinstance(iteration, int):
+            self._save_checkpoint(iteration, impedance)
         return impedance
 
+    def resume(self, iteration: int,
+               car_time_files: Optional[List[str]] = None
+            ) -> Dict[str, Dict[str, numpy.ndarray]]:
+        """Restore model state saved after iteration, instead of
+        assigning base demand.
+
+        Parameters
+        ----------
+        iteration : int
+            Number of iteration to resume from
+        car_time_files : list (optional)
+            See `assign_base_demand()`
+
+        Returns
+        -------
+        dict
+            key : str
+                Assignment class (car/transit/bike/walk)
+            value : dict
+                key : str
+                    Impedance type (time/cost/dist)
+                value : numpy.ndarray
+                    Impedance (float 2-d matrix)
+        """
+        self._init_model_run(car_time_files)
+        self._init_assignment()
+        impedance, demand, convergence, mode_share = self.checkpoints.load(
+            iteration)
+        for tp, tp_demand in demand.items():
+            for ass_class, mtx in tp_demand.items():
+                self.dtm.demand[tp][ass_class] = mtx
+        # Lists are updated in place, as they may be referenced in log
+        self.convergence[:] = convergence
+        self.mode_share[:] = mode_share
+        self.resultdata._df_buffer["demand_convergence.txt"] = pandas.DataFrame(
+            self.convergence)
+        log.info(f"Resuming model run from iteration {iteration}")
+        return impedance
+
+    def _save_checkpoint(self, iteration: int, impedance):
+        demand = {ap.name: {ass_class: self.dtm.demand[ap.name][ass_class]
+                for ass_class in ap.assignment_modes}
+            for ap in self.ass_model.assignment_periods}
+        self.checkpoints.save(
+            iteration, impedance, demand, self.convergence, self.mode_share)
+
     def _save_demand_to_omx(self, ap: AssignmentPeriod):
         zone_numbers = self.ass_model.zone_numbers
         tp = ap.name
@@ -396,24 +536,29 @@ class ModelSystem:
         transport_classes = (param.car_classes + param.long_dist_simple_classes
             if self.ass_model.use_free_flow_speeds
             else ap.assignment_modes)
-        with self.resultmatrices.open("demand", tp, zone_numbers, m='w') as mtx:
-            for ass_class in transport_classes:
-                demand = self.dtm.demand[tp][ass_class]
-                if (self.ass_model.use_free_flow_speeds
-                    and ass_class in param.intermodals):
-                    for intermodal in param.intermodals[ass_class]:
-                        demand += self.dtm.demand[tp][intermodal]
-                mtx[ass_class] = demand
-                demand_sum_string += "\t{:8.0f}".format(demand.sum())
+        matrices = {}
+        for ass_class in transport_classes:
+            demand = self.dtm.demand[tp][ass_class]
+            if (self.ass_model.use_free_flow_speeds
+                and ass_class in param.intermodals):
+                for intermodal in param.intermodals[ass_class]:
+                    demand += self.dtm.demand[tp][intermodal]
+            matrices[ass_class] = demand
+            demand_sum_string += "\t{:8.0f}".format(demand.sum())
+        # Demand matrices are fetched from assignment model,
+        # so the arrays can be handed off to writer without copying
+        self.resultmatrices.write(
+            "demand", tp, zone_numbers, matrices, copy=False)
         self.resultdata.print_line(demand_sum_string, "result_summary")
-        log.info("Saved demand matrices for " + str(tp))
+        log.info("Saving demand matrices for " + str(tp))
 
     def _save_to_omx(self, impedance, tp):
         zone_numbers = self.ass_model.zone_numbers
         for mtx_type in impedance:
-            with self.resultmatrices.open(mtx_type, tp, zone_numbers, m='w') as mtx:
-                for ass_class in impedance[mtx_type]:
-                    mtx[ass_class] = impedance[mtx_type][ass_class]
+            # Impedance dict is cleared after saving,
+            # so the arrays can be handed off to writer without copying
+            self.resultmatrices.write(
+                mtx_type, tp, zone_numbers, impedance[mtx_type], copy=False)
 
     def _calculate_noise_areas(self):
         if not self.ass_model.use_free_flow_speeds:
@@ -494,38 +639,43 @@ class ModelSystem:
         return tours, dists
 
     def _distribute_sec_dests(self, purpose, mode, impedance):
-        threads = []
-        demand = []
-        nr_threads = param.performance_settings["number_of_processors"]
-        if nr_threads == "max":
-            nr_threads = multiprocessing.cpu_count()
-        elif nr_threads <= 0:
-            nr_threads = 1
-        bounds = next(iter(purpose.sources)).bounds
-        for i in range(nr_threads):
-            # Take a range of origins, for which this thread
+        nr = nr_threads()
+        # Origin blocks are sized so that the pair matrices (impedances,
+        # utility, probability and demand) of all threads fit in budget,
+        # and one pair matrix stays small enough to be kept in cache
+        row_bytes = self.ass_model.nr_zones * float_dtype().itemsize
+        max_pairs = max(1, int(min(
+            param.performance_settings["demand_memory_gb"] * 2**30
+                / (8 * nr * row_bytes),
+            SEC_DEST_BLOCK_BYTES / row_bytes)))
+        blocks = purpose.origin_blocks(mode, max_pairs)
+        # All threads add to the same demand matrices,
+        # split in row stripes to let threads add concurrently
+        nr_zones = next(iter(impedance[mode].values())).shape[1]
+        demand = SecDestDemand(
+            purpose, mode, nr_zones, len(purpose.tours[mode]), 4 * nr)
+        with ThreadPoolExecutor(nr) as pool:
+            # Each thread takes a range of origin blocks, for which it
             # will calculate secondary destinations
-            origs = range(i, bounds.stop - bounds.start, nr_threads)
-            # Results will be saved in a temp dtm, to avoid memory clashes
-            dtm = dt.DepartureTimeModel(
-                self.ass_model.nr_zones, self.ass_model.time_periods, [mode])
-            demand.append(dtm)
-            thread = threading.Thread(
-                target=self._distribute_tours,
-                args=(dtm, purpose, mode, impedance, origs))
-            threads.append(thread)
-            thread.start()
-        for thread in threads:
-            thread.join()
-        for dtm in demand:
-            for tp in dtm.demand:
-                for ass_class in dtm.demand[tp]:
-                    self.dtm.demand[tp][ass_class] += dtm.demand[tp][ass_class]
-
-    def _distribute_tours(self, container, purpose, mode, impedance, origs):
-        for orig in origs:
-            demand = purpose.distribute_tours(mode, impedance[mode], orig)
-            container.add_demand(demand)
+            futures = [pool.submit(
+                    self._distribute_tours, demand, impedance[mode],
+                    blocks, range(i, len(blocks), nr))
+                for i in range(nr)]
+            for future in futures:
+                future.result()
+        purpose.attracted_tours[mode][purpose.bounds] += demand.matrix.sum(0)
+        self.dtm.add_sec_dest_demand(demand, nr)
+
+    def _distribute_tours(self, demand, impedance, blocks, block_nrs):
+        try:
+            for i in block_nrs:
+                demand.add_block(
+                    i, blocks[i], *demand.purpose.distribute_tour_block(
+                        demand.mode, impedance, blocks[i]))
+        except BaseException:
+            # Threads waiting for blocks from this thread are released
+            demand.cancel()
+            raise
 
 
 class AgentModelSystem(ModelSystem):
@@ -553,7 +703,10 @@ class AgentModelSystem(ModelSystem):
 
     def _init_demand_model(self, tour_purposes: List[TourPurpose]):
         log.info("Creating synthetic population")
-        random.seed(zone_param.population_draw)
+        self._previous_tours: Optional[TourTable] = None
+        tolerance = zone_param.agent_resimulation_tolerance
+        self._choice_changes = (None if tolerance is None
+                                else ChoiceChanges(tolerance))
         return DemandModel(
             self._zone_datas["domestic"], self.resultdata, tour_purposes,
             is_agent_model=True)
@@ -580,7 +733,6 @@ class AgentModelSystem(ModelSystem):
             secondary destinations are calculated for all modes
         """
         log.info("Demand calculation started...")
-        random.seed(None)
         self.dm.car_use_model.calc_basic_prob()
         for purpose in self.dm.tour_purposes:
             for mode_demand in purpose.calc_basic_prob(
@@ -588,31 +740,34 @@ class AgentModelSystem(ModelSystem):
                 # `demand` contains matrices only for non-agent purposes
                 self.dtm.add_demand(mode_demand)
         tour_probs = self.dm.generate_tour_probs()
+        persons = self.dm.persons
         log.info("Assigning mode and destination for {} agents ({} % of total population)".format(
-            len(self.dm.population), int(zone_param.agent_demand_fraction*100)))
-        purpose = self.dm.purpose_dict["hoo"]
-        sec_dest_tours = {mode: [defaultdict(list) for _ in purpose.orig_zone_numbers]
-            for mode in purpose.modes}
-        # Add keys for work-tour-related modes (e.g., "car_work"),
-        # which refer to the same demand containers as for leisure tours.
-        # They are all assigned as leisure trips.
-        work_tours = {mode.replace("leisure", "work"): sec_dest_tours[mode]
-                      for mode in sec_dest_tours}
-        sec_dest_tours.update(work_tours)
-        car_users = pandas.Series(
-            0, self.zone_numbers[self.dm.car_use_model.bounds])
-        for person in self.dm.population:
-            person.decide_car_use()
-            car_users[person.zone.number] += person.is_car_user
-            person.add_tours(self.dm.purpose_dict, tour_probs)
-            for tour in person.tours:
-                tour.choose_mode(person.is_car_user)
-                tour.choose_destination(sec_dest_tours)
+            len(persons), int(zone_param.agent_demand_fraction*100)))
+        was_car_user = persons.is_car_user
+        persons.decide_car_use(self.dm.car_use_model)
+        resimulate = None
+        if self._choice_changes is not None:
+            resimulate = self._choice_changes.select(
+                persons, self.dm.purpose_dict, tour_probs,
+                self._previous_tours, was_car_user)
+            log.info("Simulating {:.1f} % of agents".format(
+                100 * resimulate.mean() if len(persons) > 0 else 0))
+        tours = simulate_tours(
+            persons, self.dm.purpose_dict, tour_probs, agent_processes(),
+            self._previous_tours, resimulate)
+        if self._choice_changes is not None:
+            self._previous_tours = tours
         for purpose in self.dm.tour_purposes:
             try:
                 purpose.model.cumul_dest_prob.clear()
             except AttributeError:
                 pass
+        bounds = self.dm.car_use_model.bounds
+        car_users = pandas.Series(
+            numpy.bincount(
+                persons.zone[persons.is_car_user],
+                minlength=bounds.stop)[bounds],
+            self.zone_numbers[bounds])
         car_share = car_users / self.dm.zone_population
         car_share.name = "car_share"
         self.dm.car_use_model.print_results(car_share, self.dm.zone_population)
@@ -620,61 +775,30 @@ class AgentModelSystem(ModelSystem):
         purpose = self.dm.purpose_dict["hoo"]
         purpose_impedance = purpose.transform_impedance(
             previous_iter_impedance)
-        nr_threads = param.performance_settings["number_of_processors"]
-        if nr_threads == "max":
-            nr_threads = multiprocessing.cpu_count()
-        elif nr_threads <= 0:
-            nr_threads = 1
-        bounds = next(iter(purpose.sources)).bounds
         modes = purpose.modes if is_last_iteration else ["car_leisure"]
         for mode in modes:
-            threads = []
-            for i in range(nr_threads):
-                origs = range(i, bounds.stop - bounds.start, nr_threads)
-                thread = threading.Thread(
-                    target=self._distribute_tours,
-                    args=(
-                        mode, origs, sec_dest_tours[mode],
-                        purpose_impedance[mode]))
-                threads.append(thread)
-                thread.start()
-            for thread in threads:
-                thread.join()
+            tours.choose_secondary_destinations(
+                purpose, mode, purpose_impedance[mode])
+        tours.statistics.build()
         if is_last_iteration:
-            random.seed(zone_param.population_draw)
             self.dm.predict_income()
-            random.seed(None)
+            persons.calc_income(self.dm._income_models)
+            tours.calc_cost(previous_iter_impedance)
             fname0 = "agents"
             fname1 = "tours"
             # print person and tour attr to files
-            self.resultdata.print_line("\t".join(Person.attr), fname0)
-            self.resultdata.print_line("\t".join(Tour.attr), fname1)
-            for person in self.dm.population:
-                person.calc_income()
-                self.resultdata.print_line(str(person), fname0)
-                for tour in person.tours:
-                    tour.calc_cost(previous_iter_impedance)
-                    self.resultdata.print_line(str(tour), fname1)
+            fmt = zone_param.agent_output_format
+            persons.print_records(self.resultdata, fname0, fmt)
+            tours.print_records(self.resultdata, fname1, fmt)
             log.info("Results printed to files {} and {}".format(
                 fname0, fname1))
         previous_iter_impedance.clear()
+        Purpose.day_impedance.clear()
         dtm = dt.DepartureTimeModel(
             self.ass_model.nr_zones, self.ass_model.time_periods,
             self.travel_modes)
-        for person in self.dm.population:
-            for tour in person.tours:
-                dtm.add_demand(tour)
+        dtm.add_tours(tours)
         for tp in dtm.demand:
             for ass_class in dtm.demand[tp]:
                 self.dtm.demand[tp][ass_class] = dtm.demand[tp][ass_class]
         log.info("Demand calculation completed")
-
-    def _distribute_tours(self, mode, origs, sec_dest_tours, impedance):
-        sec_dest_purpose = self.dm.purpose_dict["hoo"]
-        for orig in origs:
-                dests = list(sec_dest_tours[orig])
-                probs = sec_dest_purpose.calc_sec_dest_prob(
-                    mode, impedance, orig, dests).cumsum(axis=0)
-                for j, dest in enumerate(dests):
-                    for tour in sec_dest_tours[orig][dest]:
-                        tour.choose_secondary_destination(probs[:, j])
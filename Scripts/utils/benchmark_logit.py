@@ -0,0 +1,173 @@
+"""Benchmark destination choice utility calculation with synthetic data.
+
+Compares the fused, row-blocked utility plan used in `LogitModel`
+with the previous calculation on full matrices (one temporary matrix
+per utility term), and checks that the results are identical.
+As the minimum of repeated runs is reported, the plan timing includes
+reuse of cached zone data terms, as in later demand model iterations.
+
+Run from Scripts folder:
+
+    python -m utils.benchmark_logit --zones 5000 --purpose hb_leisure
+"""
+from argparse import ArgumentParser
+from collections import defaultdict
+from pathlib import Path
+import json
+import time
+import numpy # type: ignore
+import pandas
+
+from datahandling.zonedata import ZoneData
+from models.logit import LogitModel
+from utils.benchmark_matrix_storage import synthetic_matrices
+from utils.precision import float_dtype
+
+
+class SyntheticValues(dict):
+    """Zone data values, created randomly when first requested."""
+
+    def __init__(self, zone_numbers: numpy.ndarray, seed: int = 0):
+        super().__init__()
+        self._zone_numbers = zone_numbers
+        self._rng = numpy.random.default_rng(seed)
+
+    def __missing__(self, key: str):
+        if '*' in key or key.startswith("beeline_"):
+            # Compound keys are handled in `ZoneData.get_data()`
+            raise KeyError(key)
+        val = pandas.Series(
+            self._rng.uniform(0, 1000, len(self._zone_numbers)),
+            self._zone_numbers, dtype=float_dtype())
+        self[key] = val
+        return val
+
+
+class SyntheticZoneData:
+    """Stand-in for `ZoneData`, with random values for all variables."""
+
+    get_data = ZoneData.get_data
+    revision = ZoneData.revision
+    __getitem__ = ZoneData.__getitem__
+
+    def __init__(self, zone_numbers: numpy.ndarray, beeline: numpy.ndarray):
+        self._values = SyntheticValues(zone_numbers)
+        self._revisions = defaultdict(int)
+        self._values["beeline"] = beeline
+
+
+class SyntheticPurpose:
+
+    def __init__(self, name: str, nr_zones: int, dist: numpy.ndarray):
+        self.name = name
+        self.bounds = slice(0, nr_zones)
+        self.dist = dist
+
+
+def reference_dest_util(model: LogitModel, mode: str,
+                        impedance: dict) -> numpy.ndarray:
+    """Destination utility calculated one full-matrix term at a time.
+
+    Frozen copy of destination utility calculation in `LogitModel`
+    before utility plans, independent of current model methods.
+    """
+    b = model.dest_choice_param[mode]
+    zone_data = model.zone_data
+    utility = numpy.zeros_like(next(iter(impedance.values())))
+
+    def add_zone_util(utility, b):
+        for i in b:
+            utility += b[i] * zone_data.get_data(i, model.bounds)
+        return utility
+
+    def add_impedance(utility, b):
+        for i in b:
+            utility += b[i] * impedance[i]
+        return utility
+
+    impedance["attraction_size"] = add_zone_util(
+        numpy.zeros_like(utility), b["attraction_size"])
+    add_zone_util(utility, b["attraction"])
+    add_impedance(utility, b["impedance"])
+    if "transform" in b:
+        b_transf = b["transform"]
+        transimp = numpy.zeros_like(utility)
+        add_zone_util(transimp, b_transf["attraction"])
+        add_impedance(transimp, b_transf["impedance"])
+        impedance["transform"] = transimp
+    for i in b["log"]:
+        imp = impedance[i] + 1 if b["log"][i] < 0 else impedance[i]
+        with numpy.errstate(divide="ignore"):
+            utility += b["log"][i] * numpy.log(imp)
+    exps = numpy.exp(utility)
+    dist = model.purpose.dist
+    if mode != "logsum" and dist.shape == exps.shape:
+        # If this is the lower level in nested model
+        l, u = model.distance_boundary[mode]
+        exps[(dist < l) | (dist >= u)] = 0
+    return exps
+
+
+def timed(func, repeat: int):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main(args):
+    parameters_path = (Path(__file__).parents[1] / "parameters" / "demand"
+                       / f"{args.purpose}.json")
+    parameters = json.loads(parameters_path.read_text("utf-8"))
+    matrices = synthetic_matrices(args.zones, 3)
+    dist, time_mtx, cost = (mtx.astype(float_dtype(), copy=False)
+                            for mtx in matrices.values())
+    zone_numbers = numpy.arange(1, args.zones + 1)
+    purpose = SyntheticPurpose(args.purpose, args.zones, dist)
+    model = LogitModel(
+        purpose, parameters, SyntheticZoneData(zone_numbers, dist), None)
+    print(f"{args.purpose}, {args.zones} zones, "
+          + f"{numpy.dtype(float_dtype()).name}")
+    print("\t".join(("mode", "reference_s", "plan_s", "speedup", "max_diff")))
+    for mode, b in model.dest_choice_param.items():
+        keys = (list(b["impedance"]) + list(b["log"])
+                + list(b.get("transform", {}).get("impedance", [])))
+        available = {"time": time_mtx, "cost": cost, "dist": dist,
+                     "logsum": time_mtx}
+        impedance = {key: available[key] for key in keys if key in available}
+        if not impedance:
+            impedance = {"dist": dist}
+        ref_time, expected = timed(
+            lambda: reference_dest_util(model, mode, dict(impedance)),
+            args.repeat)
+        plan_time, result = timed(
+            lambda: model._calc_dest_util(mode, dict(impedance)),
+            args.repeat)
+        finite = numpy.isfinite(expected)
+        diff = numpy.abs(result[finite] - expected[finite]).max(initial=0)
+        print("\t".join([
+            mode, f"{ref_time:.3f}", f"{plan_time:.3f}",
+            f"{ref_time / plan_time:.2f}", f"{diff:.3g}"]))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        epilog="Benchmark destination choice utility calculation.")
+    parser.add_argument(
+        "--zones",
+        type=int,
+        default=5000,
+        help="Number of zones in synthetic matrices")
+    parser.add_argument(
+        "--purpose",
+        type=str,
+        default="hb_leisure",
+        help="Name of demand model parameter file (without .json)")
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of repetitions (minimum time is reported)")
+    main(parser.parse_args())
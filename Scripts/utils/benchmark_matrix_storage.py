@@ -0,0 +1,141 @@
+"""Benchmark OMX storage options with synthetic matrices.
+
+Reports write time, full read time, row-block read time and bytes on disk
+for each combination of compression library, compression level
+and chunk shape.
+
+Run from Scripts folder:
+
+    python -m utils.benchmark_matrix_storage --zones 2000 --matrices 5
+"""
+from argparse import ArgumentParser
+from itertools import product
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import time
+import numpy # type: ignore
+
+from datahandling.matrixdata import MatrixData, StorageOptions
+
+
+def synthetic_matrices(nr_zones: int, nr_matrices: int, seed: int = 0):
+    """Create impedance-like matrices with spatial structure.
+
+    Parameters
+    ----------
+    nr_zones : int
+        Number of zones (rows and columns)
+    nr_matrices : int
+        Number of matrices to create
+
+    Returns
+    -------
+    dict
+        key : str
+            Matrix name
+        value : numpy.ndarray
+            Float32 matrix
+    """
+    rng = numpy.random.default_rng(seed)
+    coords = rng.uniform(0, 300, (nr_zones, 2))
+    dist = numpy.sqrt(
+        ((coords[:, numpy.newaxis, :] - coords[numpy.newaxis, :, :])**2)
+        .sum(axis=2)).astype(numpy.float32)
+    matrices = {}
+    for i in range(nr_matrices):
+        noise = rng.lognormal(0, 0.1, dist.shape).astype(numpy.float32)
+        matrices[f"mtx_{i}"] = (1 + i/10) * dist * noise
+    return matrices
+
+
+def benchmark(path: Path, storage: StorageOptions, zone_numbers: numpy.ndarray,
+              matrices: dict, block_rows: int):
+    matrix_data = MatrixData(path, storage)
+    start = time.perf_counter()
+    with matrix_data.open("bench", "", zone_numbers, m='w') as mtx:
+        for name, data in matrices.items():
+            mtx[name] = data
+    write_time = time.perf_counter() - start
+    file_size = (path / "bench_.omx").stat().st_size
+    start = time.perf_counter()
+    with matrix_data.open("bench", "", transport_classes=[]) as mtx:
+        for name in matrices:
+            mtx[name]
+    read_time = time.perf_counter() - start
+    matrix_data.close()
+    start = time.perf_counter()
+    with matrix_data.open("bench", "", transport_classes=[]) as mtx:
+        for name in matrices:
+            # Read one row block from the middle of the matrix
+            n = len(zone_numbers) // 2
+            mtx._file[name][n:n+block_rows, :]
+    block_time = time.perf_counter() - start
+    matrix_data.close()
+    return write_time, read_time, block_time, file_size
+
+
+def main(args):
+    zone_numbers = numpy.arange(1, args.zones + 1)
+    matrices = synthetic_matrices(args.zones, args.matrices)
+    raw_size = sum(mtx.nbytes for mtx in matrices.values())
+    print(f"{args.matrices} matrices of {args.zones} zones, "
+          + f"{raw_size / 1e6:.1f} MB uncompressed")
+    header = ("codec", "level", "chunk_rows", "write_s", "read_s",
+              "block_read_s", "MB", "ratio")
+    print("\t".join(header))
+    with TemporaryDirectory() as tmp_dir:
+        for codec, level, chunk_rows in product(
+                args.codecs, args.levels, args.chunk_rows):
+            if codec == "none" and level != args.levels[0]:
+                continue
+            storage = StorageOptions(
+                codec, level, None if chunk_rows == 0 else chunk_rows)
+            storage = storage.checked()
+            if storage.codec != codec:
+                continue
+            results = benchmark(
+                Path(tmp_dir), storage, zone_numbers, matrices,
+                args.block_rows)
+            write_time, read_time, block_time, file_size = results
+            print("\t".join([
+                codec, str(level), str(storage.chunk_rows or "auto"),
+                f"{write_time:.3f}", f"{read_time:.3f}", f"{block_time:.4f}",
+                f"{file_size / 1e6:.1f}", f"{raw_size / file_size:.2f}"]))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(epilog="Benchmark OMX compression and chunk layout.")
+    parser.add_argument(
+        "--zones",
+        type=int,
+        default=2000,
+        help="Number of zones in synthetic matrices")
+    parser.add_argument(
+        "--matrices",
+        type=int,
+        default=5,
+        help="Number of matrices per file")
+    parser.add_argument(
+        "--codecs",
+        type=str,
+        nargs="+",
+        default=["none", "zlib", "blosc:lz4", "blosc:zstd"],
+        help="Compression libraries to test")
+    parser.add_argument(
+        "--levels",
+        type=int,
+        nargs="+",
+        default=[1, 5],
+        help="Compression levels to test")
+    parser.add_argument(
+        "--chunk-rows",
+        type=int,
+        nargs="+",
+        default=[0, 1, 64],
+        help="Rows per chunk to test (0 means automatic)")
+    parser.add_argument(
+        "--block-rows",
+        type=int,
+        default=100,
+        help="Number of rows read in row-block read test")
+    main(parser.parse_args())
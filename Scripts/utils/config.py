@@ -88,8 +88,13 @@ def create_config(config: dict):
         "SEPARATE_EMME_SCENARIOS": False,
         "SAVE_EMME_MATRICES": False,
         "DEL_STRAT_FILES": False,
+        "STABLE_LOGSUM": False,
         "USE_FIXED_TRANSIT_COST": False,
         "DELETE_EXTRA_MATRICES": False,
+        "MATRIX_COMPRESSION": "zlib",
+        "MATRIX_COMPRESSION_LEVEL": 1,
+        "MATRIX_CHUNK_ROWS": None,
+        "RESUME_FROM": None,
         "SPECIFY_COMMODITY_NAMES": []
     })
     for key in config.pop("OPTIONAL_FLAGS"):
@@ -0,0 +1,67 @@
+from typing import Optional
+import numpy # type: ignore
+
+import parameters.assignment as param
+
+
+def float_dtype() -> numpy.dtype:
+    """Float type of demand model matrices and zone data vectors.
+
+    Set with "float_precision" in
+    `parameters.assignment.performance_settings` ("float32"/"float64").
+    """
+    return numpy.dtype(param.performance_settings["float_precision"])
+
+
+def demand_block_rows() -> Optional[int]:
+    """Number of origin rows in one block of demand probability calculation.
+
+    Set with "demand_block_rows" in
+    `parameters.assignment.performance_settings`.
+    If not set (None or 0), all origins are calculated at once.
+    """
+    return param.performance_settings.get("demand_block_rows") or None
+
+
+def stable_logsum() -> bool:
+    """Whether logit models use max-shifted log-sum-exp formulation.
+
+    Utilities are shifted by their maximum over alternatives before
+    exponentiation, so that exponentials and their sums do not overflow
+    or underflow in float32. Probabilities and logsums are the same as
+    without shifting, up to rounding error.
+    Set with "stable_logsum" in `parameters.assignment.performance_settings`.
+    """
+    return bool(param.performance_settings.get("stable_logsum", False))
+
+
+def impedance_cache_bytes() -> float:
+    """Memory budget (bytes) of cached day-averaged impedance matrices.
+
+    Set with "impedance_cache_gb" in
+    `parameters.assignment.performance_settings` (0 disables caching).
+    """
+    return param.performance_settings.get("impedance_cache_gb", 0) * 2**30
+
+
+def agent_processes() -> int:
+    """Number of worker processes in agent simulation.
+
+    Set with "agent_processes" in `parameters.assignment.performance_settings`.
+    Results do not depend on the number of processes.
+    """
+    return max(param.performance_settings.get("agent_processes", 1), 1)
+
+
+# Performance settings used only in demand model
+DEMAND_SETTINGS = (
+    "float_precision", "demand_memory_gb", "demand_block_rows",
+    "stable_logsum", "impedance_cache_gb", "agent_processes",
+    "checkpoints_kept",
+)
+
+
+def emme_performance_settings() -> dict:
+    """Performance settings to be passed to Emme specifications."""
+    return {key: val for key, val in param.performance_settings.items()
+            if key not in DEMAND_SETTINGS}
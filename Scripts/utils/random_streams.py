@@ -0,0 +1,138 @@
+from typing import Optional
+import numpy # type: ignore
+
+
+# Philox-4x32 round multipliers and key increments (Salmon et al. 2011)
+_M0 = numpy.uint64(0xD2511F53)
+_M1 = numpy.uint64(0xCD9E8D57)
+_W0 = numpy.uint32(0x9E3779B9)
+_W1 = numpy.uint32(0xBB67AE85)
+_LO = numpy.uint64(0xFFFFFFFF)
+_32 = numpy.uint64(32)
+
+
+def philox4x32(counter, key, rounds: int = 10):
+    """Philox-4x32 counter-based random number generator.
+
+    Parameters
+    ----------
+    counter : tuple of numpy.ndarray
+        Four arrays (of same shape) of 32-bit counter words
+    key : tuple of int
+        Two 32-bit key words
+    rounds : int (optional)
+        Number of rounds
+
+    Returns
+    -------
+    list of numpy.ndarray
+        Four arrays of random 32-bit words
+    """
+    c0, c1, c2, c3 = (numpy.asarray(c, numpy.uint32) for c in counter)
+    k0, k1 = numpy.uint32(key[0]), numpy.uint32(key[1])
+    with numpy.errstate(over="ignore"):
+        for i in range(rounds):
+            if i > 0:
+                k0 += _W0
+                k1 += _W1
+            p0 = _M0 * c0.astype(numpy.uint64)
+            p1 = _M1 * c2.astype(numpy.uint64)
+            c0, c1, c2, c3 = (
+                (p1 >> _32).astype(numpy.uint32) ^ c1 ^ k0,
+                (p1 & _LO).astype(numpy.uint32),
+                (p0 >> _32).astype(numpy.uint32) ^ c3 ^ k1,
+                (p0 & _LO).astype(numpy.uint32))
+    return [c0, c1, c2, c3]
+
+
+class RandomStreams:
+    """Counter-based random streams for agent simulation.
+
+    Each draw is a pure function of the seed, the stream id
+    (e.g., person or tour), the draw purpose and the draw index,
+    so results do not depend on the order in which agents are
+    simulated, or on how they are partitioned between processes.
+
+    Parameters
+    ----------
+    seed : int (optional)
+        Seed number (e.g., `parameters.zone.population_draw`).
+        If None, a random seed is chosen.
+    """
+    # Draw purposes
+    AGE_GROUP = 1
+    AGE = 2
+    SEX = 3
+    CAR_USE = 4
+    TOUR_COMBINATION = 5
+    INCOME = 6
+    MODE = 7
+    DEST = 8
+    SEC_DEST_GEN = 9
+    SEC_DEST = 10
+    NON_HOME = 11
+
+    def __init__(self, seed: Optional[int] = None):
+        if seed is None:
+            seed = numpy.random.SeedSequence().entropy
+        self.seed = int(seed) % 2**64
+        self._key = (self.seed & 0xFFFFFFFF, self.seed >> 32)
+
+    def _words(self,
+               ids: numpy.ndarray,
+               purpose: int,
+               sub_ids: Optional[numpy.ndarray] = None,
+               size: int = 1):
+        ids = numpy.asarray(ids, numpy.uint64)[:, numpy.newaxis]
+        if sub_ids is None:
+            sub_ids = numpy.zeros(len(ids), numpy.uint32)
+        sub_ids = numpy.asarray(sub_ids, numpy.uint32)[:, numpy.newaxis]
+        index = numpy.arange(size, dtype=numpy.uint32)
+        return philox4x32(
+            ((ids & _LO).astype(numpy.uint32),
+             (ids >> _32).astype(numpy.uint32),
+             sub_ids + numpy.zeros_like(index),
+             (numpy.uint32(purpose) << numpy.uint32(16)) + index),
+            self._key)
+
+    def random(self,
+               purpose: int,
+               ids: numpy.ndarray,
+               sub_ids: Optional[numpy.ndarray] = None,
+               size: Optional[int] = None) -> numpy.ndarray:
+        """Uniform draws in open interval (0, 1).
+
+        Parameters
+        ----------
+        purpose : int
+            Draw purpose (e.g., `RandomStreams.MODE`)
+        ids : numpy.ndarray
+            Stream ids (64-bit), one draw (or row of draws) for each
+        sub_ids : numpy.ndarray (optional)
+            Secondary ids (32-bit), e.g., tour within person
+        size : int (optional)
+            Number of draws for each id, if row of draws is wanted
+
+        Returns
+        -------
+        numpy.ndarray
+            Draws (len(ids) or len(ids) x size)
+        """
+        c0, c1, _, _ = self._words(ids, purpose, sub_ids, size or 1)
+        # 53-bit mantissa from two 32-bit words, shifted off zero
+        draws = ((c0 >> numpy.uint32(5)).astype(float) * 67108864.0
+                 + (c1 >> numpy.uint32(6)) + 0.5) / 9007199254740992.0
+        return draws if size is not None else draws[:, 0]
+
+    def gumbel(self, purpose: int, ids: numpy.ndarray,
+               sub_ids: Optional[numpy.ndarray] = None,
+               size: Optional[int] = None) -> numpy.ndarray:
+        """Standard Gumbel draws (see `random()`)."""
+        return -numpy.log(-numpy.log(self.random(purpose, ids, sub_ids, size)))
+
+    def normal(self, purpose: int, ids: numpy.ndarray,
+               sub_ids: Optional[numpy.ndarray] = None) -> numpy.ndarray:
+        """Standard normal draws (see `random()`), with Box-Muller."""
+        u = self.random(purpose, ids, sub_ids, 2)
+        return (numpy.sqrt(-2 * numpy.log(u[:, 0]))
+                * numpy.cos(2 * numpy.pi * u[:, 1]))
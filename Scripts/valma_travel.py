@@ -9,13 +9,16 @@ from assignment.emme_assignment import EmmeAssignmentModel
 from assignment.mock_assignment import MockAssignmentModel
 from assignment.assignment_period import AssignmentPeriod
 from travel_iteration import ModelSystem, AgentModelSystem
-from datahandling.matrixdata import MatrixData
+from datahandling.matrixdata import MatrixData, StorageOptions
+import parameters.assignment as param
 
 
 BASE_ZONEDATA_FILE = "2016_zonedata.gpkg"
 
 
 def main(args):
+    if args.stable_logsum:
+        param.performance_settings["stable_logsum"] = True
     calculate_long_dist_demand = args.long_dist_demand_forecast == "calc"
     long_dist_matrices_path = (None
         if args.long_dist_demand_forecast in ("calc", "base")
@@ -36,6 +39,9 @@ def main(args):
     forecast_zonedata_path = Path(args.forecast_data_path)
     cost_data_path = Path(args.cost_data_path)
     results_path = Path(args.results_path, args.scenario_name)
+    storage = StorageOptions(
+        args.matrix_compression, args.matrix_compression_level,
+        args.matrix_chunk_rows)
     emme_project_path = Path(args.emme_path)
     log_extra = {
         "status": {
@@ -78,7 +84,8 @@ def main(args):
             raise NameError(
                 "Mock Results directory {} does not exist.".format(
                     mock_result_path))
-        ass_model = MockAssignmentModel(MatrixData(mock_result_path), **kwargs)
+        ass_model = MockAssignmentModel(
+            MatrixData(mock_result_path, storage), **kwargs)
     else:
         if not emme_project_path.is_file():
             raise NameError(
@@ -102,8 +109,9 @@ def main(args):
     model_args = (forecast_zonedata_path, cost_data_path, base_zonedata_path,
                   base_matrices_path, results_path, ass_model, args.submodel,
                   long_dist_matrices_path, freight_matrices_path)
-    model = (AgentModelSystem(*model_args) if args.is_agent_model
-             else ModelSystem(*model_args))
+    model = (AgentModelSystem(*model_args, storage=storage)
+             if args.is_agent_model
+             else ModelSystem(*model_args, storage=storage))
     log_extra["status"]["results"] = model.mode_share
 
     # Run traffic assignment simulation for N iterations,
@@ -119,10 +127,23 @@ def main(args):
             stored_speed_assignment.append(results_path)
     except TypeError:
         pass
-    impedance = model.assign_base_demand(
-        iterations==0, args.car_end_assignment_only, stored_speed_assignment)
+    if args.resume_from is None:
+        impedance = model.assign_base_demand(
+            iterations==0, args.car_end_assignment_only, stored_speed_assignment)
+        i = 1
+    elif 0 < args.resume_from < iterations:
+        impedance = model.resume(args.resume_from, stored_speed_assignment)
+        log_extra["status"]["completed"] = args.resume_from
+        i = args.resume_from + 1
+        gap = model.convergence[-1]
+        if gap["max_gap"] < args.max_gap or gap["rel_gap"] < args.rel_gap:
+            iterations = i
+            log_extra["status"]["converged"] = 1
+    else:
+        raise ArgumentTypeError(
+            "Cannot resume from iteration {} with {} iterations".format(
+                args.resume_from, iterations))
     log_extra["status"]["state"] = "running"
-    i = 1
     while i <= iterations:
         log_extra["status"]["current"] = i
         try:
@@ -150,6 +171,10 @@ def main(args):
     
     if not log_extra["status"]["converged"]: log.warn("Model has not converged")
 
+    MatrixData.join()
+    if args.do_not_use_emme:
+        ass_model.matrices.close()
+
     # delete emme matrices
     if not args.save_matrices and not args.do_not_use_emme:
         matrix_ids = [mtx.id for mtx
@@ -253,6 +278,11 @@ if __name__ == "__main__":
         action="store_true",
         help="Using this flag deletes strategy files from Emme-project Database folder.",
     )
+    parser.add_argument(
+        "--stable-logsum",
+        action="store_true",
+        help="Using this flag shifts logit model utilities by their maximum before exponentiation (numerically safe with float32).",
+    )
     parser.add_argument(
         "--scenario-name",
         type=str,
@@ -310,6 +340,22 @@ if __name__ == "__main__":
         "--delete-extra-matrices",
         action="store_true",
         help="Using this flag means that only matrices needed in demand calculation will be stored.")
+    parser.add_argument(
+        "--resume-from",
+        type=int,
+        help="Restore model state saved after given iteration and continue from next iteration."),
+    parser.add_argument(
+        "--matrix-compression",
+        type=str,
+        help="Compression library for result matrices (zlib/blosc:lz4/none/...)."),
+    parser.add_argument(
+        "--matrix-compression-level",
+        type=int,
+        help="Compression level (0-9) for result matrices."),
+    parser.add_argument(
+        "--matrix-chunk-rows",
+        type=int,
+        help="Number of matrix rows per HDF5 chunk in result matrices (default: automatic)."),
     parser.set_defaults(
         **{key.lower(): val for key, val in config.items()})
     args = parser.parse_args()